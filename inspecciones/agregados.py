@@ -0,0 +1,94 @@
+"""Contadores desnormalizados de cada inspeccion: preguntas respondidas y totales, avance, criticidad total y maxima.
+Se calculan en la misma transaccion en que se escriben las respuestas a partir del arbol que ya esta en memoria, asi
+las listas y el tablero los leen de la inspeccion sin recorrer las respuestas"""
+from django.db.models import Count, Exists, Max, OuterRef, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inspecciones.carga_masiva import TAMANO_LOTE, consultas_del_arbol
+from inspecciones.models import Inspeccion, Pregunta, Respuesta
+
+# las respuestas que corresponden a una pregunta a responder, de primer nivel o filas de una cuadricula
+_TIPOS_DE_PREGUNTA = [Respuesta.TiposDeRespuesta.seleccion_unica, Respuesta.TiposDeRespuesta.numerica,
+                      Respuesta.TiposDeRespuesta.seleccion_multiple]
+
+CAMPOS_AGREGADOS = ['preguntas_respondidas', 'total_preguntas', 'avance', 'criticidad_calculada',
+                    'criticidad_calculada_con_reparaciones', 'criticidad_maxima']
+
+
+def total_de_preguntas(cuestionario_id):
+    """Las cuadriculas no se responden, sus filas si"""
+    return consultas_del_arbol(cuestionario_id)[Pregunta].exclude(
+        tipo_de_pregunta=Pregunta.TiposDePregunta.cuadricula).count()
+
+
+def _agregados(respondidas, total_preguntas, criticidad, criticidad_con_reparaciones, criticidad_maxima):
+    return {'preguntas_respondidas': respondidas, 'total_preguntas': total_preguntas,
+            'avance': min(respondidas / total_preguntas, 1.0) if total_preguntas else 0.0,
+            'criticidad_calculada': criticidad, 'criticidad_calculada_con_reparaciones': criticidad_con_reparaciones,
+            'criticidad_maxima': criticidad_maxima}
+
+
+def agregados_de_respuestas(respuestas, total_preguntas):
+    """Los contadores de una inspeccion a partir de todo su arbol de [respuestas]. La criticidad de la inspeccion
+    es la suma de las de primer nivel y la maxima es la de la pregunta mas critica"""
+    con_partes = {respuesta.respuesta_multiple_id for respuesta in respuestas}
+    preguntas = [respuesta for respuesta in respuestas if respuesta.tipo_de_respuesta in _TIPOS_DE_PREGUNTA]
+    raices = [respuesta for respuesta in respuestas if respuesta.inspeccion_id is not None]
+    respondidas = sum(1 for respuesta in preguntas if (
+            respuesta.opcion_seleccionada_id is not None or respuesta.valor_numerico is not None
+            or respuesta.id in con_partes))
+    return _agregados(respondidas, total_preguntas,
+                      sum(respuesta.criticidad_calculada for respuesta in raices),
+                      sum(respuesta.criticidad_calculada_con_reparaciones for respuesta in raices),
+                      max((respuesta.criticidad_calculada for respuesta in preguntas), default=0))
+
+
+def actualizar_agregados(inspeccion, respuestas):
+    """Debe ejecutarse en la transaccion que escribio [respuestas], el arbol completo de [inspeccion]"""
+    agregados = agregados_de_respuestas(respuestas, total_de_preguntas(inspeccion.cuestionario_id))
+    Inspeccion.objects.filter(pk=inspeccion.pk).update(**agregados)
+    for campo, valor in agregados.items():
+        setattr(inspeccion, campo, valor)
+
+
+def recalcular_agregados(inspecciones, al_avanzar=None):
+    """Recalcula desde la base de datos los contadores de [inspecciones] (queryset) con una consulta agrupada por
+    lote, para las respuestas que no se escribieron por la API. Retorna cuantas inspecciones se actualizaron.
+    [al_avanzar] recibe la fraccion procesada despues de cada lote"""
+    inspecciones = list(inspecciones.order_by('pk').values_list('pk', 'cuestionario'))
+    totales = dict(Pregunta.objects.exclude(tipo_de_pregunta=Pregunta.TiposDePregunta.cuadricula).annotate(
+        id_cuestionario=Coalesce('bloque__cuestionario', 'cuadricula__bloque__cuestionario')).filter(
+        id_cuestionario__in={cuestionario for _, cuestionario in inspecciones}).values(
+        'id_cuestionario').annotate(total=Count('id')).values_list('id_cuestionario', 'total'))
+
+    respondida = Q(tipo_de_respuesta=Respuesta.TiposDeRespuesta.seleccion_unica, opcion_seleccionada__isnull=False) | \
+        Q(tipo_de_respuesta=Respuesta.TiposDeRespuesta.numerica, valor_numerico__isnull=False) | \
+        Q(Exists(Respuesta.objects.filter(respuesta_multiple=OuterRef('pk'))),
+          tipo_de_respuesta=Respuesta.TiposDeRespuesta.seleccion_multiple)
+    de_pregunta = Q(tipo_de_respuesta__in=_TIPOS_DE_PREGUNTA)
+    raiz = Q(inspeccion__isnull=False)
+    actualizadas = 0
+    for inicio in range(0, len(inspecciones), TAMANO_LOTE):
+        lote = dict(inspecciones[inicio:inicio + TAMANO_LOTE])
+        # las partes de seleccion multiple no cuentan, el resto pertenece a la inspeccion o a una cuadricula de ella
+        filas = Respuesta.objects.filter(tipo_de_respuesta__in=[*_TIPOS_DE_PREGUNTA,
+                                                                Respuesta.TiposDeRespuesta.cuadricula]).annotate(
+            id_inspeccion=Coalesce('inspeccion', 'respuesta_cuadricula__inspeccion')).filter(
+            id_inspeccion__in=lote).values('id_inspeccion').annotate(
+            respondidas=Count('id', filter=de_pregunta & respondida),
+            criticidad=Sum('criticidad_calculada', filter=raiz),
+            criticidad_con_reparaciones=Sum('criticidad_calculada_con_reparaciones', filter=raiz),
+            criticidad_maxima=Max('criticidad_calculada', filter=de_pregunta))
+        por_inspeccion = {fila['id_inspeccion']: fila for fila in filas}
+        cambiadas = []
+        for id_inspeccion, cuestionario in lote.items():
+            fila = por_inspeccion.get(id_inspeccion, {})
+            cambiadas.append(Inspeccion(id=id_inspeccion, momento_modificacion=timezone.now(), **_agregados(
+                fila.get('respondidas', 0), totales.get(cuestionario, 0), fila.get('criticidad') or 0,
+                fila.get('criticidad_con_reparaciones') or 0, fila.get('criticidad_maxima') or 0)))
+        Inspeccion.objects.bulk_update(cambiadas, [*CAMPOS_AGREGADOS, 'momento_modificacion'], batch_size=TAMANO_LOTE)
+        actualizadas += len(cambiadas)
+        if al_avanzar is not None:
+            al_avanzar(actualizadas / len(inspecciones))
+    return actualizadas
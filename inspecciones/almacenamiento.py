@@ -0,0 +1,84 @@
+"""Almacenamiento de las fotos por contenido. Cada archivo se guarda una sola vez con el nombre de su hash sha256,
+subir el mismo contenido otra vez no escribe nada y solo suma una referencia. Las referencias se cuentan en la tabla
+ReferenciaDeArchivo y el archivo se borra cuando se elimina la ultima. Las filas de fotos que se borran sin pasar por
+aqui, como en cascada, dejan la cuenta alta y sus archivos los borra el recolector de inspecciones.recoleccion"""
+import hashlib
+import os
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+TAMANO_BLOQUE_HASH = 64 * 1024
+
+
+def hash_de_archivo(archivo):
+    """sha256 del contenido de [archivo] leido por bloques, deja el archivo al inicio"""
+    digest = hashlib.sha256()
+    archivo.seek(0)
+    for bloque in archivo.chunks(TAMANO_BLOQUE_HASH):
+        digest.update(bloque)
+    archivo.seek(0)
+    return digest.hexdigest()
+
+
+def _referencias():
+    # models importa este modulo para declarar los campos
+    return apps.get_model('inspecciones', 'ReferenciaDeArchivo').objects
+
+
+class AlmacenamientoPorContenido(FileSystemStorage):
+    def nombre_por_contenido(self, name, content):
+        """Conserva la carpeta y la extension de [name], el nombre es el hash y lo antecede una subcarpeta con sus
+        dos primeros caracteres para no llenar una sola carpeta"""
+        directorio, nombre = os.path.split(name)
+        digest = hash_de_archivo(content)
+        return os.path.join(directorio, digest[:2], digest + os.path.splitext(nombre)[1].lower())
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        nombre = self.nombre_por_contenido(name, content)
+        if not self.exists(nombre):
+            # si otro proceso lo escribe al mismo tiempo el almacenamiento base elige otro nombre, solo se duplica
+            nombre = self._save(nombre, content)
+        self.referenciar(nombre)
+        return nombre
+
+    def referenciar(self, name):
+        """Suma una referencia a un archivo ya guardado, para compartirlo sin volver a escribirlo. Actualiza la fecha
+        de modificacion para que el recolector no lo borre mientras se guarda la foto que lo usa"""
+        if self.exists(name):
+            os.utime(self.path(name))
+        with transaction.atomic():
+            _, creada = _referencias().select_for_update().get_or_create(nombre=name, defaults={'referencias': 1})
+            if not creada:
+                _referencias().filter(nombre=name).update(referencias=F('referencias') + 1)
+
+    def delete(self, name):
+        """Resta una referencia y borra el archivo con la ultima. Los archivos guardados antes de contar
+        referencias no tienen fila y se borran directamente"""
+        with transaction.atomic():
+            referencia = _referencias().select_for_update().filter(nombre=name).first()
+            if referencia is not None and referencia.referencias > 1:
+                _referencias().filter(nombre=name).update(referencias=F('referencias') - 1)
+                return
+            if referencia is not None:
+                referencia.delete()
+            # si la transaccion se revierte el archivo debe seguir existiendo
+            transaction.on_commit(lambda: super(AlmacenamientoPorContenido, self).delete(name))
+
+    def borrar_sin_referencias(self, name):
+        """Borra el archivo sin contar referencias, el recolector ya verifico que ninguna foto lo usa"""
+        super().delete(name)
+
+
+almacenamiento_por_contenido = AlmacenamientoPorContenido()
+
+
+def almacenamiento_de_fotos():
+    return almacenamiento_por_contenido
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class InspeccionesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inspecciones'
+
+    def ready(self):
+        from inspecciones import signals, tareas  # noqa: F401
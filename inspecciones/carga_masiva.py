@@ -0,0 +1,551 @@
+"""Escritura de arboles completos con un bulk_create por tabla en lugar de una insercion por fila."""
+import uuid
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from inspecciones.models import Bloque, Titulo, Pregunta, OpcionDeRespuesta, CriticidadNumerica, EtiquetaDePregunta, \
+    FotoCuestionario, Respuesta, FotoRespuesta, Activo, EtiquetaDeActivo
+
+# cantidad maxima de filas por sentencia, el backend puede reducirla si excede su limite de parametros
+TAMANO_LOTE = 500
+
+# cantidad de pares (clave, valor) que se buscan en cada consulta, cada par usa 2 parametros
+_PARES_POR_CONSULTA = 400
+
+
+def resolver_etiquetas(modelo, etiquetas_data):
+    """Retorna un diccionario (clave, valor) -> etiqueta de [modelo] con todas las etiquetas de [etiquetas_data],
+    buscando las existentes con una consulta y creando las que faltan con un solo bulk_create"""
+    pares = list({(etiqueta['clave'], etiqueta['valor']) for etiqueta in etiquetas_data})
+    etiquetas = {}
+    for i in range(0, len(pares), _PARES_POR_CONSULTA):
+        filtro = Q()
+        for clave, valor in pares[i:i + _PARES_POR_CONSULTA]:
+            filtro |= Q(clave=clave, valor=valor)
+        etiquetas.update({(e.clave, e.valor): e for e in modelo.objects.filter(filtro)})
+
+    faltantes = [modelo(clave=clave, valor=valor) for clave, valor in pares if (clave, valor) not in etiquetas]
+    if faltantes:
+        creadas = modelo.objects.bulk_create(faltantes, batch_size=TAMANO_LOTE)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # el backend no devuelve los ids generados, toca volver a consultarlos
+            return resolver_etiquetas(modelo, etiquetas_data)
+        etiquetas.update({(e.clave, e.valor): e for e in creadas})
+    return etiquetas
+
+
+def campos_cambiados(existente, entrante):
+    """Nombres de las columnas (sin la llave primaria) en que difieren dos instancias del mismo modelo"""
+    return [campo.attname for campo in existente._meta.concrete_fields
+            if not campo.primary_key and getattr(existente, campo.attname) != getattr(entrante, campo.attname)]
+
+
+# el campo que asocia cada tipo de foto, null mientras no esta asociada
+_ASOCIACION_DE_FOTOS = {FotoRespuesta: 'respuesta', FotoCuestionario: 'object_id'}
+
+
+def verificar_fotos_libres(Modelo, ids, organizacion_id):
+    """Lanza ValidationError si alguna de las fotos [ids] ya esta asociada o la subio otra organizacion, asi una
+    peticion no se puede apropiar de las fotos de otra inspeccion o cuestionario. Las subidas antes de registrar la
+    organizacion no tienen una"""
+    if not ids:
+        return
+    libres = Q(**{f'{_ASOCIACION_DE_FOTOS[Modelo]}__isnull': True}) & \
+        (Q(organizacion=organizacion_id) | Q(organizacion__isnull=True))
+    ajenas = sorted(str(pk) for pk in Modelo.objects.filter(pk__in=ids).exclude(libres).values_list('pk', flat=True))
+    if ajenas:
+        raise ValidationError({'fotos': [f'Las fotos {", ".join(ajenas)} ya estan asociadas a otro objeto']})
+
+
+def consultas_del_arbol(cuestionario):
+    """Un queryset por cada tabla del arbol de [cuestionario], en el orden en que se deben insertar"""
+    preguntas = Q(bloque__cuestionario=cuestionario) | Q(cuadricula__bloque__cuestionario=cuestionario)
+    de_preguntas = Q(pregunta__bloque__cuestionario=cuestionario) | \
+        Q(pregunta__cuadricula__bloque__cuestionario=cuestionario)
+    return {
+        Bloque: Bloque.objects.filter(cuestionario=cuestionario),
+        Titulo: Titulo.objects.filter(bloque__cuestionario=cuestionario),
+        Pregunta: Pregunta.objects.filter(preguntas),
+        OpcionDeRespuesta: OpcionDeRespuesta.objects.filter(de_preguntas),
+        CriticidadNumerica: CriticidadNumerica.objects.filter(de_preguntas),
+    }
+
+
+class PlanCuestionario:
+    """Recorre una sola vez los [bloques_data] validados por el CuestionarioCompletoSerializer, asigna los ids que
+    faltan y acumula las filas de cada tabla para insertarlas con un bulk_create por modelo en [ejecutar]"""
+
+    def __init__(self, cuestionario, bloques_data):
+        self.cuestionario = cuestionario
+        self.bloques = []
+        self.titulos = []
+        self.preguntas = []
+        self.opciones_de_respuesta = []
+        self.criticidades_numericas = []
+        # (id de la pregunta, {'clave':..., 'valor':...})
+        self.etiquetas = []
+        # (foto, objeto al que se asocia)
+        self.fotos = []
+        for bloque_data in bloques_data:
+            self._planear_bloque(bloque_data)
+
+    def ejecutar(self):
+        """Debe ejecutarse dentro de una transaccion"""
+        Bloque.objects.bulk_create(self.bloques, batch_size=TAMANO_LOTE)
+        Titulo.objects.bulk_create(self.titulos, batch_size=TAMANO_LOTE)
+        # las preguntas padre quedan antes que las de su cuadricula porque se planean primero
+        Pregunta.objects.bulk_create(self.preguntas, batch_size=TAMANO_LOTE)
+        OpcionDeRespuesta.objects.bulk_create(self.opciones_de_respuesta, batch_size=TAMANO_LOTE)
+        CriticidadNumerica.objects.bulk_create(self.criticidades_numericas, batch_size=TAMANO_LOTE)
+        self._crear_etiquetas()
+        self._asociar_fotos()
+
+    def _planear_bloque(self, bloque_data):
+        bloque_data = dict(bloque_data)
+        titulo_data = bloque_data.pop('titulo', None)
+        pregunta_data = bloque_data.pop('pregunta', None)
+
+        # el id del bloque lo asigna el default del modelo al instanciarlo, salvo que ya exista
+        bloque = Bloque(cuestionario=self.cuestionario, **bloque_data)
+        id_existente = self._id_bloque_existente(titulo_data, pregunta_data)
+        if id_existente is not None:
+            bloque.id = id_existente
+        self.bloques.append(bloque)
+        if titulo_data is not None:
+            self._planear_titulo(bloque, titulo_data)
+        if pregunta_data is not None:
+            self._planear_pregunta(pregunta_data, bloque=bloque)
+        # TODO: validar que venga o un titulo o una pregunta o una cuadricula
+
+    def _id_bloque_existente(self, titulo_data, pregunta_data):
+        return None
+
+    def _planear_titulo(self, bloque, titulo_data):
+        titulo_data = dict(titulo_data)
+        fotos_data = titulo_data.pop('fotos', [])
+        titulo = Titulo(bloque=bloque, **titulo_data)
+        self.titulos.append(titulo)
+        self.fotos.extend((foto, titulo) for foto in fotos_data)
+
+    def _planear_pregunta(self, pregunta_data, bloque=None, cuadricula=None):
+        pregunta_data = dict(pregunta_data)
+        fotos_data = pregunta_data.pop('fotos_guia', [])
+        etiquetas_data = pregunta_data.pop('etiquetas', [])
+        opciones_de_respuesta_data = pregunta_data.pop('opciones_de_respuesta', [])
+        criticidades_numericas_data = pregunta_data.pop('criticidades_numericas', [])
+        preguntas_data = pregunta_data.pop('preguntas', [])
+
+        pregunta = Pregunta(bloque=bloque, cuadricula=cuadricula, **pregunta_data)
+        self.preguntas.append(pregunta)
+        self.fotos.extend((foto, pregunta) for foto in fotos_data)
+        self.etiquetas.extend((pregunta.id, etiqueta_data) for etiqueta_data in etiquetas_data)
+        self.opciones_de_respuesta.extend(OpcionDeRespuesta(pregunta=pregunta, **opcion_data)
+                                          for opcion_data in opciones_de_respuesta_data)
+        self.criticidades_numericas.extend(CriticidadNumerica(pregunta=pregunta, **criticidad_data)
+                                           for criticidad_data in criticidades_numericas_data)
+        for subpregunta_data in preguntas_data:
+            self._planear_pregunta(subpregunta_data, cuadricula=pregunta)
+
+    def _crear_etiquetas(self):
+        PreguntaEtiqueta = Pregunta.etiquetas.through
+        PreguntaEtiqueta.objects.bulk_create(
+            [PreguntaEtiqueta(pregunta_id=pregunta_id, etiquetadepregunta_id=etiqueta_id)
+             for pregunta_id, etiqueta_id in self._relaciones_de_etiquetas()], batch_size=TAMANO_LOTE)
+
+    def _relaciones_de_etiquetas(self):
+        """Pares (id pregunta, id etiqueta) planeados, creando las etiquetas que no existan"""
+        if not self.etiquetas:
+            return set()
+        etiquetas = resolver_etiquetas(EtiquetaDePregunta, [etiqueta_data for _, etiqueta_data in self.etiquetas])
+        # un set para que una etiqueta repetida en la misma pregunta no viole la restriccion de la tabla intermedia
+        return {(pregunta_id, etiquetas[(e['clave'], e['valor'])].pk) for pregunta_id, e in self.etiquetas}
+
+    def _asociar_fotos(self):
+        fotos = self._fotos_planeadas()
+        verificar_fotos_libres(FotoCuestionario, {foto.pk for foto in fotos}, self.cuestionario.organizacion_id)
+        if fotos:
+            FotoCuestionario.objects.bulk_update(fotos, ['content_type', 'object_id'], batch_size=TAMANO_LOTE)
+
+    def _fotos_planeadas(self):
+        """Las fotos con el objeto al que deben quedar asociadas ya asignado"""
+        if not self.fotos:
+            return []
+        tipos = ContentType.objects.get_for_models(Titulo, Pregunta)
+        for foto, objeto in self.fotos:
+            foto.content_type = tipos[type(objeto)]
+            foto.object_id = objeto.pk
+        # si una foto viene en varios objetos queda asociada al ultimo, igual que con .add()
+        return list({foto.pk: foto for foto, _ in self.fotos}.values())
+
+
+class ActualizacionCuestionario(PlanCuestionario):
+    """Compara el arbol entrante con el guardado en [cuestionario] y aplica solo el conjunto minimo de inserciones,
+    actualizaciones y borrados. Titulos, preguntas, opciones y criticidades se emparejan por id; los bloques no
+    tienen id en la api asi que se emparejan por el id de su titulo o de su pregunta"""
+
+    def __init__(self, cuestionario, bloques_data):
+        self.existentes = {modelo: {objeto.pk: objeto for objeto in consulta}
+                           for modelo, consulta in consultas_del_arbol(cuestionario).items()}
+        self.bloque_por_hijo = {}
+        for titulo in self.existentes[Titulo].values():
+            self.bloque_por_hijo[titulo.id] = titulo.bloque_id
+        for pregunta in self.existentes[Pregunta].values():
+            if pregunta.bloque_id is not None:
+                self.bloque_por_hijo[pregunta.id] = pregunta.bloque_id
+        super().__init__(cuestionario, bloques_data)
+
+    def ejecutar(self):
+        """Debe ejecutarse dentro de una transaccion, retorna el resumen de los cambios aplicados"""
+        entrantes = {Bloque: self.bloques, Titulo: self.titulos, Pregunta: self.preguntas,
+                     OpcionDeRespuesta: self.opciones_de_respuesta, CriticidadNumerica: self.criticidades_numericas}
+        por_borrar = {}
+        for modelo, existentes in self.existentes.items():
+            ids_entrantes = {objeto.pk for objeto in entrantes[modelo]}
+            por_borrar[modelo] = [pk for pk in existentes if pk not in ids_entrantes]
+        self._verificar_sin_respuestas(por_borrar[Pregunta], por_borrar[OpcionDeRespuesta])
+        resumen = {}
+        # se inserta de arriba hacia abajo y se borra de abajo hacia arriba
+        modelos = list(self.existentes)
+        for modelo in modelos:
+            existentes = self.existentes[modelo]
+            nuevas = [objeto for objeto in entrantes[modelo] if objeto.pk not in existentes]
+            modelo.objects.bulk_create(nuevas, batch_size=TAMANO_LOTE)
+
+            actualizadas, cambiados = [], set()
+            for objeto in entrantes[modelo]:
+                if objeto.pk in existentes:
+                    campos = campos_cambiados(existentes[objeto.pk], objeto)
+                    if campos:
+                        actualizadas.append(objeto)
+                        cambiados.update(campos)
+            if actualizadas:
+                modelo.objects.bulk_update(actualizadas, cambiados, batch_size=TAMANO_LOTE)
+            resumen[modelo._meta.model_name] = {'insertadas': len(nuevas), 'actualizadas': len(actualizadas)}
+
+        self._actualizar_etiquetas()
+        # las fotos se desasocian antes de borrar para que el borrado en cascada de la GenericRelation no las alcance
+        self._actualizar_fotos()
+
+        for modelo in reversed(modelos):
+            borradas = por_borrar[modelo]
+            if borradas:
+                modelo.objects.filter(pk__in=borradas).delete()
+            resumen[modelo._meta.model_name]['borradas'] = len(borradas)
+        return resumen
+
+    @staticmethod
+    def _verificar_sin_respuestas(preguntas, opciones):
+        """Las preguntas y opciones que ya tienen respuestas no se pueden borrar: las opciones fallarian por su llave
+        DO_NOTHING y las preguntas se llevarian en cascada las respuestas de inspecciones ya hechas. Para quitarlas se
+        crea otra version del cuestionario"""
+        if not preguntas and not opciones:
+            return
+        respondidas = Respuesta.objects.filter(
+            Q(pregunta__in=preguntas) | Q(opcion_seleccionada__in=opciones) | Q(opcion_respondida__in=opciones),
+        ).values_list('pregunta', 'opcion_seleccionada', 'opcion_respondida').distinct()
+        preguntas, opciones = set(preguntas), set(opciones)
+        preguntas_respondidas, opciones_respondidas = set(), set()
+        for pregunta, *opciones_de_respuesta in respondidas:
+            if pregunta in preguntas:
+                preguntas_respondidas.add(str(pregunta))
+            opciones_respondidas.update(str(opcion) for opcion in opciones_de_respuesta if opcion in opciones)
+        errores = {}
+        if preguntas_respondidas:
+            errores['preguntas'] = [f'Las preguntas {", ".join(sorted(preguntas_respondidas))} ya tienen respuestas, '
+                                    'no se pueden borrar']
+        if opciones_respondidas:
+            errores['opciones_de_respuesta'] = [f'Las opciones {", ".join(sorted(opciones_respondidas))} ya tienen '
+                                                'respuestas, no se pueden borrar']
+        if errores:
+            raise ValidationError(errores)
+
+    def _id_bloque_existente(self, titulo_data, pregunta_data):
+        hijo = titulo_data if titulo_data is not None else pregunta_data
+        if hijo is None:
+            return None
+        return self.bloque_por_hijo.get(hijo['id'])
+
+    def _actualizar_etiquetas(self):
+        PreguntaEtiqueta = Pregunta.etiquetas.through
+        anteriores = {(relacion.pregunta_id, relacion.etiquetadepregunta_id): relacion.pk for relacion in
+                      PreguntaEtiqueta.objects.filter(pregunta__in=self.existentes[Pregunta].keys())}
+        relaciones = self._relaciones_de_etiquetas()
+        sobrantes = [pk for relacion, pk in anteriores.items() if relacion not in relaciones]
+        if sobrantes:
+            PreguntaEtiqueta.objects.filter(pk__in=sobrantes).delete()
+        PreguntaEtiqueta.objects.bulk_create(
+            [PreguntaEtiqueta(pregunta_id=pregunta_id, etiquetadepregunta_id=etiqueta_id)
+             for pregunta_id, etiqueta_id in relaciones if (pregunta_id, etiqueta_id) not in anteriores],
+            batch_size=TAMANO_LOTE)
+
+    def _actualizar_fotos(self):
+        ids_objetos = list(self.existentes[Titulo].keys()) + list(self.existentes[Pregunta].keys())
+        anteriores = {foto.pk: foto for foto in FotoCuestionario.objects.filter(object_id__in=ids_objetos)}
+        fotos = self._fotos_planeadas()
+        # las que ya son de este cuestionario pueden pasar de un objeto a otro
+        verificar_fotos_libres(FotoCuestionario, {foto.pk for foto in fotos} - anteriores.keys(),
+                               self.cuestionario.organizacion_id)
+        cambiadas = [foto for foto in fotos
+                     if foto.pk not in anteriores or campos_cambiados(anteriores[foto.pk], foto)]
+        if cambiadas:
+            FotoCuestionario.objects.bulk_update(cambiadas, ['content_type', 'object_id'], batch_size=TAMANO_LOTE)
+        usadas = {foto.pk for foto in fotos}
+        sobrantes = [pk for pk in anteriores if pk not in usadas]
+        if sobrantes:
+            # el recolector de fotos huerfanas las borra despues del periodo de gracia
+            FotoCuestionario.objects.filter(pk__in=sobrantes).update(content_type=None, object_id=None,
+                                                                     huerfana_desde=None)
+
+
+class PlanRespuestas:
+    """Aplana por niveles el arbol de [respuestas_data] validado por el InspeccionCompletaSerializer. Los ids se
+    asignan en el cliente (o vienen en los datos) para que cada hijo conozca a su padre antes de insertarlo, asi
+    [ejecutar] hace un bulk_create por nivel del arbol y un bulk_update por tipo de foto"""
+
+    def __init__(self, inspeccion, respuestas_data):
+        self.inspeccion = inspeccion
+        # niveles[0] son las respuestas de la inspeccion, niveles[1] sus subrespuestas y asi sucesivamente
+        self.niveles = []
+        self.fotos = {tipo: {} for tipo in FotoRespuesta.TiposDeFoto}
+        for respuesta_data in respuestas_data:
+            self._planear_respuesta(respuesta_data, 0, inspeccion=inspeccion)
+
+    @property
+    def respuestas(self):
+        return [respuesta for nivel in self.niveles for respuesta in nivel]
+
+    def ejecutar(self):
+        """Debe ejecutarse dentro de una transaccion"""
+        verificar_fotos_libres(FotoRespuesta, self.ids_de_fotos(), self.inspeccion.cuestionario.organizacion_id)
+        for nivel in self.niveles:
+            Respuesta.objects.bulk_create(nivel, batch_size=TAMANO_LOTE)
+        for tipo, fotos in self.fotos.items():
+            if fotos:
+                FotoRespuesta.objects.bulk_update(fotos.values(), ['tipo', 'respuesta'], batch_size=TAMANO_LOTE)
+
+    def ids_de_fotos(self):
+        return {id_foto for fotos in self.fotos.values() for id_foto in fotos}
+
+    def _planear_respuesta(self, respuesta_data, nivel, inspeccion=None, respuesta_cuadricula=None,
+                           respuesta_multiple=None):
+        respuesta_data = dict(respuesta_data)
+        fotos_base_data = respuesta_data.pop('fotos_base', [])
+        fotos_reparacion_data = respuesta_data.pop('fotos_reparacion', [])
+        subrespuestas_cuadricula_data = respuesta_data.pop('subrespuestas_cuadricula', [])
+        subrespuestas_multiple_data = respuesta_data.pop('subrespuestas_multiple', [])
+
+        # si no viene id lo asigna el default del modelo al instanciarla
+        respuesta = Respuesta(inspeccion=inspeccion, respuesta_cuadricula=respuesta_cuadricula,
+                              respuesta_multiple=respuesta_multiple, **respuesta_data)
+        if len(self.niveles) == nivel:
+            self.niveles.append([])
+        self.niveles[nivel].append(respuesta)
+
+        self._asociar_fotos(respuesta, fotos_base_data, FotoRespuesta.TiposDeFoto.base)
+        self._asociar_fotos(respuesta, fotos_reparacion_data, FotoRespuesta.TiposDeFoto.reparacion)
+        for subrespuesta_data in subrespuestas_cuadricula_data:
+            self._planear_respuesta(subrespuesta_data, nivel + 1, respuesta_cuadricula=respuesta)
+        for subrespuesta_data in subrespuestas_multiple_data:
+            self._planear_respuesta(subrespuesta_data, nivel + 1, respuesta_multiple=respuesta)
+
+    def _asociar_fotos(self, respuesta, fotos, tipo):
+        for foto in fotos:
+            foto.tipo = tipo
+            foto.respuesta = respuesta
+            # si la foto ya estaba en el otro tipo queda con el ultimo que se asigne, igual que con foto.save()
+            for otro_tipo, fotos_del_tipo in self.fotos.items():
+                if otro_tipo != tipo:
+                    fotos_del_tipo.pop(foto.pk, None)
+            self.fotos[tipo][foto.pk] = foto
+
+
+class ActualizacionRespuestas:
+    """Empareja por id el arbol entrante con las respuestas guardadas de [inspeccion] y aplica solo el conjunto de
+    cambios: inserta las nuevas, actualiza las que cambiaron y borra las que ya no vienen. Solo toca las fotos de
+    esta inspeccion"""
+
+    def __init__(self, inspeccion, respuestas_data):
+        self.inspeccion = inspeccion
+        self.plan = PlanRespuestas(inspeccion, respuestas_data)
+
+    def ejecutar(self):
+        """Debe ejecutarse dentro de una transaccion, retorna el resumen de los cambios aplicados"""
+        existentes = {respuesta.id: respuesta for respuesta in
+                      Respuesta.objects.de_inspecciones([self.inspeccion.id])}
+        entrantes = {respuesta.id: respuesta for respuesta in self.plan.respuestas}
+
+        # primero se insertan los padres nuevos, luego se actualizan las que pudieron cambiar de padre y al final se
+        # borran las que sobran, asi el borrado en cascada no alcanza a ninguna respuesta que se conserva
+        insertadas = 0
+        for nivel in self.plan.niveles:
+            nuevas = [respuesta for respuesta in nivel if respuesta.id not in existentes]
+            Respuesta.objects.bulk_create(nuevas, batch_size=TAMANO_LOTE)
+            insertadas += len(nuevas)
+
+        actualizadas, campos = [], set()
+        for id_respuesta, respuesta in entrantes.items():
+            if id_respuesta in existentes:
+                cambiados = campos_cambiados(existentes[id_respuesta], respuesta)
+                if cambiados:
+                    actualizadas.append(respuesta)
+                    campos.update(cambiados)
+        if actualizadas:
+            Respuesta.objects.bulk_update(actualizadas, campos, batch_size=TAMANO_LOTE)
+
+        fotos_asociadas, fotos_desasociadas = self._actualizar_fotos(existentes)
+
+        borradas = [id_respuesta for id_respuesta in existentes if id_respuesta not in entrantes]
+        if borradas:
+            Respuesta.objects.filter(id__in=borradas).delete()
+
+        return {'insertadas': insertadas, 'actualizadas': len(actualizadas), 'borradas': len(borradas),
+                'fotos_asociadas': fotos_asociadas, 'fotos_desasociadas': fotos_desasociadas}
+
+    def _actualizar_fotos(self, existentes):
+        """Reasocia las fotos que cambiaron de respuesta o de tipo y desasocia las que esta inspeccion dejo de usar, el
+        recolector de fotos huerfanas las borra despues del periodo de gracia"""
+        anteriores = {foto.id: foto for foto in FotoRespuesta.objects.filter(respuesta__in=existentes.keys())}
+        # las que ya son de esta inspeccion pueden pasar de una respuesta a otra
+        verificar_fotos_libres(FotoRespuesta, self.plan.ids_de_fotos() - anteriores.keys(),
+                               self.inspeccion.cuestionario.organizacion_id)
+        asociadas = 0
+        for fotos in self.plan.fotos.values():
+            cambiadas = [foto for foto in fotos.values()
+                         if foto.id not in anteriores
+                         or (anteriores[foto.id].respuesta_id, anteriores[foto.id].tipo) != (foto.respuesta_id,
+                                                                                            foto.tipo)]
+            if cambiadas:
+                FotoRespuesta.objects.bulk_update(cambiadas, ['tipo', 'respuesta'], batch_size=TAMANO_LOTE)
+                asociadas += len(cambiadas)
+
+        usadas = self.plan.ids_de_fotos()
+        sobrantes = [id_foto for id_foto in anteriores if id_foto not in usadas]
+        if sobrantes:
+            FotoRespuesta.objects.filter(id__in=sobrantes).update(respuesta=None, huerfana_desde=None)
+        return asociadas, len(sobrantes)
+
+
+class CargaDeActivos:
+    """Carga masiva de activos de [organizacion] con upsert por la llave natural (identificador, organizacion). Las
+    filas ya validadas se agregan una a una con [agregar] y se escriben por lotes de TAMANO_LOTE, cada lote en su
+    propia transaccion y con un numero fijo de consultas. Una fila con problemas queda en [errores] sin detener la
+    carga. Al final [terminar] escribe lo pendiente y retorna el resumen. [al_escribir_lote] se llama despues de
+    confirmar cada lote, sirve para reportar el avance"""
+
+    def __init__(self, organizacion, tamano_lote=TAMANO_LOTE, al_escribir_lote=None):
+        self.organizacion = organizacion
+        self.tamano_lote = tamano_lote
+        self.al_escribir_lote = al_escribir_lote
+        self.filas = 0
+        self.pendientes = []
+        self.identificadores = set()
+        self.ids = set()
+        self.errores = []
+        self.creados = 0
+        self.actualizados = 0
+
+    def agregar(self, numero, fila_data):
+        self.filas += 1
+        if fila_data['identificador'] in self.identificadores:
+            self.agregar_error(numero, {'identificador': ['Identificador repetido en la carga']})
+            return
+        if fila_data.get('id') and fila_data['id'] in self.ids:
+            self.agregar_error(numero, {'id': ['Id repetido en la carga']})
+            return
+        self.identificadores.add(fila_data['identificador'])
+        if fila_data.get('id'):
+            self.ids.add(fila_data['id'])
+        self.pendientes.append((numero, fila_data))
+        if len(self.pendientes) >= self.tamano_lote:
+            self._escribir_lote()
+
+    def agregar_invalida(self, numero, errores):
+        self.filas += 1
+        self.agregar_error(numero, errores)
+
+    def agregar_error(self, numero, errores):
+        self.errores.append({'fila': numero, 'errores': errores})
+
+    def terminar(self):
+        if self.pendientes:
+            self._escribir_lote()
+        return {'creados': self.creados, 'actualizados': self.actualizados, 'errores': self.errores}
+
+    def _escribir_lote(self):
+        lote, self.pendientes = self.pendientes, []
+        try:
+            with transaction.atomic():
+                errores, creados, actualizados = self._upsert(lote)
+        except IntegrityError:
+            # otra carga creo alguno de los activos despues de leer los existentes. Al repetir el lote ya los
+            # encuentra y los actualiza, o reporta el id ocupado en su fila
+            with transaction.atomic():
+                errores, creados, actualizados = self._upsert(lote)
+        self.errores.extend(errores)
+        self.creados += creados
+        self.actualizados += actualizados
+        if self.al_escribir_lote is not None:
+            self.al_escribir_lote(self)
+
+    def _upsert(self, lote):
+        """Escribe el [lote] y retorna sus errores por fila y cuantos activos creo y actualizo, no modifica la carga
+        para poder repetirlo si falla"""
+        identificadores = [fila_data['identificador'] for _, fila_data in lote]
+        ids = [fila_data['id'] for _, fila_data in lote if fila_data.get('id')]
+        existentes = Activo.objects.filter(Q(organizacion=self.organizacion, identificador__in=identificadores) |
+                                           Q(pk__in=ids))
+        por_identificador = {activo.identificador: activo for activo in existentes
+                             if activo.organizacion_id == self.organizacion.pk}
+        ids_usados = {activo.pk for activo in existentes}
+
+        errores, nuevos, actualizados, etiquetas_por_activo = [], [], [], {}
+        for numero, fila_data in lote:
+            activo = por_identificador.get(fila_data['identificador'])
+            id_fila = fila_data.get('id')
+            if activo is None and id_fila in ids_usados:
+                errores.append({'fila': numero, 'errores': {'id': ['El id ya pertenece a otro activo']}})
+                continue
+            if activo is not None and id_fila is not None and id_fila != activo.pk:
+                errores.append({'fila': numero,
+                                'errores': {'id': ['El id no corresponde al activo con este identificador']}})
+                continue
+            if activo is None:
+                activo = Activo(id=id_fila or uuid.uuid4(), identificador=fila_data['identificador'],
+                                organizacion=self.organizacion)
+                nuevos.append(activo)
+            else:
+                actualizados.append(activo)
+            etiquetas_por_activo[activo.pk] = {(etiqueta['clave'], etiqueta['valor'])
+                                               for etiqueta in fila_data.get('etiquetas', [])}
+
+        Activo.objects.bulk_create(nuevos, batch_size=TAMANO_LOTE)
+        cambiados = self._reemplazar_etiquetas(etiquetas_por_activo)
+        # el identificador es la llave por la que se encontraron, solo las etiquetas cambian a los existentes
+        modificados = [activo.pk for activo in actualizados if activo.pk in cambiados]
+        if modificados:
+            Activo.objects.filter(pk__in=modificados).update(momento_modificacion=timezone.now())
+        return errores, len(nuevos), len(actualizados)
+
+    def _reemplazar_etiquetas(self, etiquetas_por_activo):
+        """Deja a cada activo exactamente con sus etiquetas de la carga, borrando e insertando solo la diferencia.
+        Retorna los ids de los activos cuyas etiquetas cambiaron"""
+        etiquetas = resolver_etiquetas(EtiquetaDeActivo, [{'clave': clave, 'valor': valor}
+                                                          for pares in etiquetas_por_activo.values()
+                                                          for clave, valor in pares])
+        ActivoEtiqueta = Activo.etiquetas.through
+        actuales = {(relacion.activo_id, relacion.etiquetadeactivo_id): relacion.pk for relacion in
+                    ActivoEtiqueta.objects.filter(activo__in=etiquetas_por_activo.keys())}
+        deseadas = {(id_activo, etiquetas[par].pk)
+                    for id_activo, pares in etiquetas_por_activo.items() for par in pares}
+        sobrantes = {relacion: pk for relacion, pk in actuales.items() if relacion not in deseadas}
+        if sobrantes:
+            ActivoEtiqueta.objects.filter(pk__in=sobrantes.values()).delete()
+        faltantes = deseadas - actuales.keys()
+        ActivoEtiqueta.objects.bulk_create(
+            [ActivoEtiqueta(activo_id=id_activo, etiquetadeactivo_id=id_etiqueta)
+             for id_activo, id_etiqueta in faltantes], batch_size=TAMANO_LOTE)
+        return {id_activo for id_activo, _ in faltantes | sobrantes.keys()}
@@ -0,0 +1,164 @@
+"""Calculo de criticidades en el servidor.
+
+El indice en memoria de las criticidades numericas de cada cuestionario deja los rangos de cada pregunta ordenados
+por valor minimo, asi la criticidad de un valor se encuentra con una busqueda binaria y sin consultas. Lo usan el
+reporte de la inspeccion y el recalculo de criticidades, que procesa lotes enteros de respuestas con numpy"""
+from bisect import bisect_right
+from collections import defaultdict
+from functools import lru_cache
+from itertools import accumulate
+
+import numpy as np
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inspecciones.carga_masiva import TAMANO_LOTE, consultas_del_arbol
+from inspecciones.models import CriticidadNumerica, Cuestionario, Inspeccion, Respuesta
+
+# indices que guarda cada proceso, los de los ultimos cuestionarios usados
+INDICES_EN_MEMORIA = 128
+
+
+class IndiceDeCriticidades:
+    def __init__(self, criticidades):
+        por_pregunta = defaultdict(list)
+        for criticidad in criticidades:
+            por_pregunta[criticidad.pregunta_id].append(
+                (criticidad.valor_minimo, criticidad.valor_maximo, criticidad.criticidad))
+        self._rangos = {}
+        for pregunta_id, rangos in por_pregunta.items():
+            rangos.sort()
+            # el maximo acumulado permite dejar de retroceder cuando ningun rango anterior alcanza el valor
+            maximos = list(accumulate((maximo for _, maximo, _ in rangos), max))
+            self._rangos[pregunta_id] = ([minimo for minimo, _, _ in rangos], maximos, rangos)
+
+    def criticidad(self, pregunta_id, valor):
+        """La criticidad del rango de [pregunta_id] que contiene a [valor], 0 si ninguno lo contiene. Si hay rangos
+        superpuestos gana el de mayor valor minimo"""
+        if valor is None or pregunta_id not in self._rangos:
+            return 0
+        minimos, maximos, rangos = self._rangos[pregunta_id]
+        i = bisect_right(minimos, valor) - 1
+        while i >= 0 and maximos[i] >= valor:
+            _, maximo, criticidad = rangos[i]
+            if maximo >= valor:
+                return criticidad
+            i -= 1
+        return 0
+
+
+@lru_cache(maxsize=INDICES_EN_MEMORIA)
+def _indice(cuestionario_id, momento_modificacion):
+    return IndiceDeCriticidades(consultas_del_arbol(cuestionario_id)[CriticidadNumerica])
+
+
+def indice_de_cuestionario(cuestionario_id, momento_modificacion=None):
+    """El indice del cuestionario, guardado en la memoria del proceso con su [momento_modificacion] en la llave. La
+    actualizacion del arbol guarda el cuestionario, asi cada edicion cambia la llave y ningun proceso sigue usando
+    los rangos viejos sin necesidad de invalidarlos. Sin [momento_modificacion] se consulta"""
+    if momento_modificacion is None:
+        momento_modificacion = Cuestionario.objects.values_list('momento_modificacion', flat=True) \
+            .get(pk=cuestionario_id)
+    return _indice(cuestionario_id, momento_modificacion)
+
+
+# inspecciones recalculadas por consulta, acota la memoria de los arreglos del arbol de respuestas
+TAMANO_LOTE_RECALCULO = 1000
+
+_CAMPOS_RECALCULO = ['id', 'tipo_de_respuesta', 'reparado', 'criticidad_del_inspector', 'pregunta_id',
+                     'valor_numerico', 'opcion_respondida_esta_seleccionada', 'inspeccion_id',
+                     'respuesta_cuadricula_id', 'respuesta_multiple_id', 'criticidad_calculada',
+                     'criticidad_calculada_con_reparaciones', 'criticidad_pregunta', 'criticidad_opcion',
+                     'requiere_criticidad_del_inspector', 'cuestionario_id', 'momento_cuestionario']
+
+
+def recalcular_criticidades(inspecciones, al_avanzar=None):
+    """Recalcula en el servidor las criticidades de [inspecciones] (queryset) y de todas sus respuestas, y guarda
+    solo las que cambiaron. Retorna cuantas respuestas e inspecciones se actualizaron. [al_avanzar] recibe la
+    fraccion procesada despues de cada lote.
+
+    Cada respuesta hoja (seleccion unica, numerica o parte seleccionada de una seleccion multiple) vale
+    criticidad de la pregunta * criticidad de la opcion o del rango numerico * criticidad del inspector (solo si la
+    opcion la requiere). Las selecciones multiples, las cuadriculas y las inspecciones suman a sus hijas. Las
+    reparadas valen 0 en la criticidad con reparaciones"""
+    ids = list(inspecciones.order_by('pk').values_list('pk', flat=True))
+    cambios = {'respuestas': 0, 'inspecciones': 0}
+    for inicio in range(0, len(ids), TAMANO_LOTE_RECALCULO):
+        respuestas, totales = _recalcular_lote(ids[inicio:inicio + TAMANO_LOTE_RECALCULO])
+        Respuesta.objects.bulk_update(respuestas, ['criticidad_calculada', 'criticidad_calculada_con_reparaciones'],
+                                      batch_size=TAMANO_LOTE)
+        Inspeccion.objects.bulk_update(totales, ['criticidad_calculada', 'criticidad_calculada_con_reparaciones',
+                                                 'momento_modificacion'], batch_size=TAMANO_LOTE)
+        cambios['respuestas'] += len(respuestas)
+        cambios['inspecciones'] += len(totales)
+        if al_avanzar is not None:
+            al_avanzar(min(inicio + TAMANO_LOTE_RECALCULO, len(ids)) / len(ids))
+    return cambios
+
+
+def _recalcular_lote(ids_inspecciones):
+    """Una consulta para el arbol de respuestas del lote, el calculo se hace sobre arreglos de numpy: un producto
+    para las hojas y una suma por cada nivel del arbol"""
+    filas = list(Respuesta.objects.de_inspecciones(ids_inspecciones).annotate(
+        # las partes de seleccion multiple no tienen pregunta, usan la de la respuesta multiple
+        criticidad_pregunta=Coalesce('pregunta__criticidad', 'respuesta_multiple__pregunta__criticidad'),
+        criticidad_opcion=Coalesce('opcion_seleccionada__criticidad', 'opcion_respondida__criticidad'),
+        requiere_criticidad_del_inspector=Coalesce('opcion_seleccionada__requiere_criticidad_del_inspector',
+                                                   'opcion_respondida__requiere_criticidad_del_inspector'),
+        cuestionario_id=F('inspeccion__cuestionario'),
+        momento_cuestionario=F('inspeccion__cuestionario__momento_modificacion'),
+    ).values_list(*_CAMPOS_RECALCULO))
+    columnas = dict(zip(_CAMPOS_RECALCULO, zip(*filas))) if filas else {campo: () for campo in _CAMPOS_RECALCULO}
+    posiciones = {id_respuesta: i for i, id_respuesta in enumerate(columnas['id'])}
+    tipos = np.array(columnas['tipo_de_respuesta'], dtype=object)
+    numericas = tipos == Respuesta.TiposDeRespuesta.numerica
+
+    criticidad_opcion = np.array([c or 0 for c in columnas['criticidad_opcion']], dtype=np.int64)
+    # los rangos numericos salen del indice de cada cuestionario, las numericas siempre son de primer nivel
+    for i in np.flatnonzero(numericas):
+        indice = indice_de_cuestionario(columnas['cuestionario_id'][i], columnas['momento_cuestionario'][i])
+        criticidad_opcion[i] = indice.criticidad(columnas['pregunta_id'][i], columnas['valor_numerico'][i])
+    inspector = np.array([c if c is not None else 1 for c in columnas['criticidad_del_inspector']], dtype=np.int64)
+    factor = np.where(np.array([bool(r) for r in columnas['requiere_criticidad_del_inspector']], dtype=bool),
+                      inspector, 1)
+    hojas = numericas | (tipos == Respuesta.TiposDeRespuesta.seleccion_unica) | (
+            (tipos == Respuesta.TiposDeRespuesta.parte_de_seleccion_multiple) &
+            np.array([bool(s) for s in columnas['opcion_respondida_esta_seleccionada']], dtype=bool))
+    criticidad_pregunta = np.array([c or 0 for c in columnas['criticidad_pregunta']], dtype=np.int64)
+    reparado = np.array(columnas['reparado'], dtype=bool)
+
+    calculada = np.where(hojas, criticidad_pregunta * criticidad_opcion * factor, 0)
+    con_reparaciones = np.where(reparado, 0, calculada)
+    # primero las partes suman a su seleccion multiple y luego las filas a su cuadricula, asi cada padre ya esta
+    # completo cuando se suma al siguiente nivel
+    for padre in ['respuesta_multiple_id', 'respuesta_cuadricula_id']:
+        padres = np.array([posiciones.get(id_padre, -1) for id_padre in columnas[padre]], dtype=np.int64)
+        hijas = padres >= 0
+        np.add.at(calculada, padres[hijas], calculada[hijas])
+        np.add.at(con_reparaciones, padres[hijas], con_reparaciones[hijas])
+        con_reparaciones = np.where(reparado, 0, con_reparaciones)
+
+    posiciones_inspecciones = {id_inspeccion: i for i, id_inspeccion in enumerate(ids_inspecciones)}
+    inspeccion = np.array([posiciones_inspecciones.get(id_inspeccion, -1)
+                           for id_inspeccion in columnas['inspeccion_id']], dtype=np.int64)
+    raices = inspeccion >= 0
+    total = np.bincount(inspeccion[raices], weights=calculada[raices], minlength=len(ids_inspecciones))
+    total_con_reparaciones = np.bincount(inspeccion[raices], weights=con_reparaciones[raices],
+                                         minlength=len(ids_inspecciones))
+
+    cambiadas = np.flatnonzero((calculada != np.array(columnas['criticidad_calculada'], dtype=np.int64)) |
+                               (con_reparaciones != np.array(columnas['criticidad_calculada_con_reparaciones'],
+                                                             dtype=np.int64)))
+    respuestas = [Respuesta(id=columnas['id'][i], criticidad_calculada=int(calculada[i]),
+                            criticidad_calculada_con_reparaciones=int(con_reparaciones[i])) for i in cambiadas]
+    totales = []
+    for id_inspeccion, calculada_actual, con_reparaciones_actual in Inspeccion.objects.filter(
+            pk__in=ids_inspecciones).values_list('pk', 'criticidad_calculada', 'criticidad_calculada_con_reparaciones'):
+        nuevas = int(total[posiciones_inspecciones[id_inspeccion]]), \
+                 int(total_con_reparaciones[posiciones_inspecciones[id_inspeccion]])
+        if (calculada_actual, con_reparaciones_actual) != nuevas:
+            totales.append(Inspeccion(id=id_inspeccion, criticidad_calculada=nuevas[0],
+                                      criticidad_calculada_con_reparaciones=nuevas[1],
+                                      momento_modificacion=timezone.now()))
+    return respuestas, totales
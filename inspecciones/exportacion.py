@@ -0,0 +1,153 @@
+"""Exportacion de inspecciones con sus respuestas en CSV, XLSX o JSON por lineas. Las inspecciones se leen con un
+cursor del lado del servidor y las respuestas se consultan por lotes de inspecciones, asi la memoria no depende del
+numero de inspecciones exportadas. Cada formato es un generador que se entrega en un StreamingHttpResponse"""
+import csv
+import json
+import tempfile
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce, Concat
+from django.utils import timezone
+
+from inspecciones.models import Respuesta
+
+# inspecciones por consulta de respuestas
+TAMANO_LOTE_EXPORTACION = 100
+TAMANO_BLOQUE_XLSX = 64 * 1024
+
+COLUMNAS_INSPECCION = ['inspeccion', 'activo', 'tipo_de_inspeccion', 'version', 'estado', 'inspector',
+                       'momento_inicio', 'momento_finalizacion', 'momento_subida', 'criticidad_inspeccion',
+                       'criticidad_inspeccion_con_reparaciones']
+COLUMNAS_RESPUESTA = ['cuadricula', 'pregunta', 'tipo_de_respuesta', 'respuesta', 'criticidad',
+                      'criticidad_con_reparaciones', 'reparado', 'observacion', 'observacion_reparacion',
+                      'momento_respuesta']
+
+_CAMPOS_INSPECCION = {
+    'inspeccion': 'id', 'activo': 'activo__identificador', 'tipo_de_inspeccion': 'cuestionario__tipo_de_inspeccion',
+    'version': 'cuestionario__version', 'estado': 'estado', 'inspector': 'nombre_inspector',
+    'momento_inicio': 'momento_inicio', 'momento_finalizacion': 'momento_finalizacion',
+    'momento_subida': 'momento_subida', 'criticidad_inspeccion': 'criticidad_calculada',
+    'criticidad_inspeccion_con_reparaciones': 'criticidad_calculada_con_reparaciones',
+}
+
+# las respuestas que tienen un valor propio. Las cuadriculas y selecciones multiples solo agrupan a sus hijas y de
+# las partes de seleccion multiple solo interesan las opciones seleccionadas
+_HOJAS = Q(tipo_de_respuesta__in=[Respuesta.TiposDeRespuesta.seleccion_unica, Respuesta.TiposDeRespuesta.numerica]) | \
+    Q(tipo_de_respuesta=Respuesta.TiposDeRespuesta.parte_de_seleccion_multiple,
+      opcion_respondida_esta_seleccionada=True)
+
+
+def _inspecciones(inspecciones):
+    return inspecciones.annotate(
+        nombre_inspector=Concat('inspector__user__first_name', Value(' '), 'inspector__user__last_name'),
+    ).order_by('momento_inicio', 'id').values(*_CAMPOS_INSPECCION.values())
+
+
+def _respuestas_de_lote(ids):
+    """Las respuestas hoja de las inspecciones [ids] agrupadas por inspeccion, en el orden del cuestionario"""
+    respuestas = Respuesta.objects.filter(
+        Q(inspeccion__in=ids) | Q(respuesta_cuadricula__inspeccion__in=ids) | Q(respuesta_multiple__inspeccion__in=ids) |
+        Q(respuesta_multiple__respuesta_cuadricula__inspeccion__in=ids), _HOJAS,
+    ).annotate(
+        id_inspeccion=Coalesce('inspeccion', 'respuesta_cuadricula__inspeccion', 'respuesta_multiple__inspeccion',
+                               'respuesta_multiple__respuesta_cuadricula__inspeccion'),
+        orden=Coalesce('pregunta__bloque__n_orden', 'pregunta__cuadricula__bloque__n_orden',
+                       'respuesta_multiple__pregunta__bloque__n_orden',
+                       'respuesta_multiple__pregunta__cuadricula__bloque__n_orden'),
+        titulo_cuadricula=Coalesce('pregunta__cuadricula__titulo', 'respuesta_multiple__pregunta__cuadricula__titulo'),
+        titulo_pregunta=Coalesce('pregunta__titulo', 'respuesta_multiple__pregunta__titulo'),
+        titulo_opcion=Coalesce('opcion_seleccionada__titulo', 'opcion_respondida__titulo'),
+    ).order_by('orden', 'pk').values(
+        'id_inspeccion', 'titulo_cuadricula', 'titulo_pregunta', 'tipo_de_respuesta', 'titulo_opcion', 'valor_numerico',
+        'criticidad_calculada', 'criticidad_calculada_con_reparaciones', 'reparado', 'observacion',
+        'observacion_reparacion', 'momento_respuesta')
+
+    por_inspeccion = {id_inspeccion: [] for id_inspeccion in ids}
+    for respuesta in respuestas:
+        por_inspeccion[respuesta['id_inspeccion']].append({
+            'cuadricula': respuesta['titulo_cuadricula'],
+            'pregunta': respuesta['titulo_pregunta'],
+            'tipo_de_respuesta': respuesta['tipo_de_respuesta'],
+            'respuesta': respuesta['titulo_opcion'] if respuesta['titulo_opcion'] is not None
+            else respuesta['valor_numerico'],
+            'criticidad': respuesta['criticidad_calculada'],
+            'criticidad_con_reparaciones': respuesta['criticidad_calculada_con_reparaciones'],
+            'reparado': respuesta['reparado'],
+            'observacion': respuesta['observacion'],
+            'observacion_reparacion': respuesta['observacion_reparacion'],
+            'momento_respuesta': respuesta['momento_respuesta'],
+        })
+    return por_inspeccion
+
+
+def inspecciones_con_respuestas(inspecciones):
+    """Genera (inspeccion, respuestas) como diccionarios para cada inspeccion del queryset [inspecciones]"""
+    filas = _inspecciones(inspecciones).iterator(chunk_size=TAMANO_LOTE_EXPORTACION)
+    while lote := list(islice(filas, TAMANO_LOTE_EXPORTACION)):
+        respuestas = _respuestas_de_lote([fila['id'] for fila in lote])
+        for fila in lote:
+            inspeccion = {columna: fila[campo] for columna, campo in _CAMPOS_INSPECCION.items()}
+            inspeccion['inspector'] = inspeccion['inspector'].strip() or None
+            yield inspeccion, respuestas[fila['id']]
+
+
+def filas_planas(inspecciones):
+    """Una fila por respuesta con los datos de su inspeccion, o una fila sin respuesta si la inspeccion no tiene"""
+    vacia = [None] * len(COLUMNAS_RESPUESTA)
+    for inspeccion, respuestas in inspecciones_con_respuestas(inspecciones):
+        datos = [inspeccion[columna] for columna in COLUMNAS_INSPECCION]
+        if not respuestas:
+            yield datos + vacia
+        for respuesta in respuestas:
+            yield datos + [respuesta[columna] for columna in COLUMNAS_RESPUESTA]
+
+
+class _Eco:
+    """Archivo que en vez de escribir retorna lo escrito, permite usar csv.writer en un generador"""
+
+    def write(self, valor):
+        return valor
+
+
+def exportar_csv(inspecciones):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUMNAS_INSPECCION + COLUMNAS_RESPUESTA)
+    for fila in filas_planas(inspecciones):
+        yield escritor.writerow(fila)
+
+
+def exportar_ndjson(inspecciones):
+    for inspeccion, respuestas in inspecciones_con_respuestas(inspecciones):
+        yield json.dumps({**inspeccion, 'respuestas': respuestas}, cls=DjangoJSONEncoder) + '\n'
+
+
+def _celda_xlsx(valor):
+    # excel no maneja zonas horarias
+    if hasattr(valor, 'tzinfo') and valor.tzinfo is not None:
+        return timezone.localtime(valor).replace(tzinfo=None)
+    return valor
+
+
+def exportar_xlsx(inspecciones):
+    """El libro en modo de solo escritura guarda las filas en disco a medida que se agregan. El zip de un xlsx solo
+    se puede cerrar al final, asi que el archivo se entrega por bloques despues de escribir todas las filas"""
+    from openpyxl import Workbook
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('inspecciones')
+    hoja.append(COLUMNAS_INSPECCION + COLUMNAS_RESPUESTA)
+    for fila in filas_planas(inspecciones):
+        hoja.append([_celda_xlsx(valor) for valor in fila])
+    with tempfile.TemporaryFile() as archivo:
+        libro.save(archivo)
+        archivo.seek(0)
+        while bloque := archivo.read(TAMANO_BLOQUE_XLSX):
+            yield bloque
+
+
+FORMATOS = {
+    'csv': (exportar_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (exportar_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'ndjson': (exportar_ndjson, 'application/x-ndjson'),
+}
@@ -0,0 +1,43 @@
+"""Versiones de las fotos subidas por los usuarios. Solo depende de Pillow para poder ejecutarse en los procesos de un
+ProcessPoolExecutor sin cargar django, ver la tarea procesar_fotos"""
+import io
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from PIL import Image, ImageOps
+
+# lado mayor en pixeles de cada version reducida, la original conserva su tamaño
+VERSIONES = {'miniatura': 320, 'mediana': 1280}
+EXTENSIONES = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+_pool = None
+
+
+def generar_versiones(contenido, formato='WEBP', calidad=80):
+    """Recibe los bytes de una imagen y retorna los bytes de cada version {'original', 'miniatura', 'mediana'}
+    recodificadas en [formato]. La orientacion se aplica a los pixeles y los metadatos EXIF no se copian"""
+    with Image.open(io.BytesIO(contenido)) as imagen:
+        imagen = ImageOps.exif_transpose(imagen)
+        modo = 'RGBA' if formato == 'WEBP' and imagen.mode in ('RGBA', 'LA', 'P') else 'RGB'
+        imagen = imagen.convert(modo)
+    versiones = {'original': _codificar(imagen, formato, calidad)}
+    for version, lado in VERSIONES.items():
+        reducida = imagen.copy()
+        reducida.thumbnail((lado, lado))
+        versiones[version] = _codificar(reducida, formato, calidad)
+    return versiones
+
+
+def _codificar(imagen, formato, calidad):
+    salida = io.BytesIO()
+    imagen.save(salida, formato, quality=calidad)
+    return salida.getvalue()
+
+
+def pool(procesos):
+    """Pool de procesos compartido, se crea con el primer uso. Usa spawn para no copiar el estado del proceso padre,
+    como las conexiones a la base de datos"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=procesos, mp_context=get_context('spawn'))
+    return _pool
@@ -0,0 +1,111 @@
+"""Importacion de activos desde archivos CSV o XLSX. El archivo se lee fila por fila sin cargarlo completo en
+memoria, las filas se escriben por lotes con CargaDeActivos y el avance queda en el registro Importacion que el
+cliente consulta.
+
+La primera fila son los encabezados: [identificador] es obligatorio, [id] es opcional y cada columna adicional es la
+clave de una etiqueta cuyo valor es el de la celda. Las celdas vacias no generan etiqueta"""
+import codecs
+import csv
+
+from django.utils import timezone
+
+from inspecciones.carga_masiva import CargaDeActivos
+from inspecciones.models import Importacion
+from inspecciones.planeacion import recalcular_planeacion_de_organizacion
+from inspecciones.serializers import FilaDeActivoSerializer
+from inspecciones.tablero import invalidar_tablero
+
+# el registro guarda solo los primeros errores, el resto se cuentan en filas_con_error
+MAXIMO_ERRORES_GUARDADOS = 1000
+
+_COLUMNAS_DEL_ACTIVO = {'id', 'identificador'}
+
+
+class ArchivoInvalido(Exception):
+    pass
+
+
+def cargar_filas(carga, filas):
+    """Valida cada (numero, datos) de [filas] con el FilaDeActivoSerializer y la pasa a [carga]"""
+    for numero, fila in filas:
+        serializer = FilaDeActivoSerializer(data=fila)
+        if serializer.is_valid():
+            carga.agregar(numero, serializer.validated_data)
+        else:
+            carga.agregar_invalida(numero, serializer.errors)
+    return carga.terminar()
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        # excel guarda los numeros como float, 12 no debe llegar como 12.0
+        valor = int(valor)
+    return str(valor).strip()
+
+
+def _filas_de_tabla(tabla):
+    """(numero de fila en el archivo, datos de la fila) a partir de un iterador de tuplas de celdas"""
+    encabezados = [_texto(celda).lower() for celda in next(tabla, ())]
+    if 'identificador' not in encabezados:
+        raise ArchivoInvalido('El archivo no tiene la columna identificador')
+    for numero, celdas in enumerate(tabla, start=2):
+        valores = dict(zip(encabezados, (_texto(celda) for celda in celdas)))
+        if not any(valores.values()):
+            continue
+        fila = {'identificador': valores.get('identificador', ''),
+                'etiquetas': [{'clave': clave, 'valor': valor} for clave, valor in valores.items()
+                              if clave and clave not in _COLUMNAS_DEL_ACTIVO and valor]}
+        if valores.get('id'):
+            fila['id'] = valores['id']
+        yield numero, fila
+
+
+def filas_de_csv(archivo):
+    # utf-8-sig descarta el BOM que agrega excel al exportar
+    return _filas_de_tabla(csv.reader(codecs.iterdecode(archivo, 'utf-8-sig')))
+
+
+def filas_de_xlsx(archivo):
+    # openpyxl solo se necesita para este formato
+    from openpyxl import load_workbook
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    return _filas_de_tabla(libro.worksheets[0].iter_rows(values_only=True))
+
+
+_LECTORES = {Importacion.Formatos.csv: filas_de_csv, Importacion.Formatos.xlsx: filas_de_xlsx}
+
+
+def _reportar_avance(importacion, carga):
+    Importacion.objects.filter(pk=importacion.pk).update(
+        filas_procesadas=carga.filas, creados=carga.creados, actualizados=carga.actualizados,
+        filas_con_error=len(carga.errores), errores=carga.errores[:MAXIMO_ERRORES_GUARDADOS])
+
+
+def procesar_importacion(id_importacion, al_escribir_lote=None):
+    """Ejecuta una importacion pendiente desde el trabajo importar_activos. Cada lote se confirma en su propia
+    transaccion, si el proceso falla a la mitad lo ya escrito se conserva y el registro queda como fallido con el
+    motivo. [al_escribir_lote] se llama despues de reportar el avance de cada lote"""
+    importacion = Importacion.objects.select_related('organizacion').get(pk=id_importacion)
+    Importacion.objects.filter(pk=importacion.pk).update(estado=Importacion.Estados.procesando)
+
+    def reportar(carga):
+        _reportar_avance(importacion, carga)
+        if al_escribir_lote is not None:
+            al_escribir_lote(carga)
+
+    carga = CargaDeActivos(importacion.organizacion, tamano_lote=importacion.tamano_lote, al_escribir_lote=reportar)
+    try:
+        with importacion.archivo.open('rb') as archivo:
+            cargar_filas(carga, _LECTORES[importacion.formato](archivo))
+        estado, mensaje = Importacion.Estados.terminada, ''
+    except Exception as error:
+        estado, mensaje = Importacion.Estados.fallida, str(error) or error.__class__.__name__
+    _reportar_avance(importacion, carga)
+    Importacion.objects.filter(pk=importacion.pk).update(estado=estado, mensaje=mensaje, momento_fin=timezone.now())
+    if carga.creados or carga.actualizados:
+        # los bulk no emiten señales. La cache del tablero es compartida, asi la invalidacion del trabajador la ven
+        # los procesos web
+        recalcular_planeacion_de_organizacion(importacion.organizacion)
+        invalidar_tablero(importacion.organizacion_id)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inspecciones.sincronizacion import purgar_lapidas, RETENCION_LAPIDAS
+
+
+class Command(BaseCommand):
+    help = f'Borra las lapidas de la sincronizacion con mas de {RETENCION_LAPIDAS.days} dias. Se debe programar ' \
+           f'periodicamente'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{purgar_lapidas()} lapidas borradas')
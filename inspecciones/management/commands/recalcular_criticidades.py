@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inspecciones.criticidad import recalcular_criticidades
+from inspecciones.models import Organizacion, Inspeccion
+from inspecciones.tablero import invalidar_tablero
+
+
+class Command(BaseCommand):
+    help = 'Recalcula en el servidor las criticidades de las inspecciones guardadas y de sus respuestas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organizacion', type=int, action='append',
+                            help='id de la organizacion a recalcular, se puede repetir. Por defecto todas')
+
+    def handle(self, *args, **options):
+        organizaciones = Organizacion.objects.order_by('pk')
+        if options['organizacion']:
+            organizaciones = organizaciones.filter(pk__in=options['organizacion'])
+        for organizacion in organizaciones:
+            with transaction.atomic():
+                cambios = recalcular_criticidades(
+                    Inspeccion.objects.filter(cuestionario__organizacion=organizacion))
+                invalidar_tablero(organizacion.pk)
+            self.stdout.write(f'{organizacion}: {cambios["respuestas"]} respuestas y '
+                              f'{cambios["inspecciones"]} inspecciones actualizadas')
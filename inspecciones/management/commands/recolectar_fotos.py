@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from inspecciones.recoleccion import recolectar_fotos, GRACIA
+
+
+class Command(BaseCommand):
+    help = 'Borra las fotos que siguen sin respuesta, pregunta ni titulo despues del periodo de gracia, las subidas ' \
+           'abandonadas y los archivos de fotos que ya no se usan. Se debe programar periodicamente'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horas-de-gracia', type=float, default=GRACIA.total_seconds() / 3600,
+                            help='horas que una foto debe seguir huerfana antes de borrarla. Por defecto %(default)s')
+        parser.add_argument('--simular', action='store_true',
+                            help='no modifica nada, solo reporta lo que se borraria')
+
+    def handle(self, *args, **options):
+        resumen = recolectar_fotos(timedelta(hours=options['horas_de_gracia']), options['simular'])
+        marcadas, borradas = ('se marcarian', 'Se borrarian') if options['simular'] else ('marcadas', 'Se borraron')
+        self.stdout.write(f"{resumen['fotos_marcadas']} fotos {marcadas} como huerfanas")
+        self.stdout.write(f"{borradas} {resumen['fotorespuesta']} fotos de respuestas, "
+                          f"{resumen['fotocuestionario']} fotos de cuestionarios, {resumen['subidas']} subidas y "
+                          f"{resumen['archivos']} archivos ({resumen['bytes']} bytes)")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from inspecciones.models import Organizacion
+from inspecciones.planeacion import recalcular_planeacion_de_organizacion
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye la tabla de planeacion (activo, cuestionario) desde las inspecciones guardadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organizacion', type=int, action='append',
+                            help='id de la organizacion a reconstruir, se puede repetir. Por defecto todas')
+
+    def handle(self, *args, **options):
+        organizaciones = Organizacion.objects.order_by('pk')
+        if options['organizacion']:
+            organizaciones = organizaciones.filter(pk__in=options['organizacion'])
+        # una organizacion a la vez para no cargar la planeacion de todas en memoria
+        for organizacion in organizaciones:
+            filas = recalcular_planeacion_de_organizacion(organizacion)
+            self.stdout.write(f'{organizacion}: {filas} filas de planeacion')
@@ -0,0 +1,39 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from inspecciones.trabajos import procesar_pendientes, nombre_de_trabajador
+
+
+class Command(BaseCommand):
+    help = 'Proceso trabajador que ejecuta los trabajos en segundo plano. Se pueden iniciar varios en paralelo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tipo', action='append',
+                            help='solo ejecuta trabajos de esta tarea, se puede repetir. Por defecto todas')
+        parser.add_argument('--espera', type=float, default=2,
+                            help='segundos entre consultas cuando no hay trabajos pendientes')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='ejecuta los trabajos disponibles y termina')
+
+    def handle(self, *args, **options):
+        trabajador = nombre_de_trabajador()
+        parar = False
+
+        def pedir_parada(*_):
+            # termina el trabajo en curso antes de salir
+            nonlocal parar
+            parar = True
+
+        signal.signal(signal.SIGTERM, pedir_parada)
+        signal.signal(signal.SIGINT, pedir_parada)
+        self.stdout.write(f'trabajador {trabajador} iniciado')
+        while not parar:
+            ejecutados = procesar_pendientes(trabajador, options['tipo'], debe_parar=lambda: parar)
+            if ejecutados:
+                self.stdout.write(f'{ejecutados} trabajos ejecutados')
+            if options['una_vez']:
+                break
+            if not ejecutados:
+                time.sleep(options['espera'])
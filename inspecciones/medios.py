@@ -0,0 +1,127 @@
+"""Entrega de los archivos de media. Django solo verifica que el usuario pueda ver el archivo y arma las cabeceras de
+cache, la transferencia la hace el servidor web si esta configurado:
+
+- INSPECCIONES_X_ACCEL_REDIRECT = '/media-interna/': nginx con una location internal que apunta a MEDIA_ROOT
+- INSPECCIONES_X_SENDFILE = True: apache o lighttpd con mod_xsendfile
+- sin configurar se envia con FileResponse, que el servidor wsgi puede enviar con sendfile
+
+Los archivos del almacenamiento por contenido nunca cambian, se cachean un año y su hash es el ETag. Los demas se
+revalidan siempre con ETag y Last-Modified"""
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from inspecciones.models import FotoCuestionario, FotoRespuesta, Importacion, Trabajo, Organizacion, Perfil
+from inspecciones.recoleccion import HUERFANAS
+
+UN_ANO = 365 * 24 * 60 * 60
+
+_POR_CONTENIDO = re.compile(r'^[0-9a-f]{64}$')
+
+# caminos de cada foto a la organizacion que la usa
+_ORGANIZACIONES_DE_FOTOS = {
+    FotoRespuesta: ['respuesta__inspeccion__cuestionario__organizacion',
+                    'respuesta__respuesta_cuadricula__inspeccion__cuestionario__organizacion',
+                    'respuesta__respuesta_multiple__inspeccion__cuestionario__organizacion',
+                    'respuesta__respuesta_multiple__respuesta_cuadricula__inspeccion__cuestionario__organizacion'],
+    FotoCuestionario: ['titulo__bloque__cuestionario__organizacion',
+                       'pregunta__bloque__cuestionario__organizacion',
+                       'pregunta__cuadricula__bloque__cuestionario__organizacion'],
+}
+
+
+def _foto_visible(Modelo, nombre, organizacion):
+    """Un archivo de fotos puede estar compartido entre organizaciones, basta que una foto de [organizacion] lo use.
+    Las fotos sin asociar, recien subidas o ya desasociadas, solo las ve la organizacion que las subio"""
+    visibles = HUERFANAS[Modelo] & Q(organizacion=organizacion)
+    for camino in _ORGANIZACIONES_DE_FOTOS[Modelo]:
+        visibles |= Q(**{camino: organizacion})
+    return Modelo.objects.filter(Q(foto=nombre) | Q(miniatura=nombre) | Q(mediana=nombre), visibles).exists()
+
+
+def _exportacion_visible(nombre, organizacion):
+    return Trabajo.objects.filter(organizacion=organizacion, resultado__archivo=default_storage.url(nombre)).exists()
+
+
+# por la primera carpeta del nombre
+_VISIBLE = {
+    'fotos_inspecciones': lambda nombre, organizacion: _foto_visible(FotoRespuesta, nombre, organizacion),
+    'fotos_cuestionarios': lambda nombre, organizacion: _foto_visible(FotoCuestionario, nombre, organizacion),
+    'exportaciones': _exportacion_visible,
+    'importaciones': lambda nombre, organizacion: Importacion.objects.filter(
+        archivo=nombre, organizacion=organizacion).exists(),
+    'logos_organizaciones': lambda nombre, organizacion: Organizacion.objects.filter(
+        pk=organizacion, logo=nombre).exists(),
+    'fotos_perfiles': lambda nombre, organizacion: Perfil.objects.filter(
+        organizacion=organizacion, foto=nombre).exists(),
+}
+
+
+def puede_ver(usuario, nombre):
+    """Si [usuario] puede descargar el archivo [nombre] de media. Los de la raiz son los valores por defecto de los
+    campos, como blank.jpg, y los puede ver cualquiera"""
+    if usuario.is_superuser:
+        return True
+    carpeta, _, resto = nombre.partition('/')
+    if not resto:
+        return True
+    perfil = getattr(usuario, 'perfil', None)
+    if perfil is None or perfil.organizacion_id is None or carpeta not in _VISIBLE:
+        return False
+    return _VISIBLE[carpeta](nombre, perfil.organizacion_id)
+
+
+def es_por_contenido(nombre):
+    """Si [nombre] es de un archivo del almacenamiento por contenido, cuyo nombre es el sha256 del contenido"""
+    return nombre.split('/', 1)[0] in ('fotos_inspecciones', 'fotos_cuestionarios') and \
+        bool(_POR_CONTENIDO.match(os.path.splitext(os.path.basename(nombre))[0]))
+
+
+def respuesta_de_archivo(request, nombre):
+    """Respuesta con el archivo [nombre] de media, o 304 si el cliente ya tiene esta version"""
+    ruta = default_storage.path(nombre)
+    try:
+        estado = os.stat(ruta)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not stat.S_ISREG(estado.st_mode):
+        raise Http404
+    inmutable = es_por_contenido(nombre)
+    if inmutable:
+        etag = f'"{os.path.splitext(os.path.basename(nombre))[0]}"'
+    else:
+        etag = f'"{estado.st_mtime_ns:x}-{estado.st_size:x}"'
+    ultima_modificacion = int(estado.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=ultima_modificacion)
+    if response is None:
+        response = _enviar(ruta, nombre)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(ultima_modificacion)
+    # private porque depende del usuario, ningun proxy compartido la debe guardar
+    response['Cache-Control'] = f'private, max-age={UN_ANO}, immutable' if inmutable else 'private, no-cache'
+    return response
+
+
+def _enviar(ruta, nombre):
+    interna = getattr(settings, 'INSPECCIONES_X_ACCEL_REDIRECT', None)
+    if interna or getattr(settings, 'INSPECCIONES_X_SENDFILE', False):
+        content_type, encoding = mimetypes.guess_type(nombre)
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if interna:
+            response['X-Accel-Redirect'] = interna.rstrip('/') + '/' + quote(nombre)
+        else:
+            response['X-Sendfile'] = os.path.abspath(ruta)
+        return response
+    return FileResponse(open(ruta, 'rb'))
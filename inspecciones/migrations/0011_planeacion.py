@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0010_alter_fotorespuesta_respuesta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Planeacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('momento_ultima_inspeccion', models.DateTimeField(null=True)),
+                ('vencimiento', models.DateTimeField()),
+                ('activo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='planeaciones', to='inspecciones.activo')),
+                ('cuestionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='planeaciones', to='inspecciones.cuestionario')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['vencimiento'], name='inspeccione_vencimi_ab4754_idx')],
+                'constraints': [models.UniqueConstraint(fields=('activo', 'cuestionario'), name='inspecciones_planeacion_unica')],
+            },
+        ),
+    ]
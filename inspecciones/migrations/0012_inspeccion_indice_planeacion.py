@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0011_planeacion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inspeccion',
+            index=models.Index(fields=['activo', 'cuestionario', 'momento_finalizacion'], name='inspeccione_activo__4c6b9b_idx'),
+        ),
+    ]
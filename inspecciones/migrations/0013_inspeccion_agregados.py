@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0012_inspeccion_indice_planeacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inspeccion',
+            name='criticidad_maxima',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='inspeccion',
+            name='preguntas_respondidas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='inspeccion',
+            name='total_preguntas',
+            field=models.IntegerField(default=0),
+        ),
+    ]
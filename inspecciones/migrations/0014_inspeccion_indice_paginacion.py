@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0013_inspeccion_agregados'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inspeccion',
+            index=models.Index(fields=['momento_subida', 'id'], name='inspeccione_momento_45a2b6_idx'),
+        ),
+    ]
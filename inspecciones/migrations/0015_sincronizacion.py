@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0014_inspeccion_indice_paginacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activo',
+            name='momento_modificacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='cuestionario',
+            name='momento_modificacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='etiquetajerarquicadeactivo',
+            name='momento_modificacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='etiquetajerarquicadepregunta',
+            name='momento_modificacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='inspeccion',
+            name='momento_modificacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='Eliminacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recurso', models.CharField(max_length=50)),
+                ('id_objeto', models.CharField(max_length=200)),
+                ('momento', models.DateTimeField(auto_now_add=True)),
+                ('organizacion', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='inspecciones.organizacion')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['organizacion', 'recurso', 'momento'], name='inspeccione_organiz_ed0899_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:08
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0015_sincronizacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Importacion',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('archivo', models.FileField(upload_to='importaciones')),
+                ('formato', models.CharField(choices=[('csv', 'Csv'), ('xlsx', 'Xlsx')], max_length=10)),
+                ('tamano_lote', models.IntegerField()),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('terminada', 'Terminada'), ('fallida', 'Fallida')], default='pendiente', max_length=20)),
+                ('filas_procesadas', models.IntegerField(default=0)),
+                ('creados', models.IntegerField(default=0)),
+                ('actualizados', models.IntegerField(default=0)),
+                ('filas_con_error', models.IntegerField(default=0)),
+                ('errores', models.JSONField(default=list)),
+                ('mensaje', models.TextField(blank=True)),
+                ('momento_creacion', models.DateTimeField(auto_now_add=True)),
+                ('momento_fin', models.DateTimeField(null=True)),
+                ('creador', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='importaciones', to='inspecciones.perfil')),
+                ('organizacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='importaciones', to='inspecciones.organizacion')),
+            ],
+        ),
+    ]
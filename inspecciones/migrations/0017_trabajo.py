@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:15
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0016_importacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trabajo',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('tipo', models.CharField(max_length=100)),
+                ('parametros', models.JSONField(default=dict)),
+                ('prioridad', models.IntegerField(default=0)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('terminado', 'Terminado'), ('fallido', 'Fallido')], default='pendiente', max_length=20)),
+                ('intentos', models.IntegerField(default=0)),
+                ('maximo_intentos', models.IntegerField(default=3)),
+                ('disponible_desde', models.DateTimeField(default=django.utils.timezone.now)),
+                ('avance', models.FloatField(default=0)),
+                ('resultado', models.JSONField(null=True)),
+                ('error', models.TextField(blank=True)),
+                ('trabajador', models.CharField(blank=True, max_length=200)),
+                ('momento_creacion', models.DateTimeField(auto_now_add=True)),
+                ('momento_inicio', models.DateTimeField(null=True)),
+                ('momento_fin', models.DateTimeField(null=True)),
+                ('creador', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trabajos', to='inspecciones.perfil')),
+                ('organizacion', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='trabajos', to='inspecciones.organizacion')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', '-prioridad', 'disponible_desde'], name='inspeccione_estado_0b63de_idx')],
+            },
+        ),
+    ]
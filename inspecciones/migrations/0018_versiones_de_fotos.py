@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0017_trabajo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotocuestionario',
+            name='mediana',
+            field=models.ImageField(blank=True, upload_to='fotos_cuestionarios/medianas'),
+        ),
+        migrations.AddField(
+            model_name='fotocuestionario',
+            name='miniatura',
+            field=models.ImageField(blank=True, upload_to='fotos_cuestionarios/miniaturas'),
+        ),
+        migrations.AddField(
+            model_name='fotocuestionario',
+            name='procesada',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='fotorespuesta',
+            name='mediana',
+            field=models.ImageField(blank=True, upload_to='fotos_inspecciones/medianas'),
+        ),
+        migrations.AddField(
+            model_name='fotorespuesta',
+            name='miniatura',
+            field=models.ImageField(blank=True, upload_to='fotos_inspecciones/miniaturas'),
+        ),
+        migrations.AddField(
+            model_name='fotorespuesta',
+            name='procesada',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:22
+
+import inspecciones.almacenamiento
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0018_versiones_de_fotos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferenciaDeArchivo',
+            fields=[
+                ('nombre', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('referencias', models.IntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fotocuestionario',
+            name='hash_subida',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='fotorespuesta',
+            name='hash_subida',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='fotocuestionario',
+            name='foto',
+            field=models.ImageField(max_length=255, storage=inspecciones.almacenamiento.almacenamiento_de_fotos, upload_to='fotos_cuestionarios'),
+        ),
+        migrations.AlterField(
+            model_name='fotocuestionario',
+            name='mediana',
+            field=models.ImageField(blank=True, max_length=255, storage=inspecciones.almacenamiento.almacenamiento_de_fotos, upload_to='fotos_cuestionarios/medianas'),
+        ),
+        migrations.AlterField(
+            model_name='fotocuestionario',
+            name='miniatura',
+            field=models.ImageField(blank=True, max_length=255, storage=inspecciones.almacenamiento.almacenamiento_de_fotos, upload_to='fotos_cuestionarios/miniaturas'),
+        ),
+        migrations.AlterField(
+            model_name='fotorespuesta',
+            name='foto',
+            field=models.ImageField(max_length=255, storage=inspecciones.almacenamiento.almacenamiento_de_fotos, upload_to='fotos_inspecciones'),
+        ),
+        migrations.AlterField(
+            model_name='fotorespuesta',
+            name='mediana',
+            field=models.ImageField(blank=True, max_length=255, storage=inspecciones.almacenamiento.almacenamiento_de_fotos, upload_to='fotos_inspecciones/medianas'),
+        ),
+        migrations.AlterField(
+            model_name='fotorespuesta',
+            name='miniatura',
+            field=models.ImageField(blank=True, max_length=255, storage=inspecciones.almacenamiento.almacenamiento_de_fotos, upload_to='fotos_inspecciones/miniaturas'),
+        ),
+    ]
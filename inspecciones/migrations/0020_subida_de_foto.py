@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:24
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0019_almacenamiento_por_contenido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubidaDeFoto',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('destino', models.CharField(choices=[('cuestionario', 'Cuestionario'), ('inspeccion', 'Inspeccion')], max_length=20)),
+                ('nombre', models.CharField(max_length=255)),
+                ('tamano', models.BigIntegerField()),
+                ('hash', models.CharField(blank=True, max_length=64)),
+                ('recibidos', models.BigIntegerField(default=0)),
+                ('foto', models.UUIDField(null=True)),
+                ('momento_creacion', models.DateTimeField(auto_now_add=True)),
+                ('momento_modificacion', models.DateTimeField(auto_now=True)),
+                ('creador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subidas_de_fotos', to='inspecciones.perfil')),
+            ],
+        ),
+    ]
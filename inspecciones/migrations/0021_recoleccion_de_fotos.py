@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0020_subida_de_foto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotocuestionario',
+            name='huerfana_desde',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fotorespuesta',
+            name='huerfana_desde',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0021_recoleccion_de_fotos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajo',
+            name='vencimiento',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inspecciones', '0022_vencimiento_de_trabajos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotocuestionario',
+            name='organizacion',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inspecciones.organizacion'),
+        ),
+        migrations.AddField(
+            model_name='fotorespuesta',
+            name='organizacion',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inspecciones.organizacion'),
+        ),
+    ]
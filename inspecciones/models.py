@@ -7,8 +7,10 @@ from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.db.models import Q
 from django.urls import reverse
+from django.utils import timezone
 from multiselectfield import MultiSelectField
 
+from inspecciones.almacenamiento import almacenamiento_de_fotos
 from inspecciones.q_logic import different, if_and_only_if
 
 
@@ -50,6 +52,8 @@ class Perfil(models.Model):
 class EtiquetaJerarquica(models.Model):
     nombre = models.CharField(max_length=200, primary_key=True)
     json = models.JSONField()
+    # se actualiza en cada cambio, la sincronizacion entrega solo lo modificado desde el token del cliente
+    momento_modificacion = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         abstract = True
@@ -99,6 +103,8 @@ class Activo(models.Model):
     identificador = models.CharField(max_length=120)
     etiquetas = models.ManyToManyField(EtiquetaDeActivo, related_name='activos')
     organizacion = models.ForeignKey(Organizacion, related_name='activos', on_delete=models.CASCADE)
+    # se actualiza en cada cambio, la sincronizacion entrega solo lo modificado desde el token del cliente
+    momento_modificacion = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         constraints = [
@@ -109,19 +115,11 @@ class Activo(models.Model):
         return self.identificador
 
     def estado_planeacion_por_cuestionario(self):
-        cuestionarios_que_aplican = Cuestionario.objects.filter(etiquetas_aplicables__in=self.etiquetas.all(),
-                                                                estado=Cuestionario.EstadoDeCuestionario.finalizado)
-        res = []
-        for cuestionario in cuestionarios_que_aplican:
-            ultima_inspeccion = self.inspecciones.filter(cuestionario=cuestionario).order_by('-momento_finalizacion').first()
-            if ultima_inspeccion and ultima_inspeccion.momento_finalizacion is not None:
-                dias_desde_inspeccion = datetime.now().astimezone()-ultima_inspeccion.momento_finalizacion
-            else:
-                # si no se ha inspeccionado nunca
-                dias_desde_inspeccion = datetime.now().astimezone()-cuestionario.momento_subida
-            retraso = max(0, dias_desde_inspeccion.days - cuestionario.periodicidad_dias)
-            res.append({"cuestionario": cuestionario, "ultima_inspeccion": ultima_inspeccion, "retraso": retraso})
-        return res
+        """Lee la tabla de planeacion, que se mantiene actualizada desde inspecciones.planeacion"""
+        return [{"cuestionario": planeacion.cuestionario,
+                 "momento_ultima_inspeccion": planeacion.momento_ultima_inspeccion,
+                 "retraso": planeacion.retraso}
+                for planeacion in self.planeaciones.select_related('cuestionario')]
 
 
 class Cuestionario(models.Model):
@@ -133,6 +131,8 @@ class Cuestionario(models.Model):
     # si es null es porque el usuario que lo creó ya no existe
     creador = models.ForeignKey(Perfil, related_name='cuestionarios_creados', null=True, on_delete=models.SET_NULL)
     momento_subida = models.DateTimeField(auto_now_add=True)
+    # se actualiza en cada cambio, la sincronizacion entrega solo lo modificado desde el token del cliente
+    momento_modificacion = models.DateTimeField(auto_now=True, db_index=True)
     etiquetas_aplicables = models.ManyToManyField(EtiquetaDeActivo, related_name='cuestionarios')
 
     class EstadoDeCuestionario(models.TextChoices):
@@ -160,30 +160,81 @@ class Bloque(models.Model):
         return f'{self.n_orden}'
 
 
-class FotoCuestionario(models.Model):
+class VersionesDeFoto:
+    """Las fotos se guardan tal como llegan y la tarea procesar_fotos genera despues la miniatura, la mediana y
+    reemplaza la original por una recodificada"""
+
+    @property
+    def versiones(self):
+        """Urls de cada version, mientras la foto no se procesa todas son la original"""
+        original = self.foto.url
+        return {'miniatura': self.miniatura.url if self.miniatura else original,
+                'mediana': self.mediana.url if self.mediana else original,
+                'original': original}
+
+    def compartir_archivos(self, organizacion_id):
+        """Crea otra foto de [organizacion_id], sin respuesta ni pregunta, que usa los mismos archivos que esta. No
+        escribe nada en el almacenamiento, solo suma una referencia a cada archivo"""
+        nueva = type(self)(foto=self.foto.name, miniatura=self.miniatura.name, mediana=self.mediana.name,
+                           procesada=self.procesada, hash_subida=self.hash_subida, organizacion_id=organizacion_id)
+        for archivo in (self.foto, self.miniatura, self.mediana):
+            if archivo:
+                archivo.storage.referenciar(archivo.name)
+        nueva.save()
+        return nueva
+
+
+class ReferenciaDeArchivo(models.Model):
+    """Cuantos campos apuntan a cada archivo del almacenamiento por contenido, ver inspecciones.almacenamiento"""
+    nombre = models.CharField(max_length=255, primary_key=True)
+    referencias = models.IntegerField()
+
+
+class SubidaDeFoto(models.Model):
+    """Subida de una foto por partes que se puede retomar si se corta la conexion, ver inspecciones.subidas. Los
+    bytes recibidos se escriben en un archivo parcial que la vista de medios no entrega hasta que se finaliza"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    creador = models.ForeignKey(Perfil, related_name='subidas_de_fotos', on_delete=models.CASCADE)
+
+    class Destinos(models.TextChoices):
+        cuestionario = 'cuestionario'
+        inspeccion = 'inspeccion'
+
+    destino = models.CharField(choices=Destinos.choices, max_length=20)
+    nombre = models.CharField(max_length=255)
+    tamano = models.BigIntegerField()
+    # opcional, si se envia se verifica al finalizar
+    hash = models.CharField(max_length=64, blank=True)
+    # los bytes desde el inicio que ya estan escritos
+    recibidos = models.BigIntegerField(default=0)
+    # la foto creada al finalizar
+    foto = models.UUIDField(null=True)
+    momento_creacion = models.DateTimeField(auto_now_add=True)
+    momento_modificacion = models.DateTimeField(auto_now=True)
+
+
+class FotoCuestionario(VersionesDeFoto, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
-    foto = models.ImageField(upload_to='fotos_cuestionarios')
+    foto = models.ImageField(upload_to='fotos_cuestionarios', storage=almacenamiento_de_fotos, max_length=255)
+    miniatura = models.ImageField(upload_to='fotos_cuestionarios/miniaturas', storage=almacenamiento_de_fotos,
+                                  max_length=255, blank=True)
+    mediana = models.ImageField(upload_to='fotos_cuestionarios/medianas', storage=almacenamiento_de_fotos, max_length=255,
+                                blank=True)
+    procesada = models.BooleanField(default=False)
+    # sha256 del archivo como se subio, la original procesada ya no tiene este contenido
+    hash_subida = models.CharField(max_length=64, blank=True, db_index=True)
     content_type = models.ForeignKey(ContentType, null=True, on_delete=models.CASCADE)
     object_id = models.UUIDField(null=True)
     content_object = GenericForeignKey()
+    # la organizacion que la subio, mientras no este asociada solo ella la puede ver
+    organizacion = models.ForeignKey(Organizacion, related_name='+', null=True, on_delete=models.SET_NULL)
+    # cuando el recolector la encontro sin pregunta ni titulo, ver inspecciones.recoleccion
+    huerfana_desde = models.DateTimeField(null=True, db_index=True)
 
     def __str__(self):
         return self.foto.path
 
 
-from django.db.models.signals import post_delete
-from django.dispatch import receiver
-
-
-@receiver(post_delete, sender=FotoCuestionario)
-def post_foto_cuestionario_deleted(sender, instance, using, **kwargs):
-    """Evita el borrado en cascada de las fotos cuando se elimina el cuestionario
-    TODO: hacer tests
-    TODO: programar la ejecucion de una tarea de limpieza de las fotos huerfanas"""
-    instance.object_id = None
-    instance.save()
-
-
 class Titulo(models.Model):
     id = models.UUIDField(primary_key=True)
     bloque = models.OneToOneField(Bloque, on_delete=models.CASCADE, related_name='titulo')
@@ -284,6 +335,8 @@ class Inspeccion(models.Model):
     momento_inicio = models.DateTimeField()
     momento_finalizacion = models.DateTimeField(null=True)
     momento_subida = models.DateTimeField(auto_now_add=True)
+    # se actualiza en cada cambio, la sincronizacion entrega solo lo modificado desde el token del cliente
+    momento_modificacion = models.DateTimeField(auto_now=True, db_index=True)
     avance = models.FloatField(default= 0.0)
 
     class EstadoDeInspeccion(models.TextChoices):
@@ -296,14 +349,149 @@ class Inspeccion(models.Model):
     criticidad_calculada = models.IntegerField()
     criticidad_calculada_con_reparaciones = models.IntegerField()
 
+    # contadores que se mantienen al escribir las respuestas, ver inspecciones.agregados
+    preguntas_respondidas = models.IntegerField(default=0)
+    total_preguntas = models.IntegerField(default=0)
+    criticidad_maxima = models.IntegerField(default=0)
+
+    class Meta:
+        # la ultima finalizacion por (activo, cuestionario) se resuelve con este indice, ver inspecciones.planeacion
+        indexes = [models.Index(fields=['activo', 'cuestionario', 'momento_finalizacion']),
+                   # llave de la paginacion del listado, ver views_api.PaginacionPorCursor
+                   models.Index(fields=['momento_subida', 'id'])]
+
     def get_avance(self):
         return self.avance * 100
 
 
-class FotoRespuesta(models.Model):
+class Planeacion(models.Model):
+    """Fila desnormalizada por cada par (activo, cuestionario que le aplica), permite mostrar la planeacion de toda
+    una organizacion con una consulta. Se recalcula desde inspecciones.planeacion cuando cambian sus fuentes"""
+    activo = models.ForeignKey(Activo, on_delete=models.CASCADE, related_name='planeaciones')
+    cuestionario = models.ForeignKey(Cuestionario, on_delete=models.CASCADE, related_name='planeaciones')
+    # null si el activo nunca se ha inspeccionado con este cuestionario
+    momento_ultima_inspeccion = models.DateTimeField(null=True)
+    # la ultima finalizacion (o la subida del cuestionario) mas la periodicidad, desde aqui se cuenta el retraso
+    vencimiento = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['activo', 'cuestionario'], name='%(app_label)s_%(class)s_unica')
+        ]
+        indexes = [models.Index(fields=['vencimiento'])]
+
+    @property
+    def retraso(self):
+        return Planeacion.calcular_retraso(self.vencimiento)
+
+    @staticmethod
+    def calcular_retraso(vencimiento):
+        """dias completos de retraso, se calcula al leer porque depende de la fecha actual"""
+        return max(0, (datetime.now().astimezone() - vencimiento).days)
+
+
+class Trabajo(models.Model):
+    """Operacion pesada que se ejecuta en segundo plano. Los procesos del comando trabajador toman los pendientes por
+    prioridad y los reintentan si fallan, ver inspecciones.trabajos"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    # null para los trabajos que no son de una organizacion, como los de mantenimiento
+    organizacion = models.ForeignKey(Organizacion, related_name='trabajos', null=True, on_delete=models.CASCADE)
+    creador = models.ForeignKey(Perfil, related_name='trabajos', null=True, on_delete=models.SET_NULL)
+    # nombre de la tarea registrada y sus argumentos
+    tipo = models.CharField(max_length=100)
+    parametros = models.JSONField(default=dict)
+    # se toman primero los de mayor prioridad
+    prioridad = models.IntegerField(default=0)
+
+    class Estados(models.TextChoices):
+        pendiente = 'pendiente'
+        procesando = 'procesando'
+        terminado = 'terminado'
+        fallido = 'fallido'
+
+    estado = models.CharField(choices=Estados.choices, max_length=20, default=Estados.pendiente)
+    intentos = models.IntegerField(default=0)
+    maximo_intentos = models.IntegerField(default=3)
+    # despues de un fallo se espera antes de reintentar
+    disponible_desde = models.DateTimeField(default=timezone.now)
+    # fraccion entre 0 y 1
+    avance = models.FloatField(default=0)
+    resultado = models.JSONField(null=True)
+    error = models.TextField(blank=True)
+    trabajador = models.CharField(max_length=200, blank=True)
+    # mientras se procesa, si el trabajador no lo renueva antes de este momento se da por caido y se retoma
+    vencimiento = models.DateTimeField(null=True)
+    momento_creacion = models.DateTimeField(auto_now_add=True)
+    momento_inicio = models.DateTimeField(null=True)
+    momento_fin = models.DateTimeField(null=True)
+
+    class Meta:
+        # la cola de los trabajadores
+        indexes = [models.Index(fields=['estado', '-prioridad', 'disponible_desde'])]
+
+
+class Importacion(models.Model):
+    """Trabajo de carga masiva de activos desde un archivo. Se procesa por lotes fuera de la peticion que lo crea y
+    el cliente consulta su avance, ver inspecciones.importacion"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    organizacion = models.ForeignKey(Organizacion, related_name='importaciones', on_delete=models.CASCADE)
+    creador = models.ForeignKey(Perfil, related_name='importaciones', null=True, on_delete=models.SET_NULL)
+    archivo = models.FileField(upload_to='importaciones')
+
+    class Formatos(models.TextChoices):
+        csv = 'csv'
+        xlsx = 'xlsx'
+
+    formato = models.CharField(choices=Formatos.choices, max_length=10)
+    # filas por transaccion
+    tamano_lote = models.IntegerField()
+
+    class Estados(models.TextChoices):
+        pendiente = 'pendiente'
+        procesando = 'procesando'
+        terminada = 'terminada'
+        fallida = 'fallida'
+
+    estado = models.CharField(choices=Estados.choices, max_length=20, default=Estados.pendiente)
+    filas_procesadas = models.IntegerField(default=0)
+    creados = models.IntegerField(default=0)
+    actualizados = models.IntegerField(default=0)
+    filas_con_error = models.IntegerField(default=0)
+    # solo los primeros errores, ver importacion.MAXIMO_ERRORES_GUARDADOS
+    errores = models.JSONField(default=list)
+    mensaje = models.TextField(blank=True)
+    momento_creacion = models.DateTimeField(auto_now_add=True)
+    momento_fin = models.DateTimeField(null=True)
+
+
+class Eliminacion(models.Model):
+    """Lapida de un objeto borrado, la sincronizacion la entrega para que los clientes tambien lo borren. No tiene
+    llave foranea real porque se registra durante los borrados en cascada, incluso los de la misma organizacion"""
+    recurso = models.CharField(max_length=50)
+    id_objeto = models.CharField(max_length=200)
+    organizacion = models.ForeignKey(Organizacion, on_delete=models.DO_NOTHING, db_constraint=False,
+                                     related_name='+')
+    momento = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['organizacion', 'recurso', 'momento'])]
+
+
+class FotoRespuesta(VersionesDeFoto, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
-    foto = models.ImageField(upload_to='fotos_inspecciones')
+    foto = models.ImageField(upload_to='fotos_inspecciones', storage=almacenamiento_de_fotos, max_length=255)
+    miniatura = models.ImageField(upload_to='fotos_inspecciones/miniaturas', storage=almacenamiento_de_fotos,
+                                  max_length=255, blank=True)
+    mediana = models.ImageField(upload_to='fotos_inspecciones/medianas', storage=almacenamiento_de_fotos, max_length=255,
+                                blank=True)
+    procesada = models.BooleanField(default=False)
+    # sha256 del archivo como se subio, la original procesada ya no tiene este contenido
+    hash_subida = models.CharField(max_length=64, blank=True, db_index=True)
     respuesta = models.ForeignKey('Respuesta', null=True, on_delete=models.SET_NULL, related_name='fotos')
+    # la organizacion que la subio, mientras no este asociada solo ella la puede ver
+    organizacion = models.ForeignKey(Organizacion, related_name='+', null=True, on_delete=models.SET_NULL)
+    # cuando el recolector la encontro sin respuesta, ver inspecciones.recoleccion
+    huerfana_desde = models.DateTimeField(null=True, db_index=True)
 
     class TiposDeFoto(models.TextChoices):
         base = 'base'
@@ -315,6 +503,55 @@ class FotoRespuesta(models.Model):
         return f'{self.tipo}: {self.foto.path}'
 
 
+class RespuestaManager(models.Manager):
+    def de_inspecciones(self, inspecciones):
+        """Todas las respuestas del arbol de [inspecciones] (ids o queryset) en una sola consulta. El arbol tiene
+        maximo 3 niveles: cuadricula -> seleccion multiple -> parte de seleccion multiple"""
+        return self.filter(Q(inspeccion__in=inspecciones) |
+                           Q(respuesta_cuadricula__inspeccion__in=inspecciones) |
+                           Q(respuesta_multiple__inspeccion__in=inspecciones) |
+                           Q(respuesta_multiple__respuesta_cuadricula__inspeccion__in=inspecciones))
+
+    def cargar_arboles(self, inspecciones, select_related=()):
+        """Carga con dos consultas todas las respuestas de [inspecciones] y sus fotos, y deja el arbol armado en el
+        cache de prefetch de cada inspeccion y de cada respuesta, asi recorrerlo no hace mas consultas. Retorna las
+        respuestas cargadas"""
+        inspecciones = {inspeccion.id: inspeccion for inspeccion in inspecciones}
+        arbol = self.de_inspecciones(list(inspecciones)).select_related(*select_related)
+        respuestas = {respuesta.id: respuesta for respuesta in arbol}
+        hijos = {id_respuesta: {'subrespuestas_cuadricula': [], 'subrespuestas_multiple': [], 'fotos': []}
+                 for id_respuesta in respuestas}
+        raices = {id_inspeccion: [] for id_inspeccion in inspecciones}
+
+        for respuesta in respuestas.values():
+            if respuesta.inspeccion_id in raices:
+                raices[respuesta.inspeccion_id].append(respuesta)
+            if respuesta.respuesta_cuadricula_id in hijos:
+                hijos[respuesta.respuesta_cuadricula_id]['subrespuestas_cuadricula'].append(respuesta)
+            if respuesta.respuesta_multiple_id in hijos:
+                hijos[respuesta.respuesta_multiple_id]['subrespuestas_multiple'].append(respuesta)
+        for foto in FotoRespuesta.objects.filter(respuesta__in=arbol):
+            hijos[foto.respuesta_id]['fotos'].append(foto)
+
+        for id_respuesta, relaciones in hijos.items():
+            for relacion, objetos in relaciones.items():
+                _fijar_prefetch(respuestas[id_respuesta], relacion, objetos)
+        for id_inspeccion, objetos in raices.items():
+            _fijar_prefetch(inspecciones[id_inspeccion], 'respuestas', objetos)
+        return list(respuestas.values())
+
+
+def _fijar_prefetch(instancia, relacion, objetos):
+    """Deja [objetos] como resultado de instancia.relacion.all(), igual que lo hace prefetch_related"""
+    if not hasattr(instancia, '_prefetched_objects_cache'):
+        instancia._prefetched_objects_cache = {}
+    instancia._prefetched_objects_cache.pop(relacion, None)
+    queryset = getattr(instancia, relacion).all()
+    queryset._result_cache = objetos
+    queryset._prefetch_done = True
+    instancia._prefetched_objects_cache[relacion] = queryset
+
+
 class Respuesta(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     observacion = models.CharField(max_length=1500, blank=True)
@@ -324,11 +561,17 @@ class Respuesta(models.Model):
 
     @property
     def fotos_base(self):
-        return self.fotos.filter(tipo=FotoRespuesta.TiposDeFoto.base)
+        return self._fotos_de_tipo(FotoRespuesta.TiposDeFoto.base)
 
     @property
     def fotos_reparacion(self):
-        return self.fotos.filter(tipo=FotoRespuesta.TiposDeFoto.reparacion)
+        return self._fotos_de_tipo(FotoRespuesta.TiposDeFoto.reparacion)
+
+    def _fotos_de_tipo(self, tipo):
+        # si las fotos ya se cargaron con el arbol se filtran en memoria
+        if 'fotos' in getattr(self, '_prefetched_objects_cache', {}):
+            return [foto for foto in self.fotos.all() if foto.tipo == tipo]
+        return self.fotos.filter(tipo=tipo)
 
     class TiposDeRespuesta(models.TextChoices):
         cuadricula = 'cuadricula'
@@ -374,6 +617,8 @@ class Respuesta(models.Model):
     # no null para las respuestas tipo numerica
     valor_numerico = models.FloatField(null=True)
 
+    objects = RespuestaManager()
+
     class Meta:
         constraints = [
             # las contraints que referencian a otras tablas no se pueden aplicar aqui
@@ -0,0 +1,116 @@
+"""Calculo por conjuntos de la planeacion (activo, cuestionario) y mantenimiento de la tabla Planeacion. Cada funcion
+cuesta un numero fijo de consultas sin importar cuantos activos o cuestionarios haya."""
+from datetime import timedelta
+from functools import partial, reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inspecciones.carga_masiva import TAMANO_LOTE
+from inspecciones.models import Activo, Cuestionario, Inspeccion, Planeacion
+
+
+def pares_de_planeacion(activos):
+    """Queryset de valores con un elemento por cada par (activo de [activos], cuestionario finalizado de su
+    organizacion que comparte alguna etiqueta con el activo) y la ultima finalizacion del par. Es una sola consulta
+    con una subconsulta correlacionada que usa el indice (activo, cuestionario, momento_finalizacion) de Inspeccion"""
+    ultima = Inspeccion.objects.filter(
+        activo=OuterRef('id_activo'), cuestionario=OuterRef('id_cuestionario'), momento_finalizacion__isnull=False,
+    ).order_by('-momento_finalizacion').values('momento_finalizacion')[:1]
+
+    # los F sobre etiquetas__cuestionarios reutilizan el join del filter, asi que todo se refiere al mismo cuestionario
+    return activos.filter(
+        etiquetas__cuestionarios__estado=Cuestionario.EstadoDeCuestionario.finalizado,
+        etiquetas__cuestionarios__organizacion=F('organizacion'),
+    ).values(
+        'identificador', id_activo=F('id'), id_cuestionario=F('etiquetas__cuestionarios'),
+        periodicidad_dias=F('etiquetas__cuestionarios__periodicidad_dias'),
+        momento_subida=F('etiquetas__cuestionarios__momento_subida'),
+    ).distinct().annotate(
+        momento_ultima_inspeccion=Subquery(ultima),
+        referencia=Coalesce('momento_ultima_inspeccion', 'momento_subida'),
+    )
+
+
+def pares_atrasados(organizacion, ahora=None):
+    """Los pares de planeacion de [organizacion] con al menos un dia de retraso, en una sola consulta. Como el
+    vencimiento depende de la periodicidad de cada cuestionario se compara contra un corte por periodicidad, asi no
+    hace falta aritmetica de fechas en la base de datos"""
+    ahora = ahora or timezone.now()
+    periodicidades = Cuestionario.objects.filter(
+        organizacion=organizacion, estado=Cuestionario.EstadoDeCuestionario.finalizado,
+    ).values_list('periodicidad_dias', flat=True).distinct()
+
+    vencidos = Q(pk__in=[])
+    for periodicidad_dias in periodicidades:
+        vencidos |= Q(periodicidad_dias=periodicidad_dias,
+                      referencia__lte=ahora - timedelta(days=periodicidad_dias + 1))
+    pares = pares_de_planeacion(Activo.objects.filter(organizacion=organizacion)).filter(vencidos)
+    return pares.annotate(tipo_de_inspeccion=F('etiquetas__cuestionarios__tipo_de_inspeccion'),
+                          version=F('etiquetas__cuestionarios__version'))
+
+
+@transaction.atomic
+def recalcular_planeacion(activos):
+    """Reemplaza las filas de planeacion de [activos] (ids, instancias o queryset)"""
+    if isinstance(activos, (list, tuple, set)):
+        activos = [getattr(activo, 'pk', activo) for activo in activos]
+    activos = Activo.objects.filter(pk__in=activos) if not hasattr(activos, 'model') else activos
+
+    filas = [Planeacion(activo_id=par['id_activo'], cuestionario_id=par['id_cuestionario'],
+                        momento_ultima_inspeccion=par['momento_ultima_inspeccion'],
+                        vencimiento=par['referencia'] + timedelta(days=par['periodicidad_dias']))
+             for par in pares_de_planeacion(activos)]
+
+    Planeacion.objects.filter(activo__in=activos).delete()
+    Planeacion.objects.bulk_create(filas, batch_size=TAMANO_LOTE)
+    return len(filas)
+
+
+def recalcular_planeacion_de_organizacion(organizacion):
+    return recalcular_planeacion(Activo.objects.filter(organizacion=organizacion))
+
+
+def programar_planeacion(activos):
+    """Recalcula la planeacion de los activos que cumplen el Q [activos] una sola vez, al confirmar la transaccion.
+    Las señales de una misma escritura (guardar el cuestionario y luego cada etiqueta) se acumulan en la conexion y
+    el primer callback las atiende todas juntas, los demas ya no encuentran pendientes"""
+    conexion = transaction.get_connection()
+    if not hasattr(conexion, 'planeacion_pendiente'):
+        conexion.planeacion_pendiente = []
+    conexion.planeacion_pendiente.append(activos)
+    transaction.on_commit(partial(_recalcular_pendientes, conexion))
+
+
+def _recalcular_pendientes(conexion):
+    # si una transaccion se revierte sus pendientes se recalculan con la siguiente, sobra trabajo pero no falta
+    pendientes, conexion.planeacion_pendiente = conexion.planeacion_pendiente, []
+    if pendientes:
+        recalcular_planeacion(Activo.objects.filter(pk__in=Activo.objects.filter(reduce(or_, pendientes)).values('pk')))
+
+
+def planeacion_de_organizacion(organizacion, solo_atrasados=False):
+    """Activos de [organizacion] con su planeacion por cuestionario, en una sola consulta. Los activos sin
+    cuestionarios que les apliquen salen con la lista vacia"""
+    activos = Activo.objects.filter(organizacion=organizacion)
+    if solo_atrasados:
+        activos = activos.filter(id__in=pares_atrasados(organizacion).values('id_activo'))
+    filas = activos.order_by(
+        'identificador', 'planeaciones__cuestionario__tipo_de_inspeccion', 'planeaciones__cuestionario__version'
+    ).values_list('id', 'identificador', 'planeaciones__cuestionario__tipo_de_inspeccion',
+                  'planeaciones__cuestionario__version', 'planeaciones__momento_ultima_inspeccion',
+                  'planeaciones__vencimiento')
+
+    activos = {}
+    for id_activo, identificador, tipo_de_inspeccion, version, momento_ultima_inspeccion, vencimiento in filas:
+        activo = activos.setdefault(id_activo, {'id': id_activo, 'identificador': identificador, 'planeacion': []})
+        if vencimiento is not None:
+            activo['planeacion'].append({
+                'cuestionario': f'{tipo_de_inspeccion} v{version}',
+                'momento_ultima_inspeccion': momento_ultima_inspeccion,
+                'retraso': Planeacion.calcular_retraso(vencimiento),
+            })
+    return list(activos.values())
@@ -0,0 +1,124 @@
+"""Recolector de fotos huerfanas por marcado y barrido, se ejecuta periodicamente con el comando recolectar_fotos o la
+tarea del mismo nombre, nunca durante una peticion.
+
+1. Marca con [huerfana_desde] las fotos sin respuesta o sin pregunta ni titulo y desmarca las que se volvieron a
+   asociar. Una foto recien subida todavia no esta asociada, por eso solo se borran las que siguen huerfanas un
+   periodo de gracia despues de marcadas
+2. Borra por lotes las filas marcadas antes del periodo de gracia
+3. Borra las subidas por partes abandonadas y sus archivos parciales
+4. Borra los archivos que ninguna foto usa y que no se modificaron durante el periodo de gracia. Las fotos son la
+   referencia, no la cuenta de ReferenciaDeArchivo, asi tambien se recuperan los archivos de las filas borradas en
+   cascada y los guardados antes de contar referencias"""
+import os
+from datetime import timedelta
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from inspecciones.almacenamiento import almacenamiento_de_fotos
+from inspecciones.carga_masiva import TAMANO_LOTE
+from inspecciones.models import FotoCuestionario, FotoRespuesta, ReferenciaDeArchivo, SubidaDeFoto
+from inspecciones.subidas import ruta_parcial
+
+GRACIA = timedelta(hours=24)
+
+HUERFANAS = {FotoRespuesta: Q(respuesta__isnull=True), FotoCuestionario: Q(object_id__isnull=True)}
+CAMPOS_DE_ARCHIVO = ['foto', 'miniatura', 'mediana']
+
+
+def recolectar_fotos(gracia=GRACIA, simular=False, tamano_lote=TAMANO_LOTE):
+    """Ejecuta el marcado y el barrido y retorna cuantas fotos se marcaron, cuantas filas, subidas y archivos se
+    borraron y los bytes liberados. Con [simular] no modifica nada y reporta lo que borraria"""
+    ahora = timezone.now()
+    limite = ahora - gracia
+    resumen = {'fotos_marcadas': 0}
+    for Modelo, huerfana in HUERFANAS.items():
+        sin_marcar = Modelo.objects.filter(huerfana, huerfana_desde__isnull=True)
+        barribles = Modelo.objects.filter(huerfana, huerfana_desde__lte=limite)
+        if simular:
+            resumen['fotos_marcadas'] += sin_marcar.count()
+            resumen[Modelo._meta.model_name] = barribles.count()
+            continue
+        Modelo.objects.filter(huerfana_desde__isnull=False).exclude(huerfana).update(huerfana_desde=None)
+        resumen['fotos_marcadas'] += sin_marcar.update(huerfana_desde=ahora)
+        resumen[Modelo._meta.model_name] = _borrar_por_lotes(Modelo, barribles, tamano_lote)
+
+    vencidas = SubidaDeFoto.objects.filter(momento_modificacion__lte=limite)
+    resumen['subidas'] = vencidas.count() if simular else _borrar_subidas(vencidas, tamano_lote)
+
+    # al simular las filas que se borrarian no cuentan como uso de sus archivos
+    fotos = {Modelo: Modelo.objects.exclude(huerfana, huerfana_desde__lte=limite) if simular else Modelo.objects
+             for Modelo, huerfana in HUERFANAS.items()}
+    archivos, liberados = _barrer_archivos(fotos, limite, simular, tamano_lote)
+    resumen.update(archivos=archivos, bytes=liberados)
+    return resumen
+
+
+def _borrar_por_lotes(Modelo, filas, tamano_lote):
+    borradas = 0
+    while ids := list(filas.values_list('pk', flat=True)[:tamano_lote]):
+        # se vuelve a filtrar por si alguna se asocio despues de leer los ids
+        _, por_modelo = filas.filter(pk__in=ids).delete()
+        borradas += por_modelo.get(Modelo._meta.label, 0)
+    return borradas
+
+
+def _borrar_subidas(subidas, tamano_lote):
+    borradas = 0
+    while lote := list(subidas.order_by('pk')[:tamano_lote]):
+        for subida in lote:
+            # las finalizadas ya no tienen archivo parcial
+            if subida.foto is None and os.path.exists(ruta_parcial(subida)):
+                os.remove(ruta_parcial(subida))
+        borradas += SubidaDeFoto.objects.filter(pk__in=[subida.pk for subida in lote]).delete()[0]
+    return borradas
+
+
+def _nombres_en_uso(fotos, nombres=None):
+    """Nombres de archivo que usa alguna de las [fotos] {Modelo: queryset}, solo entre [nombres] si se indica"""
+    en_uso = set()
+    for Modelo, queryset in fotos.items():
+        if nombres is not None:
+            queryset = queryset.filter(Q(foto__in=nombres) | Q(miniatura__in=nombres) | Q(mediana__in=nombres))
+        for fila in queryset.values_list(*CAMPOS_DE_ARCHIVO).iterator(chunk_size=TAMANO_LOTE):
+            en_uso.update(fila)
+    en_uso.discard('')
+    return en_uso
+
+
+def _archivos_en(almacenamiento, directorio):
+    if not almacenamiento.exists(directorio):
+        return
+    directorios, archivos = almacenamiento.listdir(directorio)
+    for archivo in archivos:
+        yield os.path.join(directorio, archivo)
+    for subdirectorio in directorios:
+        yield from _archivos_en(almacenamiento, os.path.join(directorio, subdirectorio))
+
+
+def _barrer_archivos(fotos, limite, simular, tamano_lote):
+    almacenamiento = almacenamiento_de_fotos()
+    en_uso = _nombres_en_uso(fotos)
+    directorios = {Modelo._meta.get_field('foto').upload_to for Modelo in fotos}
+    sin_uso = [nombre for directorio in sorted(directorios) for nombre in _archivos_en(almacenamiento, directorio)
+               if nombre not in en_uso and almacenamiento.get_modified_time(nombre) <= limite]
+    archivos = liberados = 0
+    for inicio in range(0, len(sin_uso), tamano_lote):
+        lote = sin_uso[inicio:inicio + tamano_lote]
+        with transaction.atomic():
+            # bloquea las referencias para que no se comparta un archivo mientras se borra, y vuelve a verificar
+            # por si alguna foto empezo a usarlo despues de la primera lectura
+            list(ReferenciaDeArchivo.objects.select_for_update().filter(nombre__in=lote))
+            usados = _nombres_en_uso(fotos, lote)
+            lote = [nombre for nombre in lote
+                    if nombre not in usados and almacenamiento.get_modified_time(nombre) <= limite]
+            archivos += len(lote)
+            liberados += sum(almacenamiento.size(nombre) for nombre in lote)
+            if simular:
+                continue
+            ReferenciaDeArchivo.objects.filter(nombre__in=lote).delete()
+            for nombre in lote:
+                transaction.on_commit(partial(almacenamiento.borrar_sin_referencias, nombre))
+    return archivos, liberados
@@ -0,0 +1,95 @@
+"""Modelo de vista del detalle de una inspeccion. Carga todo el arbol de respuestas con sus preguntas, opciones,
+criticidades, etiquetas y fotos en un numero fijo de consultas y entrega a la plantilla estructuras ya calculadas."""
+from collections import defaultdict
+
+from inspecciones.criticidad import indice_de_cuestionario
+from inspecciones.models import Pregunta, Respuesta
+
+_TIPOS_DE_TARJETA = [Respuesta.TiposDeRespuesta.seleccion_unica, Respuesta.TiposDeRespuesta.numerica,
+                     Respuesta.TiposDeRespuesta.seleccion_multiple]
+
+
+def construir_reporte(inspeccion):
+    """Una tarjeta por cada respuesta de primer nivel o fila de cuadricula, ordenadas de mayor a menor criticidad con
+    reparaciones, y los grupos de las pestañas del reporte"""
+    respuestas = Respuesta.objects.cargar_arboles(
+        [inspeccion], select_related=['pregunta', 'opcion_seleccionada', 'opcion_respondida'])
+    por_id = {respuesta.id: respuesta for respuesta in respuestas}
+    ids_preguntas = {respuesta.pregunta_id for respuesta in respuestas if respuesta.pregunta_id is not None}
+    etiquetas = _etiquetas_por_pregunta(ids_preguntas)
+    criticidades = indice_de_cuestionario(inspeccion.cuestionario_id, inspeccion.cuestionario.momento_modificacion)
+
+    tarjetas = []
+    for respuesta in respuestas:
+        es_de_primer_nivel = respuesta.inspeccion_id == inspeccion.id
+        es_fila = respuesta.respuesta_cuadricula_id in por_id
+        if respuesta.tipo_de_respuesta in _TIPOS_DE_TARJETA and (es_de_primer_nivel or es_fila):
+            cuadricula = por_id[respuesta.respuesta_cuadricula_id] if es_fila else None
+            tarjetas.append(_tarjeta(respuesta, cuadricula, etiquetas, criticidades))
+    tarjetas.sort(key=lambda tarjeta: -tarjeta['criticidad_calculada_con_reparaciones'])
+
+    pendientes = [tarjeta for tarjeta in tarjetas if tarjeta['criticidad_calculada_con_reparaciones'] > 0]
+    reparadas = [tarjeta for tarjeta in tarjetas if tarjeta['reparado']]
+    sin_novedad = [tarjeta for tarjeta in tarjetas if tarjeta['criticidad_calculada'] == 0]
+    return {
+        'todas': tarjetas, 'pendientes': pendientes, 'reparadas': reparadas, 'sinNovedad': sin_novedad,
+        'grupos': {'reparadas': len(reparadas), 'pendiente': len(pendientes), 'sinNovedad': len(sin_novedad),
+                   'todas': len(reparadas) + len(pendientes) + len(sin_novedad)},
+    }
+
+
+def _etiquetas_por_pregunta(ids_preguntas):
+    PreguntaEtiqueta = Pregunta.etiquetas.through
+    etiquetas = defaultdict(list)
+    for relacion in PreguntaEtiqueta.objects.filter(pregunta__in=ids_preguntas).select_related('etiquetadepregunta'):
+        etiquetas[relacion.pregunta_id].append(str(relacion.etiquetadepregunta))
+    return etiquetas
+
+
+def _tarjeta(respuesta, cuadricula, etiquetas, criticidades):
+    if respuesta.tipo_de_respuesta == Respuesta.TiposDeRespuesta.seleccion_multiple:
+        partes = [parte for parte in respuesta.subrespuestas_multiple.all() if parte.opcion_respondida_esta_seleccionada]
+        partes.sort(key=lambda parte: -parte.criticidad_calculada_con_reparaciones)
+    else:
+        partes = [respuesta]
+    pregunta = respuesta.pregunta
+    return {
+        'id': respuesta.id,
+        'titulo_cuadricula': str(cuadricula.pregunta) if cuadricula is not None else None,
+        'pregunta': str(pregunta),
+        'descripcion': pregunta.descripcion,
+        'criticidad_pregunta': pregunta.criticidad,
+        'etiquetas': etiquetas[pregunta.id],
+        'criticidad_calculada': respuesta.criticidad_calculada,
+        'criticidad_calculada_con_reparaciones': respuesta.criticidad_calculada_con_reparaciones,
+        'reparado': respuesta.reparado,
+        'detalles': [_detalle(parte, criticidades) for parte in partes],
+    }
+
+
+def _detalle(respuesta, criticidades):
+    """Lo que se muestra de cada opcion dada: el equivalente a la etiqueta get_respuesta sin consultas"""
+    opcion, criticidad = '', 0
+    if respuesta.tipo_de_respuesta == Respuesta.TiposDeRespuesta.seleccion_unica:
+        opcion = respuesta.opcion_seleccionada
+        criticidad = opcion.criticidad
+    elif respuesta.tipo_de_respuesta == Respuesta.TiposDeRespuesta.parte_de_seleccion_multiple:
+        opcion = respuesta.opcion_respondida
+        criticidad = opcion.criticidad
+    elif respuesta.tipo_de_respuesta == Respuesta.TiposDeRespuesta.numerica:
+        opcion = respuesta.valor_numerico
+        criticidad = criticidades.criticidad(respuesta.pregunta_id, opcion)
+    return {
+        'id': respuesta.id,
+        'opcion': str(opcion),
+        'criticidad_respuesta': criticidad,
+        'criticidad_calculada': respuesta.criticidad_calculada,
+        'criticidad_calculada_con_reparaciones': respuesta.criticidad_calculada_con_reparaciones,
+        'criticidad_del_inspector': respuesta.criticidad_del_inspector,
+        'reparado': respuesta.reparado,
+        'observacion': respuesta.observacion,
+        'observacion_reparacion': respuesta.observacion_reparacion,
+        # la tarjeta muestra la miniatura y enlaza la original
+        'fotos_base': [foto.versiones for foto in respuesta.fotos_base],
+        'fotos_reparacion': [foto.versiones for foto in respuesta.fotos_reparacion],
+    }
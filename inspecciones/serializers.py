@@ -1,11 +1,25 @@
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
+from django.db import transaction, models
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 from rest_framework_recursive.fields import RecursiveField
 
+from inspecciones.agregados import actualizar_agregados
+from inspecciones.carga_masiva import TAMANO_LOTE, PlanCuestionario, PlanRespuestas, ActualizacionRespuestas, \
+    ActualizacionCuestionario, consultas_del_arbol, resolver_etiquetas
+from inspecciones.exportacion import FORMATOS
 from inspecciones.mixins import DynamicFieldsModelSerializer
+from inspecciones.planeacion import recalcular_planeacion
+from inspecciones.subidas import crear_foto, foto_con_hash, procesar_en_segundo_plano, TAMANO_MAXIMO_FOTO
+from inspecciones.tablero import invalidar_tablero
+from inspecciones.trabajos import encolar
 from inspecciones.models import Perfil, Organizacion, Activo, EtiquetaDeActivo, Cuestionario, Bloque, Titulo, \
     Pregunta, EtiquetaDePregunta, OpcionDeRespuesta, CriticidadNumerica, Inspeccion, Respuesta, FotoRespuesta, \
-    FotoCuestionario, EtiquetaJerarquicaDeActivo, EtiquetaJerarquicaDePregunta
+    FotoCuestionario, EtiquetaJerarquicaDeActivo, EtiquetaJerarquicaDePregunta, Planeacion, Importacion, Trabajo, \
+    SubidaDeFoto
 
 
 class OrganizacionSerializer(serializers.ModelSerializer):
@@ -127,7 +141,8 @@ class ActivoSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Activo
-        fields = '__all__'
+        # el momento de modificacion solo lo usa la sincronizacion
+        exclude = ['momento_modificacion']
         validators = []
 
     def create(self, validated_data):
@@ -151,6 +166,53 @@ class ActivoSerializer(serializers.ModelSerializer):
         return activo
 
 
+class EtiquetaDeFilaSerializer(serializers.Serializer):
+    # sin los validadores de unicidad del EtiquetaSerializer, las etiquetas existentes se reutilizan
+    clave = serializers.CharField(max_length=200)
+    valor = serializers.CharField(max_length=200)
+
+
+class FilaDeActivoSerializer(serializers.Serializer):
+    """Una fila de la carga masiva de activos, la unicidad la revisa CargaDeActivos contra todo el lote"""
+    id = serializers.UUIDField(required=False)
+    identificador = serializers.CharField(max_length=120)
+    etiquetas = EtiquetaDeFilaSerializer(many=True, required=False, default=[])
+
+
+class TrabajoSerializer(serializers.ModelSerializer):
+    # las tareas que se pueden encolar directamente, las demas las encolan los endpoints que las necesitan
+    tipo = serializers.ChoiceField(choices=['recalcular_criticidades', 'recalcular_agregados', 'reconstruir_planeacion'])
+
+    class Meta:
+        model = Trabajo
+        fields = ['id', 'tipo', 'prioridad', 'estado', 'intentos', 'avance', 'resultado', 'error', 'momento_creacion',
+                  'momento_inicio', 'momento_fin']
+        read_only_fields = ['estado', 'intentos', 'avance', 'resultado', 'error', 'momento_creacion',
+                            'momento_inicio', 'momento_fin']
+        extra_kwargs = {'prioridad': {'required': False}}
+
+    def create(self, validated_data):
+        return encolar(validated_data.pop('tipo'), **validated_data)
+
+
+class ImportacionSerializer(serializers.ModelSerializer):
+    tamano_lote = serializers.IntegerField(min_value=1, max_value=5000, default=TAMANO_LOTE)
+
+    class Meta:
+        model = Importacion
+        fields = ['id', 'archivo', 'formato', 'tamano_lote', 'estado', 'filas_procesadas', 'creados', 'actualizados',
+                  'filas_con_error', 'errores', 'mensaje', 'momento_creacion', 'momento_fin']
+        read_only_fields = ['formato', 'estado', 'filas_procesadas', 'creados', 'actualizados', 'filas_con_error',
+                            'errores', 'mensaje', 'momento_creacion', 'momento_fin']
+        extra_kwargs = {'archivo': {'write_only': True}}
+
+    def validate(self, data):
+        extension = data['archivo'].name.rsplit('.', 1)[-1].lower()
+        if extension not in Importacion.Formatos.values:
+            raise serializers.ValidationError({'archivo': ['El archivo debe ser .csv o .xlsx']})
+        return {**data, 'formato': extension}
+
+
 class CuestionarioSerializer(serializers.ModelSerializer):
     etiquetas_aplicables = EtiquetaSerializer(many=True)
     organizacion = None
@@ -158,7 +220,7 @@ class CuestionarioSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Cuestionario
-        exclude = ['organizacion']
+        exclude = ['organizacion', 'momento_modificacion']
 
     def create(self, validated_data):
         etiquetas_data = validated_data.pop('etiquetas_aplicables')
@@ -170,10 +232,48 @@ class CuestionarioSerializer(serializers.ModelSerializer):
         return cuestionario
 
 
+class IdUnicoValidator(UniqueValidator):
+    """UniqueValidator que tambien acepta los ids que ya pertenecen al objeto que actualiza el serializer raiz, para
+    que un PUT pueda reenviar los hijos que ya existen. El serializer raiz los expone con [ids_existentes]"""
+
+    def __call__(self, value, serializer_field):
+        ids_existentes = getattr(serializer_field.root, 'ids_existentes', None)
+        if ids_existentes is not None and value in ids_existentes(self.queryset.model):
+            return
+        super().__call__(value, serializer_field)
+
+
+class ParAtrasadoSerializer(serializers.Serializer):
+    """Un elemento de inspecciones.planeacion.pares_atrasados"""
+    activo = serializers.UUIDField(source='id_activo')
+    identificador = serializers.CharField()
+    cuestionario = serializers.UUIDField(source='id_cuestionario')
+    tipo_de_inspeccion = serializers.CharField()
+    version = serializers.IntegerField()
+    momento_ultima_inspeccion = serializers.DateTimeField()
+    retraso = serializers.SerializerMethodField()
+
+    def get_retraso(self, par):
+        return Planeacion.calcular_retraso(par['referencia'] + timedelta(days=par['periodicidad_dias']))
+
+
+class VersionesDeFotoField(serializers.ReadOnlyField):
+    """Urls de la miniatura, la mediana y la original de una foto (su propiedad versiones), absolutas como las de
+    los ImageField"""
+
+    def to_representation(self, versiones):
+        request = self.context.get('request')
+        if request is None:
+            return versiones
+        return {version: request.build_absolute_uri(url) for version, url in versiones.items()}
+
+
 class FotoCuestionarioSerializer(serializers.ModelSerializer):
+    versiones = VersionesDeFotoField()
+
     class Meta:
         model = FotoCuestionario
-        fields = ['id', 'foto']
+        fields = ['id', 'foto', 'versiones']
 
 
 class TituloSerializer(serializers.ModelSerializer):
@@ -184,18 +284,21 @@ class TituloSerializer(serializers.ModelSerializer):
     class Meta:
         model = Titulo
         exclude = ['bloque']
+        extra_kwargs = {'id': {'validators': [IdUnicoValidator(queryset=Titulo.objects.all())]}}
 
 
 class OpcionDeRespuestaSerializer(serializers.ModelSerializer):
     class Meta:
         model = OpcionDeRespuesta
         exclude = ['pregunta']
+        extra_kwargs = {'id': {'validators': [IdUnicoValidator(queryset=OpcionDeRespuesta.objects.all())]}}
 
 
 class CriticidadNumericaSerializer(serializers.ModelSerializer):
     class Meta:
         model = CriticidadNumerica
         exclude = ['pregunta']
+        extra_kwargs = {'id': {'validators': [IdUnicoValidator(queryset=CriticidadNumerica.objects.all())]}}
 
 
 class PreguntaSerializer(serializers.ModelSerializer):
@@ -210,6 +313,7 @@ class PreguntaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Pregunta
         exclude = ['bloque', 'cuadricula']
+        extra_kwargs = {'id': {'validators': [IdUnicoValidator(queryset=Pregunta.objects.all())]}}
 
 
 class BloqueSerializer(serializers.ModelSerializer):
@@ -224,63 +328,46 @@ class BloqueSerializer(serializers.ModelSerializer):
 class CuestionarioCompletoSerializer(CuestionarioSerializer):
     bloques = BloqueSerializer(many=True)
 
+    @transaction.atomic
     def create(self, validated_data):
         bloques_data = validated_data.pop('bloques')
         cuestionario = super().create(validated_data)
-        for bloque_data in bloques_data:
-            self._crear_bloque(cuestionario, bloque_data)
+        PlanCuestionario(cuestionario, bloques_data).ejecutar()
         return cuestionario
 
-    def _crear_bloque(self, cuestionario, bloque_data):
-        titulo_data = bloque_data.pop('titulo')
-        pregunta_data = bloque_data.pop('pregunta')
-
-        bloque = Bloque.objects.create(cuestionario=cuestionario, **bloque_data)
-        if titulo_data is not None:
-            self._crear_titulo(bloque, titulo_data)
-        if pregunta_data is not None:
-            self._crear_pregunta(pregunta_data, bloque=bloque)
-        # TODO: validar que venga o un titulo o una pregunta o una cuadricula
-
-    def _crear_titulo(self, bloque, titulo_data):
-        fotos_data = titulo_data.pop('fotos')
-        titulo = Titulo.objects.create(bloque=bloque, **titulo_data)
-        for foto_data in fotos_data:
-            titulo.fotos.add(foto_data)
-
-    def _crear_pregunta(self, pregunta_data, bloque=None, cuadricula=None):
-        fotos_data = pregunta_data.pop('fotos_guia')
-        etiquetas_data = pregunta_data.pop('etiquetas')
-        opciones_de_respuesta_data = pregunta_data.pop('opciones_de_respuesta')
-        criticidades_numericas_data = pregunta_data.pop('criticidades_numericas')
-        preguntas_data = pregunta_data.pop('preguntas')
-        pregunta = Pregunta.objects.create(bloque=bloque, cuadricula=cuadricula, **pregunta_data)
-        for foto_data in fotos_data:
-            pregunta.fotos_guia.add(foto_data)
-        for etiqueta_data in etiquetas_data:
-            self._crear_etiqueta(pregunta, etiqueta_data)
-        for opcion_de_respuesta_data in opciones_de_respuesta_data:
-            self._crear_opcion_de_respuesta(pregunta, opcion_de_respuesta_data)
-        for criticidad_numerica_data in criticidades_numericas_data:
-            self._crear_criticidad_numerica(pregunta, criticidad_numerica_data)
-        for pregunta_data in preguntas_data:
-            self._crear_pregunta(pregunta_data, cuadricula=pregunta)
-
-    def _crear_etiqueta(self, pregunta, etiqueta_data):
-        etiqueta_db, _ = EtiquetaDePregunta.objects.get_or_create(**etiqueta_data)
-        pregunta.etiquetas.add(etiqueta_db)
-
-    def _crear_opcion_de_respuesta(self, pregunta, opcion_de_respuesta_data):
-        OpcionDeRespuesta.objects.create(pregunta=pregunta, **opcion_de_respuesta_data)
-
-    def _crear_criticidad_numerica(self, pregunta, criticidad_numerica_data):
-        CriticidadNumerica.objects.create(pregunta=pregunta, **criticidad_numerica_data)
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        """Aplica solo las diferencias con el arbol guardado, el resumen queda en [self.cambios]"""
+        bloques_data = validated_data.pop('bloques', None)
+        etiquetas_data = validated_data.pop('etiquetas_aplicables', None)
+        validated_data.pop('id', None)
+        for campo, valor in validated_data.items():
+            setattr(instance, campo, valor)
+        instance.save()
+        if etiquetas_data is not None:
+            instance.etiquetas_aplicables.set(resolver_etiquetas(EtiquetaDeActivo, etiquetas_data).values())
+        if bloques_data is not None:
+            self.cambios = ActualizacionCuestionario(instance, bloques_data).ejecutar()
+        return instance
+
+    def ids_existentes(self, modelo):
+        """ids de los hijos del cuestionario que se esta actualizando, se pueden reenviar en el PUT"""
+        if self.instance is None:
+            return set()
+        if not hasattr(self, '_ids_existentes'):
+            self._ids_existentes = {}
+        if modelo not in self._ids_existentes:
+            consulta = consultas_del_arbol(self.instance).get(modelo)
+            self._ids_existentes[modelo] = set() if consulta is None else set(consulta.values_list('id', flat=True))
+        return self._ids_existentes[modelo]
 
 
 class FotoRespuestaSerializer(serializers.ModelSerializer):
+    versiones = VersionesDeFotoField()
+
     class Meta:
         model = FotoRespuesta
-        fields = '__all__'
+        fields = ['id', 'foto', 'respuesta', 'tipo', 'versiones']
 
 
 class RespuestaSerializer(serializers.ModelSerializer):
@@ -297,6 +384,14 @@ class RespuestaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Respuesta
         exclude = ['inspeccion']
+        extra_kwargs = {'id': {'validators': [IdUnicoValidator(queryset=Respuesta.objects.all())]}}
+
+
+class InspeccionCompletaListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        inspecciones = list(data.all() if isinstance(data, models.Manager) else data)
+        Respuesta.objects.cargar_arboles(inspecciones)
+        return super().to_representation(inspecciones)
 
 
 class InspeccionCompletaSerializer(serializers.ModelSerializer):
@@ -304,89 +399,132 @@ class InspeccionCompletaSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Inspeccion
-        fields = '__all__'
-
+        exclude = ['momento_modificacion']
+        # se calculan desde las respuestas, ver inspecciones.agregados
+        read_only_fields = ['preguntas_respondidas', 'total_preguntas', 'criticidad_maxima']
+        list_serializer_class = InspeccionCompletaListSerializer
+
+    def to_representation(self, instance):
+        # las respuestas se cargan con todo su arbol de una vez en lugar de una consulta por nodo
+        if 'respuestas' not in getattr(instance, '_prefetched_objects_cache', {}):
+            Respuesta.objects.cargar_arboles([instance])
+        return super().to_representation(instance)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
+        """Aplica solo los cambios de las respuestas, el resumen queda en [self.cambios]"""
         perfil = self.context['request'].user.perfil
-        print('aqui 1')
-        respuestas_data = validated_data.pop('respuestas')
-        print('aqui 2')
-        Inspeccion.objects.filter(id=instance.id).update(inspector=perfil, **validated_data)
+        respuestas_data = validated_data.pop('respuestas', None)
+        # update() no aplica el auto_now
+        Inspeccion.objects.filter(id=instance.id).update(inspector=perfil, momento_modificacion=timezone.now(),
+                                                         **validated_data)
         inspeccion = Inspeccion.objects.get(id=instance.id)
-        print('aqui 3')
-        self._borrar_respuestas_inspeccion(inspeccionId=inspeccion.id)
-        for respuesta_data in respuestas_data:
-            self._crear_respuesta(respuesta_data, inspeccion=inspeccion)
-        FotoRespuesta.objects.filter(respuesta=None).delete()
-        return validated_data
+        # el update por queryset no emite post_save
+        recalcular_planeacion({instance.activo_id, inspeccion.activo_id})
+        invalidar_tablero(inspeccion.cuestionario.organizacion_id)
+        if respuestas_data is not None:
+            actualizacion = ActualizacionRespuestas(inspeccion, respuestas_data)
+            self.cambios = actualizacion.ejecutar()
+            actualizar_agregados(inspeccion, actualizacion.plan.respuestas)
+        return inspeccion
 
+    @transaction.atomic
     def create(self, validated_data):
         respuestas_data = validated_data.pop('respuestas')
         perfil = self.context['request'].user.perfil
         inspeccion = Inspeccion.objects.create(inspector=perfil, **validated_data)
-
-        for respuesta_data in respuestas_data:
-            self._crear_respuesta(respuesta_data, inspeccion=inspeccion)
+        plan = PlanRespuestas(inspeccion, respuestas_data)
+        plan.ejecutar()
+        actualizar_agregados(inspeccion, plan.respuestas)
         return inspeccion
 
-    def _borrar_respuestas_inspeccion(self, inspeccionId):
-        respuestasPadre = Respuesta.objects.filter(inspeccion__id=inspeccionId)
-        print(respuestasPadre)
-        respuestasPadre.delete()
-
-    def _crear_respuesta(self, respuesta_data, inspeccion=None, respuesta_cuadricula=None, respuesta_multiple=None):
-        fotos_base_data = respuesta_data.pop('fotos_base')
-        fotos_reparacion_data = respuesta_data.pop('fotos_reparacion')
-        subrespuestas_cuadricula_data = respuesta_data.pop('subrespuestas_cuadricula')
-        subrespuestas_multiple_data = respuesta_data.pop('subrespuestas_multiple')
-        respuesta = Respuesta.objects.create(inspeccion=inspeccion, respuesta_cuadricula=respuesta_cuadricula,
-                                             respuesta_multiple=respuesta_multiple,
-                                             **respuesta_data)
-        print('aqui')
-        for foto_base_data in fotos_base_data:
-            self._asociar_foto_base(respuesta, foto_base_data)
-        for foto_reparacion_data in fotos_reparacion_data:
-            self._asociar_foto_reparacion(respuesta, foto_reparacion_data)
-        for subrespuesta_data in subrespuestas_cuadricula_data:
-            self._crear_respuesta(subrespuesta_data, respuesta_cuadricula=respuesta)
-        for subrespuesta_data in subrespuestas_multiple_data:
-            self._crear_respuesta(subrespuesta_data, respuesta_multiple=respuesta)
-        return respuesta.id
-
-    def _asociar_foto_base(self, respuesta, foto):
-        foto.tipo = FotoRespuesta.TiposDeFoto.base
-        foto.respuesta = respuesta
-        foto.save()
-        respuesta.fotos.add(foto)
-
-    def _asociar_foto_reparacion(self, respuesta, foto):
-        foto.tipo = FotoRespuesta.TiposDeFoto.reparacion
-        foto.respuesta = respuesta
-        foto.save()
-        respuesta.fotos.add(foto)
+    def ids_existentes(self, modelo):
+        """ids de las respuestas de la inspeccion que se esta actualizando, se pueden reenviar en el PUT"""
+        if self.instance is None or modelo is not Respuesta:
+            return set()
+        if not hasattr(self, '_ids_existentes'):
+            self._ids_existentes = set(
+                Respuesta.objects.de_inspecciones([self.instance.id]).values_list('id', flat=True))
+        return self._ids_existentes
+
+
+class InspeccionResumenSerializer(serializers.ModelSerializer):
+    """La inspeccion sin el arbol de respuestas, para los listados"""
+
+    class Meta:
+        model = Inspeccion
+        exclude = ['momento_modificacion']
+
+
+class FiltroDeInspeccionesSerializer(serializers.Serializer):
+    """Valida los parametros del listado de inspecciones. [respuestas] pide la representacion completa"""
+    estado = serializers.ChoiceField(choices=Inspeccion.EstadoDeInspeccion.choices, required=False)
+    activo = serializers.UUIDField(required=False)
+    cuestionario = serializers.UUIDField(required=False)
+    momento_inicio_desde = serializers.DateTimeField(required=False)
+    momento_inicio_hasta = serializers.DateTimeField(required=False)
+    momento_subida_desde = serializers.DateTimeField(required=False)
+    momento_subida_hasta = serializers.DateTimeField(required=False)
+    criticidad_desde = serializers.IntegerField(required=False)
+    criticidad_hasta = serializers.IntegerField(required=False)
+    respuestas = serializers.BooleanField(default=False)
+
+    condiciones = {
+        'estado': 'estado', 'activo': 'activo', 'cuestionario': 'cuestionario',
+        'momento_inicio_desde': 'momento_inicio__gte', 'momento_inicio_hasta': 'momento_inicio__lte',
+        'momento_subida_desde': 'momento_subida__gte', 'momento_subida_hasta': 'momento_subida__lte',
+        'criticidad_desde': 'criticidad_calculada__gte', 'criticidad_hasta': 'criticidad_calculada__lte',
+    }
+
+    def filtrar(self, queryset):
+        return queryset.filter(**{self.condiciones[campo]: valor for campo, valor in self.validated_data.items()
+                                  if campo in self.condiciones})
+
+
+class FiltroDeExportacionSerializer(FiltroDeInspeccionesSerializer):
+    formato = serializers.ChoiceField(choices=list(FORMATOS), default='csv')
 
 
 class SubirFotosSerializer(serializers.Serializer):
-    fotos = serializers.ListField(child=serializers.ImageField())
+    """Responde {nombre del archivo: id de la foto}. En [hashes] se pueden mandar los sha256 de fotos que quizas ya
+    se subieron, las conocidas se responden como {hash: id} sin tener que enviar el archivo"""
+    fotos = serializers.ListField(child=serializers.ImageField(), required=False, default=[])
     print(fotos)
+    hashes = serializers.ListField(child=serializers.RegexField(r'^[0-9a-f]{64}$'), required=False, default=[])
+
     class Meta:
-        fields = ['fotos']
+        fields = ['fotos', 'hashes']
 
-    def save(self):
+    def save(self, organizacion_id):
         ModelClass = self.Meta.model
         fotos = self.validated_data['fotos']
         print(fotos)
         # storage = FileSystemStorage(location=Path(settings.MEDIA_ROOT) / 'fotos_cuestionarios')
         # name = storage.save(name, content, max_length=self.field.max_length)
         # new_names = {foto.name: storage.save(self.generar_filename(foto.name), foto.file) for foto in fotos}
-        new_names = {foto.name: ModelClass._default_manager.create(foto=foto).id for foto in fotos}
-        return new_names
+        creadas = {foto.name: crear_foto(ModelClass, foto, organizacion_id) for foto in fotos}
+        for digest in self.validated_data['hashes']:
+            existente = foto_con_hash(ModelClass, digest, organizacion_id)
+            if existente is not None:
+                creadas[digest] = existente.compartir_archivos(organizacion_id)
+        procesar_en_segundo_plano(ModelClass, creadas.values())
+        return {nombre: foto.id for nombre, foto in creadas.items()}
 
     # def generar_filename(self, name: str) -> Path:
     #     file_root, file_ext = os.path.splitext(name)
     #     return Path(f'{get_random_string(7)}{file_ext}')
 
 
+class SubidaDeFotoSerializer(serializers.ModelSerializer):
+    tamano = serializers.IntegerField(min_value=1, max_value=TAMANO_MAXIMO_FOTO)
+    hash = serializers.RegexField(r'^[0-9a-f]{64}$', required=False)
+
+    class Meta:
+        model = SubidaDeFoto
+        fields = ['id', 'destino', 'nombre', 'tamano', 'hash', 'recibidos', 'foto']
+        read_only_fields = ['recibidos', 'foto']
+
+
 class SubirFotosCuestionarioSerializer(SubirFotosSerializer):
     class Meta(SubirFotosSerializer.Meta):
         model = FotoCuestionario
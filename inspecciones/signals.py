@@ -0,0 +1,127 @@
+"""Receivers que mantienen las tablas desnormalizadas y las caches cuando cambian sus fuentes. Se conectan en
+InspeccionesConfig.ready"""
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from inspecciones.models import Activo, Cuestionario, Inspeccion, EtiquetaJerarquicaDeActivo, \
+    EtiquetaJerarquicaDePregunta, FotoCuestionario
+from inspecciones.planeacion import recalcular_planeacion, programar_planeacion
+from inspecciones.sincronizacion import registrar_eliminacion
+from inspecciones.tablero import invalidar_tablero
+
+
+@receiver([post_save, post_delete], sender=Inspeccion)
+def planeacion_al_guardar_inspeccion(sender, instance, **kwargs):
+    recalcular_planeacion([instance.activo_id])
+    organizacion_id = _organizacion_de_inspeccion(instance)
+    if organizacion_id is not None:
+        invalidar_tablero(organizacion_id)
+
+
+def _organizacion_de_inspeccion(inspeccion):
+    # sin cargar el cuestionario completo, que ademas pudo borrarse antes porque la llave es DO_NOTHING
+    if Inspeccion.cuestionario.is_cached(inspeccion):
+        return inspeccion.cuestionario.organizacion_id
+    return Cuestionario.objects.filter(pk=inspeccion.cuestionario_id).values_list('organizacion', flat=True).first()
+
+
+@receiver(post_save, sender=Cuestionario)
+def planeacion_al_guardar_cuestionario(sender, instance, created, raw=False, **kwargs):
+    # el estado o la periodicidad pudieron cambiar. Uno recien creado aun no tiene etiquetas, no aplica a nadie
+    if not created and not raw:
+        programar_planeacion(Q(organizacion=instance.organizacion_id, etiquetas__cuestionarios=instance.pk))
+        invalidar_tablero(instance.organizacion_id)
+
+
+@receiver(m2m_changed, sender=Activo.etiquetas.through)
+def planeacion_al_cambiar_etiquetas_de_activo(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        recalcular_planeacion([instance.pk])
+        invalidar_tablero(instance.organizacion_id)
+    elif pk_set:
+        recalcular_planeacion(pk_set)
+        invalidar_tablero(*Activo.objects.filter(pk__in=pk_set).values_list('organizacion', flat=True).distinct())
+
+
+@receiver(m2m_changed, sender=Cuestionario.etiquetas_aplicables.through)
+def planeacion_al_cambiar_etiquetas_de_cuestionario(sender, instance, action, reverse, pk_set, **kwargs):
+    # solo cambian los activos con las etiquetas agregadas o quitadas. clear() no dice cuales quita, se leen antes
+    if action == 'pre_clear':
+        if reverse:
+            organizaciones = set(instance.cuestionarios.values_list('organizacion', flat=True))
+            activos = Q(etiquetas=instance.pk, organizacion__in=organizaciones)
+        else:
+            organizaciones = {instance.organizacion_id}
+            activos = Q(pk__in=list(Activo.objects.filter(organizacion=instance.organizacion_id,
+                                                          etiquetas__cuestionarios=instance.pk).values_list('pk', flat=True)))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        if reverse:
+            organizaciones = set(Cuestionario.objects.filter(pk__in=pk_set).values_list('organizacion', flat=True))
+            activos = Q(etiquetas=instance.pk, organizacion__in=organizaciones)
+        else:
+            organizaciones = {instance.organizacion_id}
+            activos = Q(organizacion=instance.organizacion_id, etiquetas__in=pk_set)
+    else:
+        return
+    programar_planeacion(activos)
+    invalidar_tablero(*organizaciones)
+
+
+@receiver(pre_delete, sender=Cuestionario)
+def desasociar_fotos_al_borrar_cuestionario(sender, instance, **kwargs):
+    """Las fotos sobreviven al cuestionario, otra version las puede volver a usar. Si no, las borra el recolector de
+    fotos huerfanas. El borrado en cascada de la GenericRelation se ejecuta despues de las señales pre_delete, asi
+    que ya no las encuentra"""
+    FotoCuestionario.objects.filter(Q(titulo__bloque__cuestionario=instance) | Q(pregunta__bloque__cuestionario=instance)
+                                    | Q(pregunta__cuadricula__bloque__cuestionario=instance)) \
+        .update(content_type=None, object_id=None, huerfana_desde=None)
+
+
+# lapidas de la sincronizacion, el recurso es el nombre con el que la API de sincronizacion entrega cada modelo
+
+@receiver(post_delete, sender=Activo)
+def lapida_de_activo(sender, instance, **kwargs):
+    registrar_eliminacion('activos', instance.pk, instance.organizacion_id)
+
+
+@receiver(post_delete, sender=Cuestionario)
+def lapida_de_cuestionario(sender, instance, **kwargs):
+    registrar_eliminacion('cuestionarios', instance.pk, instance.organizacion_id)
+
+
+@receiver(post_delete, sender=EtiquetaJerarquicaDeActivo)
+def lapida_de_etiqueta_de_activos(sender, instance, **kwargs):
+    registrar_eliminacion('etiquetas_activos', instance.pk, instance.organizacion_id)
+
+
+@receiver(post_delete, sender=EtiquetaJerarquicaDePregunta)
+def lapida_de_etiqueta_de_preguntas(sender, instance, **kwargs):
+    registrar_eliminacion('etiquetas_preguntas', instance.pk, instance.organizacion_id)
+
+
+@receiver(post_delete, sender=Inspeccion)
+def lapida_de_inspeccion(sender, instance, **kwargs):
+    organizacion_id = _organizacion_de_inspeccion(instance)
+    if organizacion_id is not None:
+        registrar_eliminacion('inspecciones', instance.pk, organizacion_id)
+
+
+# los cambios de etiquetas no pasan por save(), se marcan a mano para que la sincronizacion los entregue
+
+@receiver(m2m_changed, sender=Activo.etiquetas.through)
+def modificacion_al_cambiar_etiquetas_de_activo(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith('post_'):
+        activos = Activo.objects.filter(pk__in=pk_set or []) if reverse else Activo.objects.filter(pk=instance.pk)
+        activos.update(momento_modificacion=timezone.now())
+
+
+@receiver(m2m_changed, sender=Cuestionario.etiquetas_aplicables.through)
+def modificacion_al_cambiar_etiquetas_de_cuestionario(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith('post_'):
+        cuestionarios = Cuestionario.objects.filter(pk__in=pk_set or []) if reverse \
+            else Cuestionario.objects.filter(pk=instance.pk)
+        cuestionarios.update(momento_modificacion=timezone.now())
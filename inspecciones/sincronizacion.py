@@ -0,0 +1,55 @@
+"""Sincronizacion incremental para la app movil. Cada recurso tiene su propio token, el momento del servidor en que
+se leyo por ultima vez; con el se entregan solo las filas modificadas desde entonces y las lapidas de las borradas.
+Las lapidas se guardan RETENCION_LAPIDAS, un token mas antiguo se rechaza y el cliente debe descargar todo otra vez"""
+from datetime import datetime, timedelta, timezone
+
+from django.utils import timezone as django_timezone
+
+from inspecciones.models import Eliminacion
+
+# cubre las transacciones que iniciaron antes del token y se confirmaron despues. Las filas repetidas no hacen dano
+# porque el cliente las aplica por id
+MARGEN_SINCRONIZACION = timedelta(minutes=5)
+RETENCION_LAPIDAS = timedelta(days=30)
+
+
+class TokenVencido(ValueError):
+    pass
+
+
+def nuevo_token(momento=None):
+    """Los microsegundos desde epoch, asi el token viaja en la url sin escaparlo"""
+    momento = momento or django_timezone.now()
+    return str(int(momento.timestamp() * 1_000_000))
+
+
+def leer_token(token):
+    """El momento desde el que se sincroniza, None para descargar todo. Lanza ValueError si el token no es valido y
+    TokenVencido si es anterior a las lapidas guardadas"""
+    if not token:
+        return None
+    try:
+        momento = datetime.fromtimestamp(int(token) / 1_000_000, tz=timezone.utc)
+    except (OverflowError, OSError):
+        raise ValueError(token)
+    if momento < django_timezone.now() - RETENCION_LAPIDAS:
+        raise TokenVencido(token)
+    return momento - MARGEN_SINCRONIZACION
+
+
+def cambios_desde(queryset, recurso, organizacion, desde):
+    """Las filas de [queryset] modificadas y los ids de [recurso] eliminados desde [desde]"""
+    if desde is None:
+        return queryset, []
+    eliminados = Eliminacion.objects.filter(organizacion=organizacion, recurso=recurso, momento__gte=desde)
+    return queryset.filter(momento_modificacion__gte=desde), list(eliminados.values_list('id_objeto', flat=True))
+
+
+def registrar_eliminacion(recurso, id_objeto, organizacion_id):
+    Eliminacion.objects.create(recurso=recurso, id_objeto=str(id_objeto), organizacion_id=organizacion_id)
+
+
+def purgar_lapidas():
+    """Borra las lapidas mas antiguas que RETENCION_LAPIDAS, ningun token valido las puede pedir. Retorna cuantas"""
+    limite = django_timezone.now() - RETENCION_LAPIDAS - MARGEN_SINCRONIZACION
+    return Eliminacion.objects.filter(momento__lt=limite).delete()[0]
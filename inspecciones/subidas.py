@@ -0,0 +1,179 @@
+"""Subida de fotos por partes que se puede retomar. El protocolo es:
+
+1. POST con destino, nombre, tamano y opcionalmente el sha256 crea la subida. Si el hash ya es conocido la foto se
+   crea de una vez compartiendo los archivos y no hace falta enviar bytes
+2. PUT con la cabecera Content-Range: bytes inicio-fin/tamano y esos bytes en el cuerpo. Se escriben directo al
+   archivo parcial por bloques. Una parte no puede empezar despues de lo ya recibido, si la conexion se corta se
+   consulta la subida y se continua desde [recibidos]
+3. POST finalizar verifica el tamaño, el hash y que sea una imagen, y crea la foto
+
+Cada foto es una subida independiente, el cliente puede subir varias en paralelo"""
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from PIL import Image
+
+from inspecciones.almacenamiento import hash_de_archivo
+from inspecciones.models import SubidaDeFoto, FotoCuestionario, FotoRespuesta
+from inspecciones.trabajos import encolar
+
+TAMANO_BLOQUE = 64 * 1024
+TAMANO_MAXIMO_FOTO = 50 * 1024 * 1024
+
+MODELOS = {SubidaDeFoto.Destinos.cuestionario: FotoCuestionario, SubidaDeFoto.Destinos.inspeccion: FotoRespuesta}
+
+_RANGO = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class ErrorDeSubida(Exception):
+    pass
+
+
+class ParteFueraDeOrden(ErrorDeSubida):
+    pass
+
+
+def foto_con_hash(Modelo, digest, organizacion_id):
+    """Para cuando el cliente solo envia el hash: una foto con ese contenido subida por [organizacion_id]. Entre todas
+    las fotos responder seria confirmarle que otra organizacion tiene esa foto"""
+    if organizacion_id is None:
+        return None
+    return _foto_con_contenido(Modelo._default_manager.filter(organizacion=organizacion_id), digest)
+
+
+def _foto_con_contenido(fotos, digest):
+    # de preferencia una ya procesada, para compartir tambien sus versiones
+    return fotos.filter(hash_subida=digest).order_by('-procesada').first()
+
+
+def crear_foto(Modelo, archivo, organizacion_id, digest=None):
+    """Crea una foto de [organizacion_id] con el contenido de [archivo]. Cada subida es una foto nueva porque una foto
+    pertenece a una sola respuesta o pregunta, pero si el contenido ya existe la nueva comparte los archivos de la
+    anterior"""
+    digest = digest or hash_de_archivo(archivo)
+    # con los bytes en la mano se puede compartir con la foto de cualquier organizacion
+    existente = _foto_con_contenido(Modelo._default_manager.all(), digest)
+    if existente is not None:
+        return existente.compartir_archivos(organizacion_id)
+    return Modelo._default_manager.create(foto=archivo, hash_subida=digest, organizacion_id=organizacion_id)
+
+
+def procesar_en_segundo_plano(Modelo, fotos):
+    # las versiones se generan en segundo plano, mientras tanto se sirve la original
+    sin_procesar = [str(foto.pk) for foto in fotos if not foto.procesada]
+    if sin_procesar:
+        encolar('procesar_fotos', modelo=Modelo._meta.label, ids=sin_procesar)
+
+
+def _directorio():
+    # no el directorio temporal del sistema, que se puede limpiar al reiniciar y no se comparte entre servidores. La
+    # vista de medios no entrega esta carpeta
+    return getattr(settings, 'INSPECCIONES_DIRECTORIO_SUBIDAS', os.path.join(settings.MEDIA_ROOT, 'subidas_parciales'))
+
+
+def ruta_parcial(subida):
+    return os.path.join(_directorio(), f'{subida.pk}.part')
+
+
+def iniciar_subida(subida):
+    """Prepara el archivo parcial de una subida recien creada, o la termina de una vez si su hash ya es conocido"""
+    Modelo = MODELOS[subida.destino]
+    organizacion_id = subida.creador.organizacion_id
+    existente = foto_con_hash(Modelo, subida.hash, organizacion_id) if subida.hash else None
+    if existente is not None:
+        foto = existente.compartir_archivos(organizacion_id)
+        subida.foto, subida.recibidos = foto.pk, subida.tamano
+        subida.save(update_fields=['foto', 'recibidos'])
+        procesar_en_segundo_plano(Modelo, [foto])
+        return
+    os.makedirs(_directorio(), exist_ok=True)
+    open(ruta_parcial(subida), 'wb').close()
+
+
+def leer_rango(cabecera, tamano):
+    """(inicio, fin) inclusivos de una cabecera Content-Range"""
+    coincidencia = _RANGO.match(cabecera or '')
+    if coincidencia is None:
+        raise ErrorDeSubida('Se requiere la cabecera Content-Range: bytes inicio-fin/tamano')
+    inicio, fin, total = map(int, coincidencia.groups())
+    if total != tamano or inicio > fin or fin >= tamano:
+        raise ErrorDeSubida('El rango no corresponde al tamaño de la subida')
+    return inicio, fin
+
+
+def escribir_parte(subida, inicio, fin, flujo):
+    """Copia de [flujo] al archivo parcial los bytes [inicio, fin] sin cargarlos completos en memoria. Si el flujo
+    termina antes, lo que llego queda escrito y se puede continuar desde ahi. Las partes ya recibidas se pueden
+    reenviar"""
+    if subida.foto is not None:
+        raise ErrorDeSubida('La subida ya fue finalizada')
+    if inicio > subida.recibidos:
+        raise ParteFueraDeOrden(f'La parte debe empezar en el byte {subida.recibidos} o antes')
+    if not os.path.exists(ruta_parcial(subida)):
+        _reiniciar(subida)
+    pendientes = fin - inicio + 1
+    with open(ruta_parcial(subida), 'r+b') as archivo:
+        archivo.seek(inicio)
+        while pendientes and flujo is not None and (bloque := flujo.read(min(TAMANO_BLOQUE, pendientes))):
+            archivo.write(bloque)
+            pendientes -= len(bloque)
+    recibidos = fin + 1 - pendientes
+    # otra parte de la misma subida pudo llegar mas lejos al mismo tiempo
+    SubidaDeFoto.objects.filter(pk=subida.pk).update(recibidos=Greatest('recibidos', recibidos),
+                                                     momento_modificacion=timezone.now())
+    subida.refresh_from_db(fields=['recibidos'])
+
+
+def finalizar_subida(subida):
+    """Crea la foto con el archivo parcial completo y lo borra. Finalizar otra vez no hace nada. La subida queda
+    bloqueada mientras tanto, asi dos finalizaciones simultaneas crean una sola foto"""
+    if subida.foto is not None:
+        return
+    if subida.recibidos < subida.tamano:
+        raise ErrorDeSubida(f'Faltan bytes, se han recibido {subida.recibidos} de {subida.tamano}')
+    Modelo = MODELOS[subida.destino]
+    with transaction.atomic():
+        subida.foto = SubidaDeFoto.objects.select_for_update().values_list('foto', flat=True).get(pk=subida.pk)
+        if subida.foto is not None:
+            return
+        perdido = not os.path.exists(ruta_parcial(subida))
+        if not perdido:
+            with open(ruta_parcial(subida), 'rb') as parcial:
+                foto = _crear_foto_de_parcial(Modelo, subida, parcial)
+            subida.foto = foto.pk
+            subida.save(update_fields=['foto'])
+            procesar_en_segundo_plano(Modelo, [foto])
+    if perdido:
+        # fuera de la transaccion para que el reinicio no se revierta con el error
+        _reiniciar(subida)
+    os.remove(ruta_parcial(subida))
+
+
+def _crear_foto_de_parcial(Modelo, subida, parcial):
+    archivo = File(parcial, name=subida.nombre)
+    digest = hash_de_archivo(archivo)
+    if subida.hash and digest != subida.hash:
+        raise ErrorDeSubida('El contenido recibido no corresponde al hash de la subida')
+    try:
+        with Image.open(parcial) as imagen:
+            imagen.verify()
+    except Exception:
+        raise ErrorDeSubida('El archivo no es una imagen valida')
+    return crear_foto(Modelo, archivo, subida.creador.organizacion_id, digest)
+
+
+def _reiniciar(subida):
+    """Cuando el archivo parcial se perdio, por ejemplo al reiniciar el servidor, la subida vuelve a empezar vacia"""
+    # otra peticion pudo finalizarla y borrar el archivo despues de que esta leyo la subida
+    if not SubidaDeFoto.objects.filter(pk=subida.pk, foto__isnull=True).update(recibidos=0,
+                                                                              momento_modificacion=timezone.now()):
+        raise ErrorDeSubida('La subida ya fue finalizada')
+    os.makedirs(_directorio(), exist_ok=True)
+    open(ruta_parcial(subida), 'wb').close()
+    subida.recibidos = 0
+    raise ParteFueraDeOrden('Se perdio lo recibido de la subida, se debe enviar de nuevo desde el byte 0')
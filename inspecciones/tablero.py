@@ -0,0 +1,105 @@
+"""Datos del tablero de la organizacion (la pagina de inicio despues del login). Cada grupo de datos sale de una
+consulta agrupada y queda en la cache compartida por organizacion hasta que cambia algo que lo afecta, ver
+inspecciones.signals"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, Q
+
+from inspecciones.models import Inspeccion, Respuesta
+from inspecciones.planeacion import pares_atrasados
+
+# el numero de atrasadas cambia con el paso del tiempo aunque nada se modifique, esto acota ese desfase
+DURACION_CACHE_TABLERO = 5 * 60
+# las estadisticas solo cambian con los datos y todos los procesos ven la invalidacion en la cache compartida, la
+# duracion solo acota el caso de dos invalidaciones simultaneas que quedan en un solo cambio de version
+DURACION_CACHE_ESTADISTICAS = 60 * 60
+
+
+def _clave(nombre, organizacion_id):
+    return f'inspecciones:{nombre}:{organizacion_id}'
+
+
+def _version(organizacion_id):
+    """Version de los datos cacheados de la organizacion. Empieza en el reloj actual para que no repita una version
+    anterior si la cache la descarto"""
+    clave = _clave('version-tablero', organizacion_id)
+    version = cache.get(clave)
+    if version is None:
+        cache.add(clave, time.time_ns(), None)
+        version = cache.get(clave)
+    return version
+
+
+def _cacheado(nombre, organizacion, calcular, duracion):
+    # la version se lee antes de calcular, si los datos cambian mientras tanto quedan guardados con una version vieja
+    version = _version(organizacion.pk)
+    clave = _clave(nombre, organizacion.pk)
+    datos = cache.get(clave, version=version)
+    if datos is None:
+        datos = calcular(organizacion)
+        cache.set(clave, datos, duracion, version=version)
+    return datos
+
+
+def datos_del_tablero(organizacion):
+    return _cacheado('tablero', organizacion, calcular_tablero, DURACION_CACHE_TABLERO)
+
+
+def estadisticas_del_tablero(organizacion):
+    return _cacheado('estadisticas', organizacion, calcular_estadisticas, DURACION_CACHE_ESTADISTICAS)
+
+
+def calcular_tablero(organizacion):
+    resumen = Inspeccion.objects.filter(cuestionario__organizacion=organizacion).aggregate(
+        total=Count('id'),
+        sinNovedad=Count('id', filter=Q(criticidad_calculada=0)),
+        promedio=Avg('criticidad_calculada'),
+    )
+    return {**resumen, 'atrasadas': pares_atrasados(organizacion).count()}
+
+
+def _respuestas_seleccionadas(organizacion):
+    """Las respuestas que se grafican: las de seleccion unica y numericas de primer nivel o dentro de una cuadricula y
+    las partes de las selecciones multiples de primer nivel, siempre que la respuesta de primer nivel tenga
+    criticidad de maximo 4"""
+    tipos = [Respuesta.TiposDeRespuesta.seleccion_unica, Respuesta.TiposDeRespuesta.numerica]
+    return Respuesta.objects.filter(
+        Q(inspeccion__cuestionario__organizacion=organizacion, criticidad_calculada__lte=4,
+          tipo_de_respuesta__in=tipos) |
+        Q(respuesta_cuadricula__inspeccion__cuestionario__organizacion=organizacion,
+          respuesta_cuadricula__criticidad_calculada__lte=4, tipo_de_respuesta__in=tipos) |
+        Q(respuesta_multiple__inspeccion__cuestionario__organizacion=organizacion,
+          respuesta_multiple__criticidad_calculada__lte=4)
+    )
+
+
+def calcular_estadisticas(organizacion):
+    """Una consulta agrupada por cada grafica: estados de las inspecciones, histograma de criticidad y reparaciones"""
+    estados = dict(Inspeccion.objects.filter(cuestionario__organizacion=organizacion)
+                   .values_list('estado').annotate(cantidad=Count('id')).order_by())
+    respuestas = _respuestas_seleccionadas(organizacion)
+    criticidades = list(respuestas.values_list('criticidad_calculada').annotate(cantidad=Count('id'))
+                        .order_by('criticidad_calculada'))
+    reparaciones = respuestas.aggregate(novedades=Count('id', filter=Q(criticidad_calculada__gt=0)),
+                                        reparadas=Count('id', filter=Q(reparado=True)))
+    return {'estados': {estado: estados.get(estado, 0) for estado in Inspeccion.EstadoDeInspeccion.values},
+            'criticidades': criticidades, **reparaciones}
+
+
+def _nueva_version(organizaciones_ids):
+    for organizacion_id in organizaciones_ids:
+        try:
+            cache.incr(_clave('version-tablero', organizacion_id))
+        except ValueError:
+            # sin version nadie ha cacheado datos que se puedan volver a leer
+            pass
+
+
+def invalidar_tablero(*organizaciones_ids):
+    """Cambia la version de los datos cacheados de las organizaciones cuando se confirma la transaccion actual. Una
+    lectura concurrente que consulto antes del cambio los guarda con la version vieja, que ya nadie lee. Dos
+    invalidaciones simultaneas pueden quedar en un solo incremento porque incr no es atomico en todas las caches, en
+    ese caso la duracion de la cache es la que acota el desfase"""
+    transaction.on_commit(lambda: _nueva_version(organizaciones_ids))
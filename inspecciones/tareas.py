@@ -0,0 +1,143 @@
+"""Tareas que ejecutan los trabajadores, ver inspecciones.trabajos. Se registran en InspeccionesConfig.ready"""
+import os
+import tempfile
+from concurrent.futures import Future
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from inspecciones.agregados import recalcular_agregados
+from inspecciones.criticidad import recalcular_criticidades
+from inspecciones.exportacion import FORMATOS
+from inspecciones.imagenes import generar_versiones, pool, EXTENSIONES
+from inspecciones.importacion import procesar_importacion
+from inspecciones.models import Inspeccion, Importacion
+from inspecciones.planeacion import recalcular_planeacion_de_organizacion
+from inspecciones.recoleccion import recolectar_fotos, GRACIA
+from inspecciones.sincronizacion import purgar_lapidas
+from inspecciones.serializers import FiltroDeExportacionSerializer
+from inspecciones.tablero import invalidar_tablero
+from inspecciones.trabajos import tarea, reportar_avance, renovar, ErrorPermanente
+
+
+@tarea('procesar_fotos', prioridad=20)
+def procesar_fotos(trabajo, modelo, ids):
+    """Genera las versiones de las fotos [ids] del modelo [modelo] en el pool de procesos y las guarda desde este
+    proceso. Se leen y se envian por grupos del tamaño del pool para no tener todas en memoria.
+    INSPECCIONES_PROCESOS_FOTOS = 0 las genera sin pool, de a una. Una foto que no se puede leer o decodificar se
+    marca como procesada con su original y se reporta en [fallidas], sin detener las demas"""
+    fotos = list(apps.get_model(modelo).objects.filter(pk__in=ids, procesada=False))
+    formato = getattr(settings, 'INSPECCIONES_FORMATO_FOTOS', 'WEBP')
+    calidad = getattr(settings, 'INSPECCIONES_CALIDAD_FOTOS', 80)
+    procesos = getattr(settings, 'INSPECCIONES_PROCESOS_FOTOS', None)
+    por_grupo = 1 if procesos == 0 else procesos or os.cpu_count() or 1
+
+    fallidas = []
+    for inicio in range(0, len(fotos), por_grupo):
+        grupo = fotos[inicio:inicio + por_grupo]
+        pendientes = [_generar_versiones(foto, formato, calidad, procesos) for foto in grupo]
+        for foto, pendiente in zip(grupo, pendientes):
+            try:
+                versiones = pendiente.result()
+            except Exception:
+                fallidas.append(str(foto.pk))
+                foto.procesada = True
+                foto.save(update_fields=['procesada'])
+            else:
+                _guardar_versiones(foto, versiones, EXTENSIONES[formato])
+        reportar_avance(trabajo, (inicio + len(grupo)) / len(fotos))
+    return {'fotos': len(fotos), 'fallidas': fallidas}
+
+
+def _generar_versiones(foto, formato, calidad, procesos):
+    """Future con las versiones de [foto], o con el error si no se pudo leer o decodificar"""
+    pendiente = Future()
+    try:
+        with foto.foto.open('rb') as archivo:
+            contenido = archivo.read()
+        if procesos != 0:
+            return pool(procesos).submit(generar_versiones, contenido, formato, calidad)
+        pendiente.set_result(generar_versiones(contenido, formato, calidad))
+    except Exception as error:
+        pendiente.set_exception(error)
+    return pendiente
+
+
+def _guardar_versiones(foto, versiones, extension):
+    anterior = foto.foto.name
+    nombre = f'{os.path.splitext(os.path.basename(anterior))[0]}.{extension}'
+    for campo, version in [('foto', 'original'), ('miniatura', 'miniatura'), ('mediana', 'mediana')]:
+        getattr(foto, campo).save(nombre, ContentFile(versiones[version]), save=False)
+    foto.procesada = True
+    foto.save(update_fields=['foto', 'miniatura', 'mediana', 'procesada'])
+    # la original recodificada reemplaza a la subida
+    if foto.foto.name != anterior:
+        foto.foto.storage.delete(anterior)
+
+
+# la importacion registra sus propios fallos en el registro Importacion y no los reintenta. El segundo intento es para
+# cuando el trabajador muere a la mitad, repite el archivo completo pero el upsert lo hace seguro
+@tarea('importar_activos', prioridad=10, maximo_intentos=2)
+def importar_activos(trabajo, importacion):
+    procesar_importacion(importacion, al_escribir_lote=lambda carga: renovar(trabajo))
+    importacion = Importacion.objects.get(pk=importacion)
+    return {'importacion': str(importacion.pk), 'estado': importacion.estado, 'creados': importacion.creados,
+            'actualizados': importacion.actualizados, 'filas_con_error': importacion.filas_con_error}
+
+
+@tarea('exportar_inspecciones', prioridad=10)
+def exportar_inspecciones(trabajo, filtros):
+    """Escribe la exportacion en un archivo temporal y lo guarda en el almacenamiento de medios"""
+    filtro = FiltroDeExportacionSerializer(data=filtros)
+    if not filtro.is_valid():
+        # los filtros se validaron al encolar, si ya no son validos tampoco lo seran al reintentar
+        raise ErrorPermanente(filtro.errors)
+    inspecciones = filtro.filtrar(Inspeccion.objects.filter(cuestionario__organizacion=trabajo.organizacion))
+    formato = filtro.validated_data['formato']
+    exportar, _ = FORMATOS[formato]
+    with tempfile.TemporaryFile() as archivo:
+        for bloque in exportar(inspecciones):
+            archivo.write(bloque.encode() if isinstance(bloque, str) else bloque)
+        nombre = default_storage.save(f'exportaciones/{trabajo.pk}.{formato}', File(archivo))
+    return {'archivo': default_storage.url(nombre)}
+
+
+# los recalculos no van en una sola transaccion para que el avance se vea mientras corren, cada lote se escribe por
+# separado y si el trabajo se reintenta vuelve a calcular desde los datos guardados
+
+@tarea('recalcular_criticidades')
+def recalcular_criticidades_de_organizacion(trabajo):
+    cambios = recalcular_criticidades(Inspeccion.objects.filter(cuestionario__organizacion=trabajo.organizacion),
+                                      al_avanzar=lambda avance: reportar_avance(trabajo, avance))
+    invalidar_tablero(trabajo.organizacion_id)
+    return cambios
+
+
+@tarea('recalcular_agregados')
+def recalcular_agregados_de_organizacion(trabajo):
+    actualizadas = recalcular_agregados(Inspeccion.objects.filter(cuestionario__organizacion=trabajo.organizacion),
+                                        al_avanzar=lambda avance: reportar_avance(trabajo, avance))
+    invalidar_tablero(trabajo.organizacion_id)
+    return {'inspecciones': actualizadas}
+
+
+@tarea('reconstruir_planeacion')
+def reconstruir_planeacion(trabajo):
+    filas = recalcular_planeacion_de_organizacion(trabajo.organizacion)
+    invalidar_tablero(trabajo.organizacion_id)
+    return {'filas': filas}
+
+
+# mantenimiento de todas las organizaciones, se encola sin organizacion
+@tarea('recolectar_fotos', prioridad=-10, maximo_intentos=1)
+def recolectar_fotos_huerfanas(trabajo, horas_de_gracia=GRACIA.total_seconds() / 3600, simular=False):
+    return recolectar_fotos(timedelta(hours=horas_de_gracia), simular)
+
+
+@tarea('purgar_lapidas', prioridad=-10)
+def purgar_lapidas_vencidas(trabajo):
+    return {'lapidas': purgar_lapidas()}
@@ -0,0 +1,91 @@
+import uuid
+
+from django.urls import reverse
+
+from inspecciones.agregados import recalcular_agregados
+from inspecciones.models import Inspeccion
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class AgregadosDeInspeccionTest(InspeccionesAuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = {nombre: uuid.uuid4() for nombre in ['unica', 'opcion_unica', 'numerica', 'cuadricula', 'fila1',
+                                                       'fila2', 'opcion']}
+        # 4 preguntas a responder: la seleccion unica, la numerica y las dos filas de la cuadricula
+        _, self.id_cuestionario = self.crear_cuestionario([
+            {'n_orden': 1, 'pregunta': {
+                'id': self.ids['unica'], 'titulo': 'unica', 'descripcion': '', 'criticidad': 1,
+                'tipo_de_pregunta': 'seleccion_unica',
+                'opciones_de_respuesta': [{'id': self.ids['opcion_unica'], 'titulo': 'mal', 'descripcion': '',
+                                           'criticidad': 1, 'requiere_criticidad_del_inspector': False}]}},
+            {'n_orden': 2, 'pregunta': {
+                'id': self.ids['numerica'], 'titulo': 'presion', 'descripcion': '', 'criticidad': 1,
+                'tipo_de_pregunta': 'numerica', 'criticidades_numericas': []}},
+            {'n_orden': 3, 'pregunta': {
+                'id': self.ids['cuadricula'], 'titulo': 'cuadricula', 'descripcion': '', 'criticidad': 1,
+                'tipo_de_pregunta': 'cuadricula', 'tipo_de_cuadricula': 'seleccion_multiple',
+                'opciones_de_respuesta': [{'id': self.ids['opcion'], 'titulo': 'fuga', 'descripcion': '',
+                                           'criticidad': 1, 'requiere_criticidad_del_inspector': False}],
+                'preguntas': [{'id': self.ids[fila], 'titulo': fila, 'descripcion': '', 'criticidad': 1,
+                               'tipo_de_pregunta': 'parte_de_cuadricula'} for fila in ['fila1', 'fila2']]}},
+        ])
+
+    def _respuestas(self, con_numerica):
+        sin_fotos = {'fotos_base': [], 'fotos_reparacion': []}
+        parte = self._build_respuesta(None, tipo_de_respuesta='parte_de_seleccion_multiple', **sin_fotos,
+                                      opcion_respondida=self.ids['opcion'], opcion_respondida_esta_seleccionada=True,
+                                      criticidad_calculada=3, criticidad_calculada_con_reparaciones=3)
+        respuestas = [
+            {**self._build_respuesta(self.ids['unica'], tipo_de_respuesta='seleccion_unica', **sin_fotos,
+                                     opcion_seleccionada=self.ids['opcion_unica'], criticidad_calculada=2,
+                                     criticidad_calculada_con_reparaciones=0), 'id': self.ids['unica']},
+            {**self._build_respuesta(self.ids['cuadricula'], tipo_de_respuesta='cuadricula', **sin_fotos,
+                                     criticidad_calculada=3, criticidad_calculada_con_reparaciones=3,
+                                     subrespuestas_cuadricula=[self._build_respuesta(
+                                         self.ids['fila1'], tipo_de_respuesta='seleccion_multiple', **sin_fotos,
+                                         criticidad_calculada=3, criticidad_calculada_con_reparaciones=3,
+                                         subrespuestas_multiple=[parte])]),
+             'id': self.ids['cuadricula']},
+        ]
+        if con_numerica:
+            respuestas.append(self._build_respuesta(self.ids['numerica'], tipo_de_respuesta='numerica', **sin_fotos,
+                                                    valor_numerico=5, criticidad_calculada=7,
+                                                    criticidad_calculada_con_reparaciones=7))
+        return respuestas
+
+    def _agregados(self, id_inspeccion):
+        return Inspeccion.objects.filter(pk=id_inspeccion).values(
+            'preguntas_respondidas', 'total_preguntas', 'avance', 'criticidad_calculada',
+            'criticidad_calculada_con_reparaciones', 'criticidad_maxima').get()
+
+    def test_contadores_al_crear_y_actualizar_la_inspeccion(self):
+        response, id_inspeccion = self.crear_inspeccion(self.id_cuestionario, respuestas=self._respuestas(True))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self._agregados(id_inspeccion), {
+            'preguntas_respondidas': 3, 'total_preguntas': 4, 'avance': 0.75, 'criticidad_calculada': 12,
+            'criticidad_calculada_con_reparaciones': 10, 'criticidad_maxima': 7})
+        self.assertEqual(response.data['avance'], 0.75)
+
+        # al quitar la numerica los contadores se actualizan en el mismo PUT
+        url = reverse('api:inspeccion-completa-detail', args=[id_inspeccion])
+        response = self.client.put(url, {'id': id_inspeccion, 'cuestionario': self.id_cuestionario,
+                                         'momento_inicio': '2020-01-01T00:00:00Z', 'activo': self.activo.id,
+                                         'criticidad_calculada': 0, 'criticidad_calculada_con_reparaciones': 0,
+                                         'estado': 'borrador', 'respuestas': self._respuestas(False)},
+                                   format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._agregados(id_inspeccion), {
+            'preguntas_respondidas': 2, 'total_preguntas': 4, 'avance': 0.5, 'criticidad_calculada': 5,
+            'criticidad_calculada_con_reparaciones': 3, 'criticidad_maxima': 3})
+
+    def test_recalcular_desde_la_base_de_datos_coincide(self):
+        _, id_inspeccion = self.crear_inspeccion(self.id_cuestionario, respuestas=self._respuestas(True))
+        incremental = self._agregados(id_inspeccion)
+        Inspeccion.objects.update(preguntas_respondidas=0, total_preguntas=0, avance=0, criticidad_maxima=0)
+
+        self.assertEqual(recalcular_agregados(Inspeccion.objects.all()), 1)
+
+        self.assertEqual(self._agregados(id_inspeccion), incremental)
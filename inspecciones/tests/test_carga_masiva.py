@@ -0,0 +1,221 @@
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from inspecciones.models import Cuestionario, Pregunta, EtiquetaDePregunta, FotoCuestionario, FotoRespuesta, \
+    OpcionDeRespuesta, Respuesta, Activo, EtiquetaDeActivo
+from inspecciones.serializers import CuestionarioCompletoSerializer, InspeccionCompletaSerializer
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class CargaMasivaCuestionarioTest(InspeccionesAuthenticatedTestCase):
+    # funciones auxiliares
+
+    def _build_bloques(self, n_bloques):
+        """Cada 10 bloques uno es un titulo y otro una cuadricula de 3 preguntas, los demas son de seleccion unica"""
+        bloques = []
+        for i in range(n_bloques):
+            if i % 10 == 0:
+                bloques.append({'n_orden': i, 'titulo': {'id': uuid.uuid4(), 'titulo': 'tit', 'descripcion': ''}})
+            elif i % 10 == 1:
+                bloques.append({'n_orden': i, 'pregunta': {
+                    'id': uuid.uuid4(), 'titulo': 'cuadricula', 'descripcion': '', 'criticidad': 1,
+                    'tipo_de_pregunta': 'cuadricula', 'tipo_de_cuadricula': 'seleccion_unica',
+                    'etiquetas': [{'clave': 'sistema', 'valor': f'sistema{i % 7}'}],
+                    'opciones_de_respuesta': [self._build_opcion(), self._build_opcion()],
+                    'preguntas': [{'id': uuid.uuid4(), 'titulo': 'sub', 'descripcion': '', 'criticidad': 1,
+                                   'tipo_de_pregunta': 'parte_de_cuadricula'} for _ in range(3)]}})
+            else:
+                bloques.append({'n_orden': i, 'pregunta': {
+                    'id': uuid.uuid4(), 'titulo': 'tit', 'descripcion': '', 'criticidad': 1,
+                    'tipo_de_pregunta': 'seleccion_unica',
+                    'etiquetas': [{'clave': 'sistema', 'valor': f'sistema{i % 7}'}, {'clave': 'zona', 'valor': 'a'}],
+                    'opciones_de_respuesta': [self._build_opcion(), self._build_opcion()]}})
+        return bloques
+
+    def _build_opcion(self):
+        return {'id': uuid.uuid4(), 'titulo': 'op', 'descripcion': '', 'criticidad': 1,
+                'requiere_criticidad_del_inspector': False}
+
+    def _contar_consultas_al_guardar(self, bloques, version=1):
+        serializer = CuestionarioCompletoSerializer(
+            data={'id': uuid.uuid4(), 'tipo_de_inspeccion': 'preoperacional', 'version': version,
+                  'estado': 'finalizado', 'periodicidad_dias': 1, 'etiquetas_aplicables': [], 'bloques': bloques},
+            context={'request': SimpleNamespace(user=self.user)})
+        serializer.is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as consultas:
+            serializer.save()
+        return len(consultas)
+
+    # inicio tests
+
+    def test_etiquetas_repetidas_se_crean_una_sola_vez(self):
+        EtiquetaDePregunta.objects.create(clave='zona', valor='a')
+        self._contar_consultas_al_guardar(self._build_bloques(20))
+
+        self.assertEqual(EtiquetaDePregunta.objects.count(), 8)  # 7 sistemas + la zona que ya existia
+        self.assertEqual(Pregunta.objects.filter(etiquetas__clave='zona').count(), 16)
+
+    def test_cuadricula_y_fotos_quedan_asociadas(self):
+        bloques = self._build_bloques(2)
+        bloques[1]['pregunta']['fotos_guia'] = [self.foto_cuestionario.id]
+        self._contar_consultas_al_guardar(bloques)
+
+        cuadricula = Pregunta.objects.get(tipo_de_pregunta='cuadricula')
+        self.assertEqual(cuadricula.preguntas.count(), 3)
+        self.assertEqual(cuadricula.opciones_de_respuesta.count(), 2)
+        self.assertEqual(list(cuadricula.fotos_guia.all()), [FotoCuestionario.objects.get()])
+
+    def test_benchmark_consultas_por_tamano_de_cuestionario(self):
+        """Antes se hacia al menos una consulta por fila, ahora la cantidad depende solo del numero de lotes"""
+        consultas = {}
+        for version, n_bloques in enumerate([10, 100, 1000], start=1):
+            consultas[n_bloques] = self._contar_consultas_al_guardar(self._build_bloques(n_bloques), version)
+
+        self.assertEqual(Cuestionario.objects.count(), 3)
+        self.assertEqual(OpcionDeRespuesta.objects.count(), 2 * (9 + 90 + 900))
+        self.assertLessEqual(consultas[10], 12)
+        # crece con el numero de lotes, no con el de filas
+        self.assertLessEqual(consultas[100], consultas[1000])
+        self.assertLess(consultas[1000], 60)
+
+
+class CargaMasivaInspeccionTest(InspeccionesAuthenticatedTestCase):
+    def _contar_consultas_al_guardar(self, respuestas, id_cuestionario):
+        serializer = InspeccionCompletaSerializer(
+            data={'id': str(uuid.uuid4()), 'cuestionario': id_cuestionario, 'activo': self.activo.id,
+                  'momento_inicio': '2020-01-01T00:00:00Z', 'estado': 'borrador', 'criticidad_calculada': 0,
+                  'criticidad_calculada_con_reparaciones': 0, 'respuestas': respuestas},
+            context={'request': SimpleNamespace(user=self.user)})
+        serializer.is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as consultas:
+            serializer.save()
+        return len(consultas)
+
+    def _build_cuadricula_multiple(self, id_pregunta, id_subpregunta, id_opcion, n_filas, fotos=False):
+        def parte(**kwargs):
+            return self._build_respuesta(None, tipo_de_respuesta='parte_de_seleccion_multiple',
+                                         opcion_respondida=id_opcion, opcion_respondida_esta_seleccionada=True,
+                                         **kwargs)
+
+        fotos_vacias = {} if fotos else {'fotos_base': [], 'fotos_reparacion': []}
+        return self._build_respuesta(id_pregunta, tipo_de_respuesta='cuadricula', **fotos_vacias,
+                                     subrespuestas_cuadricula=[
+                                         self._build_respuesta(id_subpregunta, tipo_de_respuesta='seleccion_multiple',
+                                                               fotos_base=[], fotos_reparacion=[],
+                                                               subrespuestas_multiple=[
+                                                                   parte(fotos_base=[], fotos_reparacion=[])])
+                                         for _ in range(n_filas)])
+
+    def test_arbol_de_tres_niveles_con_fotos(self):
+        (_, id_cuestionario), id_pregunta, id_opcion, id_subpregunta = \
+            self.crear_cuestionario_con_pregunta_de_cuadricula()
+
+        self._contar_consultas_al_guardar(
+            [self._build_cuadricula_multiple(id_pregunta, id_subpregunta, id_opcion, 2, fotos=True)], id_cuestionario)
+
+        cuadricula = Respuesta.objects.get(tipo_de_respuesta='cuadricula')
+        self.assertIsNotNone(cuadricula.inspeccion_id)
+        self.assertEqual(cuadricula.subrespuestas_cuadricula.count(), 2)
+        for fila in cuadricula.subrespuestas_cuadricula.all():
+            self.assertIsNone(fila.inspeccion_id)
+            self.assertEqual(fila.subrespuestas_multiple.count(), 1)
+        self.assertEqual(list(cuadricula.fotos_base), [self.foto_inspeccion1])
+        self.assertEqual(list(cuadricula.fotos_reparacion), [self.foto_inspeccion2])
+
+    def test_consultas_no_dependen_del_numero_de_respuestas(self):
+        (_, id_cuestionario), id_pregunta, id_opcion, id_subpregunta = \
+            self.crear_cuestionario_con_pregunta_de_cuadricula()
+
+        consultas_pequena = self._contar_consultas_al_guardar(
+            [self._build_cuadricula_multiple(id_pregunta, id_subpregunta, id_opcion, 2, fotos=True)], id_cuestionario)
+        # la otra inspeccion usa las mismas fotos, solo se pueden asociar si estan libres
+        FotoRespuesta.objects.update(respuesta=None)
+        # el arbol grande cabe en un lote por nivel, si no habria una consulta adicional por lote
+        consultas_grande = self._contar_consultas_al_guardar(
+            [self._build_cuadricula_multiple(id_pregunta, id_subpregunta, id_opcion, 8, fotos=True)
+             for _ in range(5)], id_cuestionario)
+
+        self.assertEqual(Respuesta.objects.count(), (1 + 2 * 2) + 5 * (1 + 8 * 2))
+        self.assertEqual(consultas_pequena, consultas_grande)
+
+
+class CargaMasivaActivosTest(InspeccionesAuthenticatedTestCase):
+    def _importar(self, filas):
+        response = self.client.post(reverse('api:activo-importar'), filas, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def _build_filas(self, n_filas):
+        return [{'identificador': f'activo{i}', 'etiquetas': [{'clave': 'modelo', 'valor': f'm{i % 5}'},
+                                                               {'clave': 'zona', 'valor': 'a'}]}
+                for i in range(n_filas)]
+
+    def test_upsert_por_identificador_y_errores_por_fila(self):
+        filas = [
+            # self.activo ya existe con identificador a1, se actualizan sus etiquetas
+            {'identificador': 'a1', 'etiquetas': [{'clave': 'modelo', 'valor': 'x'}]},
+            {'identificador': 'nuevo', 'etiquetas': []},
+            {'identificador': 'nuevo'},
+            {'etiquetas': []},
+            {'identificador': 'otro', 'id': str(self.activo.id)},
+        ]
+
+        resumen = self._importar(filas)
+
+        self.assertEqual((resumen['creados'], resumen['actualizados']), (1, 1))
+        self.assertEqual([error['fila'] for error in resumen['errores']], [2, 3, 4])
+        self.assertIn('identificador', resumen['errores'][1]['errores'])
+        self.assertEqual([str(e) for e in Activo.objects.get(pk=self.activo.pk).etiquetas.all()], ['modelo: x'])
+        self.assertEqual(Activo.objects.filter(organizacion=self.organizacion).count(), 2)
+
+    def test_id_repetido_en_la_carga(self):
+        id_repetido = str(uuid.uuid4())
+
+        resumen = self._importar([{'identificador': 'b1', 'id': id_repetido},
+                                  {'identificador': 'b2', 'id': id_repetido}])
+
+        self.assertEqual(resumen['creados'], 1)
+        self.assertEqual(resumen['errores'], [{'fila': 1, 'errores': {'id': ['Id repetido en la carga']}}])
+
+    def test_solo_cambia_el_momento_de_modificacion_si_cambian_las_etiquetas(self):
+        filas = [{'identificador': 'a1', 'etiquetas': [{'clave': 'modelo', 'valor': 'x'}]}]
+        self._importar(filas)
+        modificacion = Activo.objects.get(pk=self.activo.pk).momento_modificacion
+
+        self.assertEqual(self._importar(filas)['actualizados'], 1)
+
+        self.assertEqual(Activo.objects.get(pk=self.activo.pk).momento_modificacion, modificacion)
+
+    def test_repite_el_lote_si_otra_carga_crea_los_mismos_activos(self):
+        bulk_create = Activo.objects.bulk_create
+        conflicto = [IntegrityError('natural_key')]
+
+        def crear(nuevos, **kwargs):
+            if conflicto:
+                raise conflicto.pop()
+            return bulk_create(nuevos, **kwargs)
+
+        with mock.patch.object(Activo.objects, 'bulk_create', side_effect=crear):
+            resumen = self._importar(self._build_filas(3) + [{'identificador': 'otro', 'id': str(self.activo.id)}])
+
+        self.assertEqual((resumen['creados'], len(resumen['errores'])), (3, 1))
+        self.assertEqual(Activo.objects.filter(organizacion=self.organizacion).count(), 4)
+
+    def test_consultas_no_dependen_del_numero_de_activos(self):
+        def contar_consultas(filas):
+            with CaptureQueriesContext(connection) as consultas:
+                self._importar(filas)
+            return len(consultas)
+
+        # la primera carga crea las etiquetas, las siguientes ya las encuentran
+        self._importar(self._build_filas(5))
+        con_10 = contar_consultas(self._build_filas(10))
+        # la ultima carga actualiza los 10 anteriores y crea 190 mas, siempre en un solo lote
+        self.assertEqual(contar_consultas(self._build_filas(200)), con_10)
+        self.assertEqual(Activo.objects.filter(organizacion=self.organizacion).count(), 201)
+        self.assertEqual(EtiquetaDeActivo.objects.count(), 6)
@@ -1,6 +1,7 @@
 import uuid
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.urls import reverse
 from rest_framework.test import APITestCase
 
@@ -12,8 +13,10 @@ class InspeccionesAuthenticatedTestCase(APITestCase):
     [self.perfil] perteneciente a esta y realiza la autenticacion en el [self.client], tambien crea un activo [self.activo]"""
 
     def setUp(self):
+        # los ids se reutilizan entre tests, asi que una cache de un test anterior podria responder por otro
+        cache.clear()
         self._crear_admin_y_autenticar()
-        self.activo = Activo.objects.create(identificador="a1", organizacion=self.organizacion)
+        self.activo = Activo.objects.create(id=uuid.uuid4(), identificador="a1", organizacion=self.organizacion)
         _, foto_cuestionario_id = self.subir_foto_cuestionario()
         self.foto_cuestionario = FotoCuestionario.objects.get(id=foto_cuestionario_id)
         _, foto_inspeccion_id1 = self.subir_foto_inspeccion()
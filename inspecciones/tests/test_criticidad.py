@@ -0,0 +1,126 @@
+import uuid
+from io import StringIO
+from types import SimpleNamespace
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from inspecciones.criticidad import IndiceDeCriticidades, indice_de_cuestionario, recalcular_criticidades
+from inspecciones.models import Cuestionario, Inspeccion, Respuesta
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class IndiceDeCriticidadesTest(SimpleTestCase):
+    def test_busca_el_rango_que_contiene_al_valor(self):
+        pregunta = uuid.uuid4()
+        indice = IndiceDeCriticidades([
+            SimpleNamespace(pregunta_id=pregunta, valor_minimo=10, valor_maximo=20, criticidad=2),
+            SimpleNamespace(pregunta_id=pregunta, valor_minimo=0, valor_maximo=100, criticidad=1),
+            SimpleNamespace(pregunta_id=pregunta, valor_minimo=30, valor_maximo=40, criticidad=3),
+        ])
+
+        self.assertEqual(indice.criticidad(pregunta, 10), 2)
+        self.assertEqual(indice.criticidad(pregunta, 25), 1)
+        self.assertEqual(indice.criticidad(pregunta, 40), 3)
+        self.assertEqual(indice.criticidad(pregunta, 100), 1)
+        self.assertEqual(indice.criticidad(pregunta, 101), 0)
+        self.assertEqual(indice.criticidad(pregunta, -1), 0)
+        self.assertEqual(indice.criticidad(pregunta, None), 0)
+        self.assertEqual(indice.criticidad(uuid.uuid4(), 10), 0)
+
+
+class IndiceDeCuestionarioTest(InspeccionesAuthenticatedTestCase):
+    def test_indice_en_memoria_hasta_que_se_guarda_el_cuestionario(self):
+        id_pregunta = uuid.uuid4()
+        _, id_cuestionario = self.crear_cuestionario([{'n_orden': 1, 'pregunta': {
+            'id': id_pregunta, 'titulo': 'tit', 'descripcion': '', 'criticidad': 1,
+            'tipo_de_pregunta': 'numerica',
+            'criticidades_numericas': [{'id': uuid.uuid4(), 'criticidad': 1, 'valor_minimo': 0, 'valor_maximo': 10}]}}])
+
+        self.assertEqual(indice_de_cuestionario(id_cuestionario).criticidad(id_pregunta, 5), 1)
+        momento = Cuestionario.objects.get(pk=id_cuestionario).momento_modificacion
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(indice_de_cuestionario(id_cuestionario, momento).criticidad(id_pregunta, 5), 1)
+        self.assertEqual(len(consultas), 0)
+
+        # la edicion cambia el momento de modificacion y con el la llave del indice en todos los procesos
+        self.client.put(reverse('api:cuestionario-completo-detail', args=[id_cuestionario]), {
+            'id': id_cuestionario, 'tipo_de_inspeccion': 'preoperacional', 'version': 1, 'estado': 'finalizado',
+            'periodicidad_dias': 1, 'etiquetas_aplicables': [], 'bloques': [{'n_orden': 1, 'pregunta': {
+                'id': id_pregunta, 'titulo': 'tit', 'descripcion': '', 'criticidad': 1,
+                'tipo_de_pregunta': 'numerica', 'criticidades_numericas': [
+                    {'id': uuid.uuid4(), 'criticidad': 4, 'valor_minimo': 0, 'valor_maximo': 10}]}}]},
+            format='json')
+
+        self.assertEqual(indice_de_cuestionario(id_cuestionario).criticidad(id_pregunta, 5), 4)
+
+
+class RecalculoDeCriticidadesTest(InspeccionesAuthenticatedTestCase):
+    def _crear_inspeccion(self):
+        """Una seleccion unica reparada que requiere criticidad del inspector, una numerica y una cuadricula de
+        seleccion multiple con una parte seleccionada y otra no. Todas llegan con criticidad 0"""
+        id_unica, id_opcion_unica, id_numerica, id_cuadricula, id_fila, id_opcion = (uuid.uuid4() for _ in range(6))
+        _, id_cuestionario = self.crear_cuestionario([
+            {'n_orden': 1, 'pregunta': {
+                'id': id_unica, 'titulo': 'unica', 'descripcion': '', 'criticidad': 2,
+                'tipo_de_pregunta': 'seleccion_unica',
+                'opciones_de_respuesta': [{'id': id_opcion_unica, 'titulo': 'mal', 'descripcion': '', 'criticidad': 3,
+                                           'requiere_criticidad_del_inspector': True}]}},
+            {'n_orden': 2, 'pregunta': {
+                'id': id_numerica, 'titulo': 'presion', 'descripcion': '', 'criticidad': 2,
+                'tipo_de_pregunta': 'numerica',
+                'criticidades_numericas': [{'id': uuid.uuid4(), 'criticidad': 4, 'valor_minimo': 0,
+                                            'valor_maximo': 10}]}},
+            {'n_orden': 3, 'pregunta': {
+                'id': id_cuadricula, 'titulo': 'cuadricula', 'descripcion': '', 'criticidad': 1,
+                'tipo_de_pregunta': 'cuadricula', 'tipo_de_cuadricula': 'seleccion_multiple',
+                'opciones_de_respuesta': [{'id': id_opcion, 'titulo': 'fuga', 'descripcion': '', 'criticidad': 3,
+                                           'requiere_criticidad_del_inspector': False}],
+                'preguntas': [{'id': id_fila, 'titulo': 'fila', 'descripcion': '', 'criticidad': 1,
+                               'tipo_de_pregunta': 'parte_de_cuadricula'}]}},
+        ])
+        sin_fotos = {'fotos_base': [], 'fotos_reparacion': []}
+        partes = [self._build_respuesta(None, tipo_de_respuesta='parte_de_seleccion_multiple', **sin_fotos,
+                                        opcion_respondida=id_opcion, opcion_respondida_esta_seleccionada=seleccionada)
+                  for seleccionada in [True, False]]
+        _, id_inspeccion = self.crear_inspeccion(id_cuestionario, respuestas=[
+            self._build_respuesta(id_unica, tipo_de_respuesta='seleccion_unica', **sin_fotos,
+                                  opcion_seleccionada=id_opcion_unica, criticidad_del_inspector=4, reparado=True),
+            self._build_respuesta(id_numerica, tipo_de_respuesta='numerica', **sin_fotos, valor_numerico=5),
+            self._build_respuesta(id_cuadricula, tipo_de_respuesta='cuadricula', **sin_fotos,
+                                  subrespuestas_cuadricula=[self._build_respuesta(
+                                      id_fila, tipo_de_respuesta='seleccion_multiple', **sin_fotos,
+                                      subrespuestas_multiple=partes)]),
+        ])
+        return str(id_inspeccion)
+
+    def _criticidades(self, tipo):
+        return list(Respuesta.objects.filter(tipo_de_respuesta=tipo).order_by('-criticidad_calculada').values_list(
+            'criticidad_calculada', 'criticidad_calculada_con_reparaciones'))
+
+    def test_recalcula_respuestas_e_inspeccion(self):
+        id_inspeccion = self._crear_inspeccion()
+
+        cambios = recalcular_criticidades(Inspeccion.objects.all())
+
+        # la parte no seleccionada ya valia 0
+        self.assertEqual(cambios, {'respuestas': 5, 'inspecciones': 1})
+        self.assertEqual(self._criticidades('seleccion_unica'), [(24, 0)])
+        self.assertEqual(self._criticidades('numerica'), [(8, 8)])
+        self.assertEqual(self._criticidades('parte_de_seleccion_multiple'), [(3, 3), (0, 0)])
+        self.assertEqual(self._criticidades('seleccion_multiple'), [(3, 3)])
+        self.assertEqual(self._criticidades('cuadricula'), [(3, 3)])
+        inspeccion = Inspeccion.objects.get(pk=id_inspeccion)
+        self.assertEqual((inspeccion.criticidad_calculada, inspeccion.criticidad_calculada_con_reparaciones), (35, 11))
+        # una segunda pasada no encuentra nada que cambiar
+        self.assertEqual(recalcular_criticidades(Inspeccion.objects.all()), {'respuestas': 0, 'inspecciones': 0})
+
+    def test_comando_recalcula_la_organizacion(self):
+        id_inspeccion = self._crear_inspeccion()
+
+        call_command('recalcular_criticidades', organizacion=[self.organizacion.pk], stdout=StringIO())
+
+        self.assertEqual(Inspeccion.objects.get(pk=id_inspeccion).criticidad_calculada, 35)
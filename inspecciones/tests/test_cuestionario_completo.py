@@ -1,9 +1,11 @@
 import uuid
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
-from inspecciones.models import Cuestionario, Bloque, Pregunta, OpcionDeRespuesta
+from inspecciones.models import Cuestionario, Bloque, Pregunta, OpcionDeRespuesta, FotoCuestionario, Respuesta
 from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
 
 
@@ -24,6 +26,21 @@ class CuestionarioCompletoTest(InspeccionesAuthenticatedTestCase):
         self.assertEqual(bloque['n_orden'], 1)
         return bloque
 
+    def _put_cuestionario(self, id_cuestionario, bloques):
+        url = reverse('api:cuestionario-completo-detail', args=[id_cuestionario])
+        return self.client.put(url, {'id': id_cuestionario, 'tipo_de_inspeccion': 'preoperacional', 'version': 1,
+                                     'estado': 'finalizado', 'periodicidad_dias': 1, 'etiquetas_aplicables': [],
+                                     'bloques': bloques},
+                               format='json')
+
+    def _bloque_con_pregunta(self, n_orden, id_pregunta, id_opcion, titulo='tit'):
+        return {'n_orden': n_orden, 'pregunta': {
+            'id': id_pregunta, 'titulo': titulo, 'descripcion': 'desc', 'criticidad': 1,
+            'etiquetas': [{'clave': 'sistema', 'valor': 'motor'}], 'fotos_guia': [self.foto_cuestionario.id],
+            'tipo_de_pregunta': 'seleccion_unica',
+            'opciones_de_respuesta': [{'id': id_opcion, 'titulo': 'tit', 'descripcion': 'desc', 'criticidad': 1,
+                                       'requiere_criticidad_del_inspector': False}]}}
+
     # inicio tests
 
     def test_crear_cuestionario_con_bloque(self):
@@ -221,3 +238,94 @@ class CuestionarioCompletoTest(InspeccionesAuthenticatedTestCase):
         self.assertEqual(opcion_de_respuesta['id'], str(id_opcion))
         subpregunta = cuadricula['preguntas'][0]
         self.assertEqual(subpregunta['id'], str(id_subpregunta))
+
+    def test_actualizar_cuestionario_solo_aplica_los_cambios(self):
+        (_, id_cuestionario), id_pregunta, id_opcion = self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+        id_bloque = Bloque.objects.get().id
+        _, id_inspeccion = self.crear_inspeccion_con_respuesta_de_seleccion_unica(id_cuestionario, id_pregunta,
+                                                                                  id_opcion)
+
+        with CaptureQueriesContext(connection) as consultas:
+            response = self._put_cuestionario(
+                id_cuestionario, [self._bloque_con_pregunta(1, id_pregunta, id_opcion, titulo='cambio')])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cambios']['pregunta'], {'insertadas': 0, 'actualizadas': 1, 'borradas': 0})
+        self.assertEqual(response.data['cambios']['bloque'], {'insertadas': 0, 'actualizadas': 0, 'borradas': 0})
+        self.assertEqual(Bloque.objects.get().id, id_bloque)
+        self.assertEqual(Pregunta.objects.get().titulo, 'cambio')
+        self.assertEqual(Pregunta.objects.get().etiquetas.count(), 1)
+        self.assertEqual(Pregunta.objects.get().fotos_guia.count(), 1)
+        # las respuestas de las inspecciones ya hechas se conservan
+        self.assertEqual(Respuesta.objects.get().inspeccion_id, str(id_inspeccion))
+        self.assertLess(len(consultas), 40)
+
+    def test_actualizar_cuestionario_agrega_y_borra_bloques(self):
+        (_, id_cuestionario), id_pregunta, id_opcion = self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+        id_pregunta_nueva, id_opcion_nueva = uuid.uuid4(), uuid.uuid4()
+
+        response = self._put_cuestionario(id_cuestionario, [
+            {'n_orden': 1, 'titulo': {'id': uuid.uuid4(), 'titulo': 'tit', 'descripcion': ''}},
+            self._bloque_con_pregunta(2, id_pregunta_nueva, id_opcion_nueva)])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cambios']['bloque'], {'insertadas': 2, 'actualizadas': 0, 'borradas': 1})
+        self.assertEqual(list(Pregunta.objects.values_list('id', flat=True)), [id_pregunta_nueva])
+        self.assertEqual(list(OpcionDeRespuesta.objects.values_list('id', flat=True)), [id_opcion_nueva])
+        # la foto pasa a la pregunta nueva en lugar de borrarse con la anterior
+        self.assertEqual(FotoCuestionario.objects.get().object_id, id_pregunta_nueva)
+
+    def test_no_se_borran_preguntas_ni_opciones_con_respuestas(self):
+        (_, id_cuestionario), id_pregunta, id_opcion = self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+        self.crear_inspeccion_con_respuesta_de_seleccion_unica(id_cuestionario, id_pregunta, id_opcion)
+
+        response = self._put_cuestionario(id_cuestionario, [self._bloque_con_pregunta(1, uuid.uuid4(), uuid.uuid4())])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(id_pregunta), response.data['preguntas'][0])
+        self.assertIn(str(id_opcion), response.data['opciones_de_respuesta'][0])
+        self.assertEqual(Pregunta.objects.get().id, id_pregunta)
+
+        # la pregunta se conserva pero se quita la opcion respondida
+        response = self._put_cuestionario(id_cuestionario, [self._bloque_con_pregunta(1, id_pregunta, uuid.uuid4())])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn('preguntas', response.data)
+        self.assertIn(str(id_opcion), response.data['opciones_de_respuesta'][0])
+        self.assertEqual(list(OpcionDeRespuesta.objects.values_list('id', flat=True)), [id_opcion])
+        self.assertEqual(Respuesta.objects.count(), 1)
+
+    def test_actualizar_cuestionario_no_toma_fotos_de_otro_cuestionario(self):
+        (_, id_otro), id_pregunta_otra, _ = self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+        Cuestionario.objects.filter(id=id_otro).update(version=2)
+        _, id_cuestionario = self.crear_cuestionario_con_bloque(
+            titulo={'id': uuid.uuid4(), 'titulo': 'tit', 'descripcion': ''})
+
+        response = self._put_cuestionario(id_cuestionario,
+                                          [self._bloque_con_pregunta(1, uuid.uuid4(), uuid.uuid4())])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(self.foto_cuestionario.id), response.data['fotos'][0])
+        self.assertEqual(FotoCuestionario.objects.get().object_id, id_pregunta_otra)
+
+    def _contar_consultas_al_leer(self, n_bloques):
+        bloques = []
+        for i in range(n_bloques):
+            bloque = self._bloque_con_pregunta(2 * i, uuid.uuid4(), uuid.uuid4())
+            bloque['pregunta'].update(tipo_de_pregunta='cuadricula', tipo_de_cuadricula='seleccion_unica', preguntas=[
+                {'id': uuid.uuid4(), 'titulo': 'tit', 'descripcion': '', 'criticidad': 1,
+                 'tipo_de_pregunta': 'parte_de_cuadricula'} for _ in range(3)])
+            bloques.append(bloque)
+            bloques.append({'n_orden': 2 * i + 1, 'titulo': {'id': uuid.uuid4(), 'titulo': 'tit', 'descripcion': '',
+                                                             'fotos': [self.foto_cuestionario.id]}})
+        _, id_cuestionario = self.crear_cuestionario(bloques)
+
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('api:cuestionario-completo-detail', args=[id_cuestionario]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['bloques']), 2 * n_bloques)
+        Cuestionario.objects.all().delete()
+        return len(consultas)
+
+    def test_consultas_al_leer_no_dependen_del_tamano_del_cuestionario(self):
+        self.assertEqual(self._contar_consultas_al_leer(1), self._contar_consultas_al_leer(20))
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from inspecciones.exportacion import COLUMNAS_INSPECCION, COLUMNAS_RESPUESTA
+from inspecciones.models import Activo
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class ExportacionTest(InspeccionesAuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.ids = {nombre: uuid.uuid4() for nombre in
+                    ['cuadricula', 'fila', 'bien', 'luces', 'delantera', 'trasera', 'presion']}
+        opcion = lambda nombre: {'id': self.ids[nombre], 'titulo': nombre, 'descripcion': '', 'criticidad': 1,
+                                 'requiere_criticidad_del_inspector': False}
+        pregunta = lambda nombre, tipo, **kwargs: {'id': self.ids[nombre], 'titulo': nombre, 'descripcion': '',
+                                                   'criticidad': 1, 'tipo_de_pregunta': tipo, **kwargs}
+        _, self.id_cuestionario = self.crear_cuestionario([
+            {'n_orden': 1, 'pregunta': pregunta('cuadricula', 'cuadricula', tipo_de_cuadricula='seleccion_unica',
+                                                opciones_de_respuesta=[opcion('bien')],
+                                                preguntas=[pregunta('fila', 'parte_de_cuadricula')])},
+            {'n_orden': 2, 'pregunta': pregunta('luces', 'seleccion_multiple',
+                                                opciones_de_respuesta=[opcion('delantera'), opcion('trasera')])},
+            {'n_orden': 3, 'pregunta': pregunta('presion', 'numerica', criticidades_numericas=[])},
+        ])
+
+    def _crear_inspeccion(self):
+        sin_fotos = {'fotos_base': [], 'fotos_reparacion': []}
+        parte = lambda nombre, seleccionada: self._build_respuesta(
+            None, tipo_de_respuesta='parte_de_seleccion_multiple', opcion_respondida=self.ids[nombre],
+            opcion_respondida_esta_seleccionada=seleccionada, **sin_fotos)
+        response, id_inspeccion = self.crear_inspeccion(self.id_cuestionario, respuestas=[
+            self._build_respuesta(self.ids['presion'], tipo_de_respuesta='numerica', valor_numerico=5,
+                                  criticidad_calculada=2, criticidad_calculada_con_reparaciones=2, **sin_fotos),
+            self._build_respuesta(self.ids['luces'], tipo_de_respuesta='seleccion_multiple', **sin_fotos,
+                                  subrespuestas_multiple=[parte('delantera', True), parte('trasera', False)]),
+            self._build_respuesta(self.ids['cuadricula'], tipo_de_respuesta='cuadricula', **sin_fotos,
+                                  subrespuestas_cuadricula=[self._build_respuesta(
+                                      self.ids['fila'], tipo_de_respuesta='seleccion_unica', reparado=True,
+                                      opcion_seleccionada=self.ids['bien'], **sin_fotos)]),
+        ])
+        self.assertEqual(response.status_code, 201, response.data)
+        return str(id_inspeccion)
+
+    def _descargar(self, **filtros):
+        response = self.client.get(reverse('descargar_inspecciones'), filtros)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_con_una_fila_por_respuesta(self):
+        id_inspeccion = self._crear_inspeccion()
+
+        filas = list(csv.DictReader(io.StringIO(self._descargar().decode())))
+
+        self.assertEqual(list(filas[0]), COLUMNAS_INSPECCION + COLUMNAS_RESPUESTA)
+        self.assertEqual({fila['inspeccion'] for fila in filas}, {id_inspeccion})
+        # en el orden del cuestionario, sin las partes de seleccion multiple no seleccionadas
+        self.assertEqual([(fila['cuadricula'], fila['pregunta'], fila['respuesta']) for fila in filas],
+                         [('cuadricula', 'fila', 'bien'), ('', 'luces', 'delantera'), ('', 'presion', '5.0')])
+        self.assertEqual(filas[0]['reparado'], 'True')
+        self.assertEqual(filas[2]['criticidad'], '2')
+        self.assertEqual(filas[0]['activo'], self.activo.identificador)
+
+    def test_ndjson_filtrado_por_activo(self):
+        id_inspeccion = self._crear_inspeccion()
+        otro_activo = Activo.objects.create(id=uuid.uuid4(), identificador='otro', organizacion=self.organizacion)
+
+        lineas = self._descargar(formato='ndjson', activo=self.activo.id).decode().splitlines()
+        vacia = self._descargar(formato='ndjson', activo=otro_activo.id)
+
+        self.assertEqual(len(lineas), 1)
+        inspeccion = json.loads(lineas[0])
+        self.assertEqual(inspeccion['inspeccion'], id_inspeccion)
+        self.assertEqual([respuesta['pregunta'] for respuesta in inspeccion['respuestas']],
+                         ['fila', 'luces', 'presion'])
+        self.assertEqual(vacia, b'')
+
+    def test_xlsx(self):
+        self._crear_inspeccion()
+
+        libro = load_workbook(io.BytesIO(self._descargar(formato='xlsx')), read_only=True)
+        filas = list(libro.active.iter_rows(values_only=True))
+
+        self.assertEqual(list(filas[0]), COLUMNAS_INSPECCION + COLUMNAS_RESPUESTA)
+        self.assertEqual(len(filas), 4)
+        # excel no maneja zonas horarias, las fechas van en la hora local
+        self.assertEqual(filas[3][COLUMNAS_INSPECCION.index('momento_inicio')],
+                         timezone.localtime(datetime(2020, 1, 1, tzinfo=dt_timezone.utc)).replace(tzinfo=None))
+
+    def test_consultas_no_dependen_del_numero_de_inspecciones(self):
+        def contar_consultas():
+            with CaptureQueriesContext(connection) as consultas:
+                self._descargar()
+            return len([c for c in consultas if 'inspecciones_' in c['sql']])
+
+        self._crear_inspeccion()
+        consultas_una = contar_consultas()
+        for _ in range(5):
+            self._crear_inspeccion()
+
+        self.assertEqual(contar_consultas(), consultas_una)
+
+    def test_formato_invalido(self):
+        response = self.client.get(reverse('descargar_inspecciones'), {'formato': 'pdf'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('formato', response.json())
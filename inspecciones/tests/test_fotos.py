@@ -0,0 +1,156 @@
+import io
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import override_settings
+from django.urls import reverse
+from PIL import Image
+
+from inspecciones.almacenamiento import hash_de_archivo
+from inspecciones.imagenes import generar_versiones
+from inspecciones.models import FotoRespuesta, Organizacion, Perfil, ReferenciaDeArchivo, SubidaDeFoto
+from inspecciones.subidas import ruta_parcial
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+from inspecciones.trabajos import encolar, procesar_pendientes
+
+
+def _jpeg_rotado(ancho, alto):
+    """Una foto como las del celular: los pixeles horizontales y la orientacion vertical en el EXIF"""
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotar 90 grados
+    salida = io.BytesIO()
+    Image.new('RGB', (ancho, alto), 'red').save(salida, 'JPEG', exif=exif)
+    return salida.getvalue()
+
+
+class VersionesDeFotosTest(InspeccionesAuthenticatedTestCase):
+    def _procesar(self):
+        # los archivos reemplazados se borran al confirmar la transaccion
+        with self.captureOnCommitCallbacks(execute=True):
+            procesar_pendientes(tipos=['procesar_fotos'])
+        self.foto_inspeccion1.refresh_from_db()
+
+    def test_generar_versiones(self):
+        versiones = generar_versiones(_jpeg_rotado(2000, 1000))
+
+        tamanos = {}
+        for version, contenido in versiones.items():
+            with Image.open(io.BytesIO(contenido)) as imagen:
+                self.assertEqual(imagen.format, 'WEBP')
+                self.assertEqual(len(imagen.getexif()), 0)
+                tamanos[version] = imagen.size
+        # la orientacion queda aplicada a los pixeles
+        self.assertEqual(tamanos, {'original': (1000, 2000), 'mediana': (640, 1280), 'miniatura': (160, 320)})
+
+    def test_versiones_en_segundo_plano_con_pool_de_procesos(self):
+        original = self.foto_inspeccion1.foto.name
+        self.assertEqual(self.foto_inspeccion1.versiones['miniatura'], self.foto_inspeccion1.foto.url)
+
+        self._procesar()
+
+        foto = self.foto_inspeccion1
+        self.assertTrue(foto.procesada)
+        self.assertTrue(foto.foto.name.endswith('.webp'))
+        # las dos fotos de inspeccion del setUp compartian el archivo subido, ya nadie lo usa
+        self.assertFalse(foto.foto.storage.exists(original))
+        self.assertTrue(foto.miniatura.name.startswith('fotos_inspecciones/miniaturas/'))
+        with foto.miniatura.open('rb') as archivo, Image.open(archivo) as imagen:
+            self.assertLessEqual(max(imagen.size), 320)
+        self.assertEqual(FotoRespuesta.objects.filter(procesada=False).count(), 0)
+
+    @override_settings(INSPECCIONES_PROCESOS_FOTOS=0)
+    def test_una_foto_que_no_es_imagen_no_detiene_las_demas(self):
+        danada = FotoRespuesta.objects.create(foto=ContentFile(b'no es una imagen', name='danada.jpg'))
+        nombre = danada.foto.name
+        trabajo = encolar('procesar_fotos', modelo='inspecciones.FotoRespuesta',
+                          ids=[str(danada.pk), str(self.foto_inspeccion1.pk)])
+
+        self._procesar()
+
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'terminado', trabajo.error)
+        self.assertEqual(trabajo.resultado['fallidas'], [str(danada.pk)])
+        danada.refresh_from_db()
+        self.assertEqual((danada.procesada, danada.foto.name), (True, nombre))
+        self.assertFalse(FotoRespuesta.objects.filter(procesada=False).exists())
+
+    @override_settings(INSPECCIONES_PROCESOS_FOTOS=0, INSPECCIONES_FORMATO_FOTOS='JPEG')
+    def test_urls_de_las_versiones_en_la_api(self):
+        self._procesar()
+        (_, id_cuestionario), id_pregunta, id_opcion = self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+        _, id_inspeccion = self.crear_inspeccion_con_respuesta_de_seleccion_unica(id_cuestionario, id_pregunta,
+                                                                                  id_opcion)
+
+        response = self.client.get(reverse('api:inspeccion-completa-detail', args=[id_inspeccion]))
+
+        versiones = response.data['respuestas'][0]['fotos_base_url'][0]['versiones']
+        self.assertEqual(versiones['miniatura'], 'http://testserver' + self.foto_inspeccion1.miniatura.url)
+        self.assertTrue(versiones['mediana'].startswith('http://testserver/media/fotos_inspecciones/medianas/'))
+        self.assertTrue(versiones['original'].endswith('.jpg'))
+
+    def tearDown(self):
+        for foto in FotoRespuesta.objects.exclude(miniatura=''):
+            foto.miniatura.delete(save=False)
+            foto.mediana.delete(save=False)
+            foto.foto.delete(save=False)
+        super().tearDown()
+
+
+class AlmacenamientoPorContenidoTest(InspeccionesAuthenticatedTestCase):
+    def _referencias(self, foto):
+        return ReferenciaDeArchivo.objects.get(nombre=foto.foto.name).referencias
+
+    def test_el_mismo_contenido_se_guarda_una_vez(self):
+        # el setUp sube dos veces la misma imagen como foto de inspeccion
+        self.assertNotEqual(self.foto_inspeccion1.pk, self.foto_inspeccion2.pk)
+        self.assertEqual(self.foto_inspeccion1.foto.name, self.foto_inspeccion2.foto.name)
+        with open('media/perfil.png', 'rb') as archivo:
+            digest = hash_de_archivo(ContentFile(archivo.read()))
+        self.assertEqual(self.foto_inspeccion1.foto.name, f'fotos_inspecciones/{digest[:2]}/{digest}.png')
+        self.assertEqual(self._referencias(self.foto_inspeccion1), 2)
+
+    def test_subir_solo_el_hash_de_una_foto_conocida(self):
+        desconocido = '0' * 64
+        response = self.client.post(reverse('api:inspeccion-completa-subir-fotos'),
+                                    {'hashes': [self.foto_inspeccion1.hash_subida, desconocido]})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn(desconocido, response.data)
+        nueva = FotoRespuesta.objects.get(pk=response.data[self.foto_inspeccion1.hash_subida])
+        self.assertIsNone(nueva.respuesta)
+        self.assertEqual(nueva.foto.name, self.foto_inspeccion1.foto.name)
+        self.assertEqual(self._referencias(nueva), 3)
+
+    def test_el_hash_solo_se_reconoce_en_la_misma_organizacion(self):
+        otro = get_user_model().objects.create_user(username='otro', password='otro')
+        Perfil.objects.create(user=otro, organizacion=Organizacion.objects.create(nombre='otra'),
+                              rol=Perfil.Roles.inspector)
+        self.client.force_authenticate(user=otro)
+        digest = self.foto_inspeccion1.hash_subida
+
+        response = self.client.post(reverse('api:inspeccion-completa-subir-fotos'), {'hashes': [digest]})
+        self.assertEqual(response.data, {})
+        response = self.client.post(reverse('api:subida-foto-list'),
+                                    {'destino': 'inspeccion', 'nombre': 'foto.png', 'tamano': 10, 'hash': digest},
+                                    format='json')
+        self.assertEqual((response.data['foto'], response.data['recibidos']), (None, 0))
+        os.remove(ruta_parcial(SubidaDeFoto.objects.get(pk=response.data['id'])))
+
+        # con los bytes si comparte el archivo
+        _, id_foto = self.subir_foto_inspeccion()
+        self.assertEqual(FotoRespuesta.objects.get(pk=id_foto).foto.name, self.foto_inspeccion1.foto.name)
+
+    def test_el_archivo_se_borra_con_la_ultima_referencia(self):
+        nombre = self.foto_inspeccion1.foto.name
+        storage = self.foto_inspeccion1.foto.storage
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.foto_inspeccion1.foto.delete(save=False)
+        self.assertTrue(storage.exists(nombre))
+        self.assertEqual(ReferenciaDeArchivo.objects.get(nombre=nombre).referencias, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.foto_inspeccion2.foto.delete(save=False)
+        self.assertFalse(storage.exists(nombre))
+        self.assertFalse(ReferenciaDeArchivo.objects.filter(nombre=nombre).exists())
@@ -0,0 +1,84 @@
+import io
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from openpyxl import Workbook
+
+from inspecciones import tablero
+from inspecciones.models import Activo, Importacion
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+from inspecciones.trabajos import procesar_pendientes
+
+
+class ImportacionTest(InspeccionesAuthenticatedTestCase):
+    def tearDown(self):
+        for importacion in Importacion.objects.all():
+            importacion.archivo.delete(save=False)
+        super().tearDown()
+
+    def _subir(self, nombre, contenido, **datos):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('api:importacion-list'),
+                                        {'archivo': SimpleUploadedFile(nombre, contenido), **datos},
+                                        format='multipart')
+            procesar_pendientes(tipos=['importar_activos'])
+        return response
+
+    def _consultar(self, response):
+        self.assertEqual(response.status_code, 201, response.data)
+        response = self.client.get(reverse('api:importacion-detail', args=[response.data['id']]))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_importar_csv_por_lotes(self):
+        contenido = 'identificador,modelo,zona\r\na1,x,\r\nnuevo1,m1,a\r\n,m2,a\r\nnuevo2,12,a\r\n'
+        importacion = self._consultar(self._subir('activos.csv', contenido.encode('utf-8-sig'), tamano_lote=1))
+
+        self.assertEqual(importacion['estado'], 'terminada')
+        self.assertEqual((importacion['filas_procesadas'], importacion['creados'], importacion['actualizados']),
+                         (4, 2, 1))
+        self.assertEqual(importacion['filas_con_error'], 1)
+        # el numero de fila es el del archivo, los encabezados son la fila 1
+        self.assertEqual(importacion['errores'][0]['fila'], 4)
+        self.assertEqual([str(e) for e in Activo.objects.get(pk=self.activo.pk).etiquetas.all()], ['modelo: x'])
+        self.assertEqual(sorted(str(e) for e in Activo.objects.get(identificador='nuevo2').etiquetas.all()),
+                         ['modelo: 12', 'zona: a'])
+
+    def test_importar_xlsx(self):
+        libro = Workbook()
+        libro.active.append(['Identificador', 'modelo'])
+        libro.active.append(['nuevo', 7.0])
+        libro.active.append([None, None])
+        archivo = io.BytesIO()
+        libro.save(archivo)
+
+        importacion = self._consultar(self._subir('activos.xlsx', archivo.getvalue()))
+
+        self.assertEqual((importacion['estado'], importacion['creados']), ('terminada', 1))
+        self.assertEqual([str(e) for e in Activo.objects.get(identificador='nuevo').etiquetas.all()], ['modelo: 7'])
+
+    def test_la_importacion_del_trabajador_invalida_el_tablero_de_la_web(self):
+        with mock.patch('inspecciones.tablero.calcular_tablero', wraps=tablero.calcular_tablero) as calcular:
+            tablero.datos_del_tablero(self.organizacion)
+            # el trabajador corre en otro proceso con su propia conexion a la cache
+            with mock.patch('inspecciones.tablero.cache', caches.create_connection('default')):
+                self._subir('activos.csv', b'identificador,modelo\r\nnuevo,m\r\n')
+            tablero.datos_del_tablero(self.organizacion)
+
+        self.assertEqual(calcular.call_count, 2)
+
+    def test_archivo_sin_identificador_falla(self):
+        importacion = self._consultar(self._subir('activos.csv', b'nombre\r\na\r\n'))
+
+        self.assertEqual(importacion['estado'], 'fallida')
+        self.assertIn('identificador', importacion['mensaje'])
+        self.assertIsNotNone(importacion['momento_fin'])
+
+    def test_formato_no_soportado(self):
+        response = self._subir('activos.txt', b'identificador\r\na\r\n')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('archivo', response.data)
+        self.assertFalse(Importacion.objects.exists())
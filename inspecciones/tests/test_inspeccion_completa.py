@@ -1,9 +1,11 @@
 import uuid
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
-from inspecciones.models import Inspeccion, OpcionDeRespuesta
+from inspecciones.models import Cuestionario, Inspeccion, OpcionDeRespuesta, Respuesta, FotoRespuesta
 from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
 
 
@@ -138,3 +140,156 @@ class InspeccionCompletaTest(InspeccionesAuthenticatedTestCase):
         self.assertEqual(len(respuesta['subrespuestas_cuadricula']), 1)
         subrespuesta = respuesta['subrespuestas_cuadricula'][0]
         self.assertEqual(subrespuesta['opcion_seleccionada'], id_opcion)
+
+    def _put_inspeccion(self, id_inspeccion, id_cuestionario, respuestas):
+        url = reverse('api:inspeccion-completa-detail', args=[id_inspeccion])
+        return self.client.put(url, {'id': id_inspeccion, 'cuestionario': id_cuestionario,
+                                     'momento_inicio': '2020-01-01T00:00:00Z', 'activo': self.activo.id,
+                                     'criticidad_calculada': 0, 'criticidad_calculada_con_reparaciones': 0,
+                                     'estado': 'borrador', 'respuestas': respuestas},
+                               format='json')
+
+    def test_actualizar_inspeccion_solo_aplica_los_cambios(self):
+        (_, id_cuestionario), id_pregunta, id_opcion, id_subpregunta = \
+            self.crear_cuestionario_con_pregunta_de_cuadricula()
+        id_cuadricula, id_fila = uuid.uuid4(), uuid.uuid4()
+        fila = self._build_respuesta(id_subpregunta, id=id_fila, tipo_de_respuesta='seleccion_unica',
+                                     opcion_seleccionada=id_opcion)
+        cuadricula = self._build_respuesta(id_pregunta, id=id_cuadricula, tipo_de_respuesta='cuadricula',
+                                           fotos_base=[], fotos_reparacion=[], subrespuestas_cuadricula=[fila])
+        _, id_inspeccion = self.crear_inspeccion(id_cuestionario, respuestas=[cuadricula])
+
+        fila['observacion'] = 'cambio'
+        response = self._put_inspeccion(id_inspeccion, id_cuestionario, [cuadricula])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cambios'], {'insertadas': 0, 'actualizadas': 1, 'borradas': 0,
+                                                    'fotos_asociadas': 0, 'fotos_desasociadas': 0})
+        self.assertEqual(Respuesta.objects.get(id=id_fila).observacion, 'cambio')
+        self.assertEqual(Respuesta.objects.count(), 2)
+
+        cuadricula['subrespuestas_cuadricula'] = []
+        response = self._put_inspeccion(id_inspeccion, id_cuestionario, [cuadricula])
+
+        self.assertEqual(response.data['cambios'], {'insertadas': 0, 'actualizadas': 0, 'borradas': 1,
+                                                    'fotos_asociadas': 0, 'fotos_desasociadas': 2})
+        self.assertEqual(list(Respuesta.objects.values_list('id', flat=True)), [id_cuadricula])
+
+    def test_actualizar_inspeccion_no_toca_fotos_de_otras_inspecciones(self):
+        (_, id_cuestionario), id_pregunta, id_opcion = self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+        _, id_foto_en_vuelo = self.subir_foto_inspeccion()
+        (_, id_inspeccion) = self.crear_inspeccion_con_respuesta_de_seleccion_unica(
+            id_cuestionario, id_pregunta, id_opcion)
+
+        response = self._put_inspeccion(id_inspeccion, id_cuestionario, [])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cambios']['borradas'], 1)
+        self.assertEqual(response.data['cambios']['fotos_desasociadas'], 2)
+        # las desasociadas las borra el recolector despues, no la peticion
+        self.assertEqual(FotoRespuesta.objects.filter(respuesta=None).count(), 3)
+        foto_en_vuelo = FotoRespuesta.objects.get(id=id_foto_en_vuelo)
+        foto_en_vuelo.foto.delete()
+
+    def test_actualizar_inspeccion_no_toma_fotos_de_otra_inspeccion(self):
+        (_, id_cuestionario), id_pregunta, id_opcion = self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+        response, id_otra = self.crear_inspeccion_con_respuesta_de_seleccion_unica(id_cuestionario, id_pregunta,
+                                                                                   id_opcion)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        _, id_inspeccion = self.crear_inspeccion(id_cuestionario, respuestas=[])
+        respuesta = self._build_respuesta(id_pregunta, tipo_de_respuesta='seleccion_unica',
+                                          opcion_seleccionada=id_opcion)
+
+        response = self._put_inspeccion(id_inspeccion, id_cuestionario, [respuesta])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(self.foto_inspeccion1.id), response.data['fotos'][0])
+        self.assertEqual(FotoRespuesta.objects.get(id=self.foto_inspeccion1.id).respuesta.inspeccion_id, str(id_otra))
+        self.assertFalse(Respuesta.objects.filter(inspeccion=id_inspeccion).exists())
+        # tampoco al crear
+        self.assertEqual(self.crear_inspeccion(id_cuestionario, respuestas=[respuesta])[0].status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def _contar_consultas_al_leer(self, n_filas):
+        (_, id_cuestionario), id_pregunta, id_opcion, id_subpregunta = \
+            self.crear_cuestionario_con_pregunta_de_cuadricula()
+        parte = self._build_respuesta(None, tipo_de_respuesta='parte_de_seleccion_multiple', fotos_base=[],
+                                      fotos_reparacion=[], opcion_respondida=id_opcion,
+                                      opcion_respondida_esta_seleccionada=True)
+        fila = self._build_respuesta(id_subpregunta, tipo_de_respuesta='seleccion_multiple', fotos_base=[],
+                                     fotos_reparacion=[], subrespuestas_multiple=[parte, parte])
+        _, id_inspeccion = self.crear_inspeccion(id_cuestionario, respuestas=[
+            self._build_respuesta(id_pregunta, tipo_de_respuesta='cuadricula',
+                                  subrespuestas_cuadricula=[fila] * n_filas)])
+
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('api:inspeccion-completa-detail', args=[id_inspeccion]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cuadricula = response.data['respuestas'][0]
+        self.assertEqual(len(cuadricula['subrespuestas_cuadricula']), n_filas)
+        self.assertEqual(len(cuadricula['subrespuestas_cuadricula'][0]['subrespuestas_multiple']), 2)
+        self.assertEqual(len(cuadricula['fotos_base_url']), 1)
+        Inspeccion.objects.all().delete()
+        Cuestionario.objects.all().delete()
+        return len(consultas)
+
+    def test_consultas_al_leer_no_dependen_del_numero_de_respuestas(self):
+        self.assertEqual(self._contar_consultas_al_leer(1), self._contar_consultas_al_leer(30))
+
+    def _crear_inspecciones_sin_respuestas(self, cantidad, **kwargs):
+        cuestionario = Cuestionario.objects.create(
+            id=uuid.uuid4(), tipo_de_inspeccion=f'listado{cantidad}', version=1, periodicidad_dias=1,
+            organizacion=self.organizacion, estado=Cuestionario.EstadoDeCuestionario.finalizado)
+        campos = {'estado': Inspeccion.EstadoDeInspeccion.borrador, 'criticidad_calculada': 0,
+                  'criticidad_calculada_con_reparaciones': 0, **kwargs}
+        Inspeccion.objects.bulk_create(
+            Inspeccion(id=str(uuid.uuid4()), cuestionario=cuestionario, activo=self.activo,
+                       momento_inicio='2020-01-01T00:00:00Z', **campos) for _ in range(cantidad))
+        return cuestionario
+
+    def test_listado_paginado_por_cursor(self):
+        self._crear_inspecciones_sin_respuestas(5)
+        # la mitad con el mismo momento_subida para que el id desempate
+        Inspeccion.objects.filter(pk__in=Inspeccion.objects.order_by('pk').values('pk')[:3]).update(
+            momento_subida='2021-01-01T00:00:00Z')
+
+        ids, url = [], reverse('api:inspeccion-completa-list') + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            ids += [inspeccion['id'] for inspeccion in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(ids, list(Inspeccion.objects.order_by('-momento_subida', '-id').values_list('id', flat=True)))
+        response = self.client.get(reverse('api:inspeccion-completa-list') + '?cursor=x')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('cursor', response.data)
+
+    def test_listado_filtrado_y_sin_respuestas(self):
+        self._crear_inspecciones_sin_respuestas(2, criticidad_calculada=5)
+        cuestionario = self._crear_inspecciones_sin_respuestas(
+            1, estado=Inspeccion.EstadoDeInspeccion.finalizada, criticidad_calculada=1)
+        url = reverse('api:inspeccion-completa-list')
+
+        response = self.client.get(url, {'criticidad_desde': 3})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertNotIn('respuestas', response.data['results'][0])
+        response = self.client.get(url, {'estado': 'finalizada', 'cuestionario': cuestionario.id,
+                                         'respuestas': 'true'})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['respuestas'], [])
+        self.assertEqual(self.client.get(url, {'momento_inicio_desde': 'ayer'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_consultas_del_listado_no_dependen_del_numero_de_inspecciones(self):
+        def contar_consultas():
+            with CaptureQueriesContext(connection) as consultas:
+                response = self.client.get(reverse('api:inspeccion-completa-list'), {'respuestas': 'true'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(consultas)
+
+        self._crear_inspecciones_sin_respuestas(2)
+        con_dos = contar_consultas()
+        self._crear_inspecciones_sin_respuestas(20)
+        self.assertEqual(contar_consultas(), con_dos)
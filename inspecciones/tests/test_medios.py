@@ -0,0 +1,74 @@
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from inspecciones.models import Organizacion, Perfil
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class ArchivosDeMediosTest(InspeccionesAuthenticatedTestCase):
+    def _descargar(self, nombre, **cabeceras):
+        response = self.client.get(reverse('archivo-de-medios', args=[nombre]), **cabeceras)
+        response.contenido = response.getvalue()
+        response.close()
+        return response
+
+    def _autenticar_en_otra_organizacion(self):
+        user = get_user_model().objects.create_user(username='perro', password='perro')
+        Perfil.objects.create(user=user, organizacion=Organizacion.objects.create(nombre='otra'),
+                              rol=Perfil.Roles.inspector)
+        self.client.force_authenticate(user=user)
+
+    def test_las_fotos_se_cachean_como_inmutables(self):
+        foto = self.foto_cuestionario.foto
+        self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+
+        response = self._descargar(foto.name)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with foto.open('rb') as archivo:
+            self.assertEqual(response.contenido, archivo.read())
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn(response['ETag'].strip('"'), foto.name)
+
+        response = self._descargar(foto.name, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.contenido, b'')
+
+    def test_los_demas_archivos_se_revalidan(self):
+        response = self._descargar('blank.jpg')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        response = self._descargar('blank.jpg', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_otra_organizacion_no_ve_las_fotos(self):
+        self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+        # las fotos recien subidas solo las ve la organizacion que las subio
+        self.assertEqual(self._descargar(self.foto_inspeccion1.foto.name).status_code, status.HTTP_200_OK)
+        self._autenticar_en_otra_organizacion()
+
+        self.assertEqual(self._descargar(self.foto_cuestionario.foto.name).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self._descargar(self.foto_inspeccion1.foto.name).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_requiere_autenticacion(self):
+        self.client.force_authenticate(user=None)
+
+        response = self._descargar(self.foto_inspeccion1.foto.name)
+
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    @override_settings(INSPECCIONES_X_ACCEL_REDIRECT='/media-interna/')
+    def test_delega_el_envio_a_nginx(self):
+        nombre = self.foto_inspeccion1.foto.name
+
+        response = self._descargar(nombre, HTTP_ACCEPT='image/webp')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'], f'/media-interna/{nombre}')
+        self.assertEqual(response.contenido, b'')
+        self.assertIn('immutable', response['Cache-Control'])
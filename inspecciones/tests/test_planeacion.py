@@ -0,0 +1,138 @@
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from inspecciones.models import Activo, Cuestionario, EtiquetaDeActivo, Inspeccion, Planeacion
+from inspecciones.planeacion import recalcular_planeacion, pares_atrasados
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class PlaneacionTest(InspeccionesAuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.etiqueta = EtiquetaDeActivo.objects.create(clave='modelo', valor='kenworth')
+        self.activo.etiquetas.add(self.etiqueta)
+        self.cuestionario = Cuestionario.objects.create(
+            id=uuid.uuid4(), tipo_de_inspeccion='preoperacional', version=1, periodicidad_dias=2,
+            organizacion=self.organizacion, estado=Cuestionario.EstadoDeCuestionario.finalizado)
+        # los cambios de cuestionarios se recalculan al confirmar la transaccion
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cuestionario.etiquetas_aplicables.add(self.etiqueta)
+
+    def _finalizar_inspeccion(self, hace_dias, activo=None):
+        momento = timezone.now() - timedelta(days=hace_dias)
+        return Inspeccion.objects.create(
+            id=str(uuid.uuid4()), cuestionario=self.cuestionario, activo=activo or self.activo,
+            momento_inicio=momento, momento_finalizacion=momento, estado=Inspeccion.EstadoDeInspeccion.finalizada,
+            criticidad_calculada=0, criticidad_calculada_con_reparaciones=0)
+
+    def test_se_crea_una_fila_por_cuestionario_que_aplica(self):
+        planeacion = Planeacion.objects.get()
+        self.assertEqual((planeacion.activo, planeacion.cuestionario), (self.activo, self.cuestionario))
+        self.assertIsNone(planeacion.momento_ultima_inspeccion)
+        self.assertEqual(planeacion.retraso, 0)
+
+        self.activo.etiquetas.remove(self.etiqueta)
+        self.assertFalse(Planeacion.objects.exists())
+
+    def test_guardar_inspeccion_actualiza_el_retraso(self):
+        self._finalizar_inspeccion(hace_dias=10)
+        self.assertEqual(Planeacion.objects.get().retraso, 8)
+
+        ultima = self._finalizar_inspeccion(hace_dias=1)
+        planeacion = Planeacion.objects.get()
+        self.assertEqual(planeacion.momento_ultima_inspeccion, ultima.momento_finalizacion)
+        self.assertEqual(planeacion.retraso, 0)
+
+    def test_los_cambios_de_un_cuestionario_se_recalculan_una_vez_al_confirmar(self):
+        otra = EtiquetaDeActivo.objects.create(clave='modelo', valor='volvo')
+        otro = Activo.objects.create(id=uuid.uuid4(), identificador='a0', organizacion=self.organizacion)
+        otro.etiquetas.add(otra)
+
+        with mock.patch('inspecciones.planeacion.recalcular_planeacion', wraps=recalcular_planeacion) as recalcular:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.cuestionario.periodicidad_dias = 5
+                self.cuestionario.save()
+                self.cuestionario.etiquetas_aplicables.set([otra])
+                self.assertEqual(Planeacion.objects.get().activo, self.activo)
+
+        recalcular.assert_called_once()
+        self.assertEqual(set(recalcular.call_args.args[0]), {self.activo, otro})
+        planeacion = Planeacion.objects.get()
+        self.assertEqual(planeacion.activo, otro)
+        self.assertEqual(planeacion.vencimiento, self.cuestionario.momento_subida + timedelta(days=5))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cuestionario.etiquetas_aplicables.clear()
+        self.assertFalse(Planeacion.objects.exists())
+
+    def test_comando_reconstruye_la_tabla(self):
+        self._finalizar_inspeccion(hace_dias=10)
+        Planeacion.objects.all().delete()
+
+        salida = StringIO()
+        call_command('reconstruir_planeacion', stdout=salida)
+
+        self.assertEqual(Planeacion.objects.get().retraso, 8)
+        self.assertIn('1 filas', salida.getvalue())
+
+    def test_lista_de_activos_hace_una_consulta_de_planeacion(self):
+        self.client.force_login(self.user)
+        activos = [Activo(id=uuid.uuid4(), identificador=f'b{i}', organizacion=self.organizacion) for i in range(30)]
+        Activo.objects.bulk_create(activos)
+        Activo.etiquetas.through.objects.bulk_create(
+            [Activo.etiquetas.through(activo_id=activo.id, etiquetadeactivo_id=self.etiqueta.id) for activo in activos])
+        recalcular_planeacion(activos)
+        self._finalizar_inspeccion(hace_dias=10, activo=activos[0])
+
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('activo-list'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['activo_list']), 31)
+        self.assertContains(response, 'Retraso 8 dias')
+        planeacion = [c['sql'] for c in consultas if 'planeacion' in c['sql']]
+        self.assertEqual(len(planeacion), 1)
+
+    def test_pares_atrasados_respeta_la_periodicidad_de_cada_cuestionario(self):
+        semanal = Cuestionario.objects.create(
+            id=uuid.uuid4(), tipo_de_inspeccion='semanal', version=1, periodicidad_dias=7,
+            organizacion=self.organizacion, estado=Cuestionario.EstadoDeCuestionario.finalizado)
+        semanal.etiquetas_aplicables.add(self.etiqueta)
+        self._finalizar_inspeccion(hace_dias=5)
+        Inspeccion.objects.create(
+            id=str(uuid.uuid4()), cuestionario=semanal, activo=self.activo, momento_inicio=timezone.now(),
+            momento_finalizacion=timezone.now() - timedelta(days=5), estado=Inspeccion.EstadoDeInspeccion.finalizada,
+            criticidad_calculada=0, criticidad_calculada_con_reparaciones=0)
+
+        with CaptureQueriesContext(connection) as consultas:
+            atrasados = list(pares_atrasados(self.organizacion))
+
+        self.assertEqual([(par['identificador'], par['tipo_de_inspeccion']) for par in atrasados],
+                         [('a1', 'preoperacional')])
+        self.assertEqual(len(consultas), 2)  # las periodicidades y los pares
+
+    def test_endpoint_de_atrasados_y_tablero(self):
+        self._finalizar_inspeccion(hace_dias=10)
+        otro = Activo.objects.create(id=uuid.uuid4(), identificador='a0', organizacion=self.organizacion)
+        otro.etiquetas.add(self.etiqueta)
+
+        response = self.client.get(reverse('api:activo-atrasados'), {'page_size': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['identificador'], 'a1')
+        self.assertEqual(response.data['results'][0]['retraso'], 8)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('mi-organizacion'))
+        self.assertEqual(response.context['inspecciones']['atrasadas'], 1)
+        response = self.client.get(reverse('activo-list'), {'atrasados': '1'})
+        self.assertEqual([activo['identificador'] for activo in response.context['activo_list']], ['a1'])
@@ -0,0 +1,92 @@
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+
+from inspecciones.models import FotoCuestionario, FotoRespuesta, ReferenciaDeArchivo, SubidaDeFoto
+from inspecciones.recoleccion import recolectar_fotos
+from inspecciones.subidas import ruta_parcial
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class RecoleccionDeFotosTest(InspeccionesAuthenticatedTestCase):
+    def _recolectar(self, **kwargs):
+        # los archivos se borran al confirmar la transaccion
+        with self.captureOnCommitCallbacks(execute=True):
+            return recolectar_fotos(**kwargs)
+
+    def test_las_fotos_recien_subidas_sobreviven_el_periodo_de_gracia(self):
+        resumen = self._recolectar()
+
+        self.assertEqual(resumen['fotos_marcadas'], 3)
+        self.assertEqual((resumen['fotorespuesta'], resumen['fotocuestionario']), (0, 0))
+        self.assertEqual(FotoRespuesta.objects.filter(huerfana_desde__isnull=False).count(), 2)
+        self.assertTrue(self.foto_inspeccion1.foto.storage.exists(self.foto_inspeccion1.foto.name))
+
+        # ya estan marcadas, no se vuelven a marcar
+        self.assertEqual(self._recolectar()['fotos_marcadas'], 0)
+
+    def test_borra_las_huerfanas_marcadas_y_sus_archivos(self):
+        self._recolectar()
+        # la foto de cuestionario se asocia despues de marcada
+        self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+
+        resumen = self._recolectar(gracia=timedelta(0))
+
+        self.assertEqual((resumen['fotorespuesta'], resumen['fotocuestionario']), (2, 0))
+        self.assertFalse(FotoRespuesta.objects.exists())
+        nombre = self.foto_inspeccion1.foto.name
+        self.assertFalse(self.foto_inspeccion1.foto.storage.exists(nombre))
+        self.assertFalse(ReferenciaDeArchivo.objects.filter(nombre=nombre).exists())
+        self.assertIsNone(FotoCuestionario.objects.get().huerfana_desde)
+        self.assertTrue(self.foto_cuestionario.foto.storage.exists(self.foto_cuestionario.foto.name))
+
+    def test_las_fotos_de_un_cuestionario_borrado_quedan_huerfanas(self):
+        (_, id_cuestionario), _, _ = self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+        self.client.delete(reverse('api:cuestionario-detail', args=[id_cuestionario]))
+        self.assertIsNone(FotoCuestionario.objects.get().object_id)
+
+        self.assertEqual(self._recolectar()['fotos_marcadas'], 3)
+        self.assertEqual(self._recolectar(gracia=timedelta(0))['fotocuestionario'], 1)
+
+        self.assertFalse(self.foto_cuestionario.foto.storage.exists(self.foto_cuestionario.foto.name))
+
+    def test_simular_reporta_sin_modificar(self):
+        self._recolectar()
+
+        simulado = self._recolectar(gracia=timedelta(0), simular=True)
+
+        self.assertEqual((simulado['fotorespuesta'], simulado['fotocuestionario']), (2, 1))
+        self.assertGreaterEqual(simulado['archivos'], 2)
+        self.assertGreater(simulado['bytes'], 0)
+        self.assertEqual(FotoRespuesta.objects.count(), 2)
+        self.assertTrue(self.foto_inspeccion1.foto.storage.exists(self.foto_inspeccion1.foto.name))
+        self.assertEqual(self._recolectar(gracia=timedelta(0)), simulado)
+
+    def test_borra_las_subidas_abandonadas(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        with override_settings(INSPECCIONES_DIRECTORIO_SUBIDAS=directorio):
+            response = self.client.post(reverse('api:subida-foto-list'),
+                                        {'destino': 'inspeccion', 'nombre': 'foto.png', 'tamano': 10},
+                                        format='json')
+            subida = SubidaDeFoto.objects.get(pk=response.data['id'])
+            self.assertTrue(os.path.exists(ruta_parcial(subida)))
+
+            self.assertEqual(self._recolectar()['subidas'], 0)
+            self.assertEqual(self._recolectar(gracia=timedelta(0))['subidas'], 1)
+
+            self.assertFalse(SubidaDeFoto.objects.exists())
+            self.assertFalse(os.path.exists(ruta_parcial(subida)))
+
+    def test_comando(self):
+        call_command('recolectar_fotos', '--simular', stdout=io.StringIO())
+        self.assertFalse(FotoRespuesta.objects.filter(huerfana_desde__isnull=False).exists())
+
+        call_command('recolectar_fotos', '--horas-de-gracia', '1', stdout=io.StringIO())
+        self.assertEqual(FotoRespuesta.objects.filter(huerfana_desde__isnull=False).count(), 2)
@@ -0,0 +1,74 @@
+import uuid
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class ReporteInspeccionTest(InspeccionesAuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def _crear_inspeccion_con_filas(self, n_filas):
+        """Una cuadricula de seleccion multiple con [n_filas] filas de dos partes, mas una respuesta numerica"""
+        id_cuadricula, id_subpregunta, id_numerica, id_opcion = (uuid.uuid4() for _ in range(4))
+        _, id_cuestionario = self.crear_cuestionario([
+            {'n_orden': 1, 'pregunta': {
+                'id': id_cuadricula, 'titulo': 'cuadricula', 'descripcion': '', 'criticidad': 1,
+                'etiquetas': [{'clave': 'sistema', 'valor': 'motor'}], 'tipo_de_pregunta': 'cuadricula',
+                'tipo_de_cuadricula': 'seleccion_multiple',
+                'opciones_de_respuesta': [{'id': id_opcion, 'titulo': 'fuga', 'descripcion': '', 'criticidad': 3,
+                                           'requiere_criticidad_del_inspector': False}],
+                'preguntas': [{'id': id_subpregunta, 'titulo': 'fila', 'descripcion': '', 'criticidad': 1,
+                               'tipo_de_pregunta': 'parte_de_cuadricula'}]}},
+            {'n_orden': 2, 'pregunta': {
+                'id': id_numerica, 'titulo': 'presion', 'descripcion': '', 'criticidad': 2,
+                'tipo_de_pregunta': 'numerica', 'unidades': 'psi',
+                'criticidades_numericas': [{'id': uuid.uuid4(), 'criticidad': 4, 'valor_minimo': 0,
+                                            'valor_maximo': 10}]}},
+        ])
+        sin_fotos = {'fotos_base': [], 'fotos_reparacion': []}
+        parte = self._build_respuesta(None, tipo_de_respuesta='parte_de_seleccion_multiple', **sin_fotos,
+                                      opcion_respondida=id_opcion, opcion_respondida_esta_seleccionada=True,
+                                      criticidad_calculada=3, criticidad_calculada_con_reparaciones=3)
+        fila = self._build_respuesta(id_subpregunta, tipo_de_respuesta='seleccion_multiple', **sin_fotos,
+                                     subrespuestas_multiple=[parte, parte],
+                                     criticidad_calculada=6, criticidad_calculada_con_reparaciones=6)
+        _, id_inspeccion = self.crear_inspeccion(id_cuestionario, respuestas=[
+            self._build_respuesta(id_cuadricula, tipo_de_respuesta='cuadricula', **sin_fotos,
+                                  subrespuestas_cuadricula=[fila] * n_filas),
+            self._build_respuesta(id_numerica, tipo_de_respuesta='numerica', valor_numerico=5,
+                                  criticidad_calculada=8, criticidad_calculada_con_reparaciones=8),
+        ])
+        return id_inspeccion
+
+    def test_tarjetas_del_reporte(self):
+        id_inspeccion = self._crear_inspeccion_con_filas(2)
+
+        response = self.client.get(reverse('inspeccion-detail', args=[id_inspeccion]))
+
+        self.assertEqual(response.status_code, 200)
+        tarjetas = response.context['reporte']['todas']
+        self.assertEqual([tarjeta['pregunta'] for tarjeta in tarjetas], ['presion', 'fila', 'fila'])
+        self.assertEqual(tarjetas[0]['detalles'][0]['criticidad_respuesta'], 4)
+        self.assertEqual(len(tarjetas[0]['detalles'][0]['fotos_base']), 1)
+        self.assertEqual(tarjetas[1]['titulo_cuadricula'], 'cuadricula')
+        self.assertEqual(tarjetas[1]['etiquetas'], [])
+        self.assertEqual([detalle['opcion'] for detalle in tarjetas[1]['detalles']], ['fuga', 'fuga'])
+        self.assertEqual(response.context['grupos'], {'reparadas': 0, 'pendiente': 3, 'sinNovedad': 0, 'todas': 3})
+
+    def test_reporte_de_300_respuestas_en_menos_de_10_consultas(self):
+        # 100 filas de seleccion multiple con dos partes cada una son 300 respuestas, mas la cuadricula y la numerica
+        id_inspeccion = self._crear_inspeccion_con_filas(100)
+
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('inspeccion-detail', args=[id_inspeccion]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['reporte']['todas']), 101)
+        # sin contar la sesion ni el usuario: el perfil y la organizacion del menu, la inspeccion, las etiquetas del
+        # cuestionario, el arbol de respuestas, sus fotos, las etiquetas de las preguntas y las criticidades numericas
+        self.assertLess(len([c for c in consultas if 'inspecciones_' in c['sql']]), 10)
@@ -0,0 +1,66 @@
+import uuid
+from datetime import timedelta
+
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from inspecciones.models import Activo, EtiquetaJerarquicaDeActivo, Eliminacion
+from inspecciones.sincronizacion import nuevo_token, purgar_lapidas, RETENCION_LAPIDAS
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class SincronizacionTest(InspeccionesAuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.otro_activo = Activo.objects.create(id=uuid.uuid4(), identificador='a2', organizacion=self.organizacion)
+        EtiquetaJerarquicaDeActivo.objects.create(nombre='sistema', json={}, organizacion=self.organizacion)
+        # todo lo anterior se modifico hace un dia
+        hace_un_dia = timezone.now() - timedelta(days=1)
+        Activo.objects.update(momento_modificacion=hace_un_dia)
+        EtiquetaJerarquicaDeActivo.objects.update(momento_modificacion=hace_un_dia)
+
+    def _sincronizar(self, **tokens):
+        response = self.client.get(reverse('api:sincronizacion-list'), tokens)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_sin_token_entrega_todo(self):
+        datos = self._sincronizar()
+
+        self.assertEqual(len(datos['activos']['cambiados']), 2)
+        self.assertEqual(len(datos['etiquetas_activos']['cambiados']), 1)
+        self.assertEqual(datos['cuestionarios']['eliminados'], [])
+        self.assertIsNotNone(datos['activos']['token'])
+
+    def test_con_token_entrega_solo_los_cambios_y_las_lapidas(self):
+        token = nuevo_token(timezone.now() - timedelta(hours=1))
+        self.activo.identificador = 'a1 modificado'
+        self.activo.save()
+        id_borrado = str(self.otro_activo.id)
+        self.otro_activo.delete()
+
+        datos = self._sincronizar(activos=token, etiquetas_activos=token)
+
+        self.assertEqual([activo['identificador'] for activo in datos['activos']['cambiados']], ['a1 modificado'])
+        self.assertEqual(datos['activos']['eliminados'], [id_borrado])
+        self.assertEqual(datos['etiquetas_activos']['cambiados'], [])
+        self.assertEqual(datos['etiquetas_activos']['eliminados'], [])
+
+    def test_token_invalido(self):
+        response = self.client.get(reverse('api:sincronizacion-list'), {'activos': 'ayer'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('activos', response.data)
+
+    def test_token_anterior_a_la_retencion_de_lapidas(self):
+        self.otro_activo.delete()
+        Eliminacion.objects.update(momento=timezone.now() - 2 * RETENCION_LAPIDAS)
+
+        response = self.client.get(reverse('api:sincronizacion-list'),
+                                   {'activos': nuevo_token(timezone.now() - 2 * RETENCION_LAPIDAS)})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('vencido', str(response.data['activos']))
+        self.assertEqual(purgar_lapidas(), 1)
+        self.assertFalse(Eliminacion.objects.exists())
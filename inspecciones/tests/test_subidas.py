@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+
+from inspecciones.models import FotoRespuesta, SubidaDeFoto, Trabajo, Perfil
+from inspecciones.subidas import finalizar_subida, ruta_parcial
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class SubidaPorPartesTest(InspeccionesAuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directorio = tempfile.mkdtemp()
+        configuracion = override_settings(INSPECCIONES_DIRECTORIO_SUBIDAS=self.directorio)
+        configuracion.enable()
+        self.addCleanup(configuracion.disable)
+        with open('media/perfil.png', 'rb') as archivo:
+            self.contenido = archivo.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio)
+        super().tearDown()
+
+    def _crear(self, **datos):
+        response = self.client.post(reverse('api:subida-foto-list'),
+                                    {'destino': 'inspeccion', 'nombre': 'foto.png', 'tamano': len(self.contenido),
+                                     **datos}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def _enviar(self, id_subida, inicio, fin, contenido=None):
+        return self.client.put(reverse('api:subida-foto-detail', args=[id_subida]),
+                               self.contenido[inicio:fin + 1] if contenido is None else contenido,
+                               content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f'bytes {inicio}-{fin}/{len(self.contenido)}')
+
+    def _finalizar(self, id_subida):
+        return self.client.post(reverse('api:subida-foto-finalizar', args=[id_subida]))
+
+    def test_subida_por_partes_retomada_despues_de_un_corte(self):
+        subida = self._crear()
+        mitad = len(self.contenido) // 2
+
+        # la conexion se corta y de la primera mitad solo llegan 100 bytes
+        response = self._enviar(subida['id'], 0, mitad - 1, self.contenido[:100])
+        self.assertEqual(response.data['recibidos'], 100)
+        recibidos = self.client.get(reverse('api:subida-foto-detail', args=[subida['id']])).data['recibidos']
+        self._enviar(subida['id'], recibidos, mitad - 1)
+        response = self._enviar(subida['id'], mitad, len(self.contenido) - 1)
+        self.assertEqual(response.data['recibidos'], len(self.contenido))
+
+        response = self._finalizar(subida['id'])
+
+        self.assertEqual(response.status_code, 200, response.data)
+        foto = FotoRespuesta.objects.get(pk=response.data['foto'])
+        with foto.foto.open('rb') as archivo:
+            self.assertEqual(archivo.read(), self.contenido)
+        # comparte el archivo de las fotos del setUp, que tienen el mismo contenido
+        self.assertEqual(foto.foto.name, self.foto_inspeccion1.foto.name)
+        self.assertTrue(Trabajo.objects.filter(tipo='procesar_fotos', parametros__ids=[str(foto.pk)]).exists())
+        # finalizar otra vez responde la misma foto
+        self.assertEqual(self._finalizar(subida['id']).data['foto'], str(foto.pk))
+
+    def test_finalizar_con_la_subida_desactualizada_no_crea_otra_foto(self):
+        subida = self._crear()
+        self._enviar(subida['id'], 0, len(self.contenido) - 1)
+        # la lee antes de que otra peticion la finalice
+        desactualizada = SubidaDeFoto.objects.get(pk=subida['id'])
+        foto = self._finalizar(subida['id']).data['foto']
+
+        finalizar_subida(desactualizada)
+
+        self.assertEqual(str(desactualizada.foto), foto)
+        self.assertEqual(FotoRespuesta.objects.filter(hash_subida=self.foto_inspeccion1.hash_subida).count(), 3)
+
+    def test_archivo_parcial_perdido_reinicia_la_subida(self):
+        subida = self._crear()
+        self._enviar(subida['id'], 0, len(self.contenido) - 1)
+        os.remove(ruta_parcial(SubidaDeFoto.objects.get(pk=subida['id'])))
+
+        response = self._finalizar(subida['id'])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('byte 0', response.data['detail'])
+        self.assertEqual(self.client.get(reverse('api:subida-foto-detail', args=[subida['id']])).data['recibidos'], 0)
+        self._enviar(subida['id'], 0, len(self.contenido) - 1)
+        self.assertEqual(self._finalizar(subida['id']).status_code, 200)
+
+    def test_parte_despues_de_lo_recibido(self):
+        subida = self._crear()
+
+        response = self._enviar(subida['id'], 10, 19)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['recibidos'], 0)
+
+    def test_finalizar_incompleta_o_invalida(self):
+        incompleta = self._crear()
+        self._enviar(incompleta['id'], 0, 9)
+        self.assertEqual(self._finalizar(incompleta['id']).status_code, 400)
+
+        invalida = self._crear(tamano=4)
+        self.client.put(reverse('api:subida-foto-detail', args=[invalida['id']]), b'hola',
+                        content_type='application/octet-stream', HTTP_CONTENT_RANGE='bytes 0-3/4')
+        response = self._finalizar(invalida['id'])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('imagen', response.data['detail'])
+
+    def test_hash_conocido_no_necesita_bytes(self):
+        subida = self._crear(hash=self.foto_inspeccion1.hash_subida)
+
+        self.assertEqual(subida['recibidos'], len(self.contenido))
+        foto = FotoRespuesta.objects.get(pk=subida['foto'])
+        self.assertEqual(foto.foto.name, self.foto_inspeccion1.foto.name)
+
+    def test_solo_el_creador_ve_su_subida(self):
+        subida = self._crear()
+        otro = get_user_model().objects.create_user(username='otro', password='otro')
+        Perfil.objects.create(user=otro, celular='1', organizacion=self.organizacion, rol=Perfil.Roles.inspector)
+        self.client.force_authenticate(user=otro)
+
+        self.assertEqual(self._enviar(subida['id'], 0, 9).status_code, 404)
@@ -0,0 +1,128 @@
+import uuid
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from inspecciones import tablero
+from inspecciones.models import Cuestionario, Inspeccion, Perfil
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+
+
+class TableroTest(InspeccionesAuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.cuestionario = Cuestionario.objects.create(
+            id=uuid.uuid4(), tipo_de_inspeccion='diaria', version=1, periodicidad_dias=1,
+            organizacion=self.organizacion, estado=Cuestionario.EstadoDeCuestionario.finalizado)
+
+    def _crear_inspeccion(self, criticidad):
+        return Inspeccion.objects.create(
+            id=str(uuid.uuid4()), cuestionario=self.cuestionario, activo=self.activo,
+            momento_inicio='2020-01-01T00:00:00Z', estado=Inspeccion.EstadoDeInspeccion.borrador,
+            criticidad_calculada=criticidad, criticidad_calculada_con_reparaciones=criticidad)
+
+    def _crear_usuarios(self, cantidad):
+        for i in range(cantidad):
+            user = get_user_model().objects.create_user(username=f'u{i}', password='u')
+            Perfil.objects.create(user=user, celular='1', organizacion=self.organizacion, rol=Perfil.Roles.inspector)
+
+    def _cargar_tablero(self):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('mi-organizacion'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(consultas)
+
+    def test_estadisticas_de_inspecciones(self):
+        self._crear_inspeccion(0)
+        self._crear_inspeccion(4)
+
+        response, _ = self._cargar_tablero()
+
+        self.assertEqual(response.context['inspecciones'],
+                         {'total': 2, 'sinNovedad': 1, 'promedio': 2.0, 'atrasadas': 0})
+
+    def test_la_cache_se_invalida_al_guardar_una_inspeccion(self):
+        _, consultas_sin_cache = self._cargar_tablero()
+        _, consultas_con_cache = self._cargar_tablero()
+        self.assertLess(consultas_con_cache, consultas_sin_cache)
+
+        # la cache se borra cuando se confirma la transaccion
+        with self.captureOnCommitCallbacks(execute=True):
+            self._crear_inspeccion(0)
+        response, _ = self._cargar_tablero()
+        self.assertEqual(response.context['inspecciones']['total'], 1)
+
+    def test_otro_proceso_no_sirve_datos_viejos(self):
+        # una cache en memoria es distinta en cada proceso y nunca veria la invalidacion de los demas
+        otro_proceso = caches.create_connection('default')
+        self.assertNotIsInstance(otro_proceso, LocMemCache)
+        with mock.patch('inspecciones.tablero.cache', otro_proceso):
+            self.assertEqual(tablero.datos_del_tablero(self.organizacion)['total'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._crear_inspeccion(0)
+
+        with mock.patch('inspecciones.tablero.cache', otro_proceso):
+            self.assertEqual(tablero.datos_del_tablero(self.organizacion)['total'], 1)
+
+    def test_una_lectura_concurrente_no_deja_datos_viejos_en_cache(self):
+        calcular = tablero.calcular_tablero
+
+        def calcular_durante_un_cambio(organizacion):
+            datos = calcular(organizacion)
+            # otra transaccion confirma un cambio despues de la consulta y antes de guardar en cache
+            with self.captureOnCommitCallbacks(execute=True):
+                self._crear_inspeccion(0)
+            return datos
+
+        with mock.patch('inspecciones.tablero.calcular_tablero', calcular_durante_un_cambio):
+            self.assertEqual(tablero.datos_del_tablero(self.organizacion)['total'], 0)
+
+        self.assertEqual(tablero.datos_del_tablero(self.organizacion)['total'], 1)
+
+    def test_las_estadisticas_se_invalidan_desde_otro_proceso(self):
+        estados = tablero.estadisticas_del_tablero(self.organizacion)['estados']
+        self.assertEqual(estados[Inspeccion.EstadoDeInspeccion.borrador], 0)
+
+        # el cambio lo hace otro proceso, por ejemplo el trabajador de tareas
+        with mock.patch('inspecciones.tablero.cache', caches.create_connection('default')):
+            with self.captureOnCommitCallbacks(execute=True):
+                self._crear_inspeccion(0)
+
+        estados = tablero.estadisticas_del_tablero(self.organizacion)['estados']
+        self.assertEqual(estados[Inspeccion.EstadoDeInspeccion.borrador], 1)
+
+    def test_lista_de_usuarios_no_depende_del_numero_de_usuarios(self):
+        self._cargar_tablero()  # llena la cache de las estadisticas
+        _, consultas_un_usuario = self._cargar_tablero()
+        self._crear_usuarios(10)
+        response, consultas_once_usuarios = self._cargar_tablero()
+
+        self.assertEqual(len(response.context['usuarios']), 11)
+        self.assertEqual(consultas_un_usuario, consultas_once_usuarios)
+
+    def test_datos_de_las_graficas(self):
+        (_, id_cuestionario), id_pregunta, id_opcion, id_subpregunta = \
+            self.crear_cuestionario_con_pregunta_de_cuadricula()
+        fila = self._build_respuesta(id_subpregunta, tipo_de_respuesta='seleccion_unica', opcion_seleccionada=id_opcion,
+                                     fotos_base=[], fotos_reparacion=[])
+        self.crear_inspeccion(id_cuestionario, respuestas=[self._build_respuesta(
+            id_pregunta, tipo_de_respuesta='cuadricula', subrespuestas_cuadricula=[
+                {**fila, 'criticidad_calculada': 2, 'reparado': True}, {**fila, 'criticidad_calculada': 2},
+                {**fila, 'criticidad_calculada': 0}])])
+
+        with CaptureQueriesContext(connection) as consultas:
+            estado, criticidad, reparaciones = self.client.get(reverse('chart_data')).json()
+
+        self.assertEqual([punto['y'] for punto in estado['series'][0]['data']], [0, 1, 0])
+        self.assertEqual(criticidad['xAxis']['categories'], [0, 2])
+        self.assertEqual([punto['y'] for punto in criticidad['series'][0]['data']], [1, 2])
+        self.assertEqual([punto['y'] for punto in reparaciones['series'][0]['data']], [1, 1])
+        # el perfil, la organizacion y una consulta agrupada por grafica
+        self.assertEqual(len([c for c in consultas if 'inspecciones_' in c['sql']]), 5)
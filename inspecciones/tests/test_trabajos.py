@@ -0,0 +1,138 @@
+import os
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils import timezone
+
+from inspecciones.models import Trabajo
+from inspecciones.tests.test_classes import InspeccionesAuthenticatedTestCase
+from inspecciones.trabajos import tarea, encolar, procesar_pendientes, reportar_avance, tomar_trabajo, \
+    ejecutar, ErrorPermanente
+
+ejecutados = []
+# las fotos que sube cada test tambien encolan trabajos
+TIPOS = ['prueba', 'prueba_fallida', 'prueba_permanente', 'recalcular_agregados', 'exportar_inspecciones']
+
+
+@tarea('prueba')
+def tarea_de_prueba(trabajo, nombre):
+    ejecutados.append(nombre)
+    reportar_avance(trabajo, 0.5)
+    return {'nombre': nombre}
+
+
+@tarea('prueba_fallida', maximo_intentos=2)
+def tarea_fallida(trabajo):
+    raise ValueError('fallo de prueba')
+
+
+@tarea('prueba_permanente')
+def tarea_con_error_permanente(trabajo):
+    raise ErrorPermanente('parametros invalidos')
+
+
+class TrabajosTest(InspeccionesAuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        ejecutados.clear()
+
+    def tearDown(self):
+        for trabajo in Trabajo.objects.filter(tipo='exportar_inspecciones', estado=Trabajo.Estados.terminado):
+            default_storage.delete(f'exportaciones/{os.path.basename(trabajo.resultado["archivo"])}')
+        super().tearDown()
+
+    def test_se_ejecutan_por_prioridad(self):
+        encolar('prueba', nombre='normal')
+        encolar('prueba', nombre='urgente', prioridad=5)
+        encolar('prueba', nombre='despues')
+
+        self.assertEqual(procesar_pendientes('prueba', TIPOS), 3)
+
+        self.assertEqual(ejecutados, ['urgente', 'normal', 'despues'])
+        trabajo = Trabajo.objects.get(parametros__nombre='urgente')
+        self.assertEqual((trabajo.estado, trabajo.avance, trabajo.resultado, trabajo.intentos),
+                         ('terminado', 1, {'nombre': 'urgente'}, 1))
+
+    def test_reintentos_con_espera(self):
+        trabajo = encolar('prueba_fallida')
+
+        procesar_pendientes('prueba', TIPOS)
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.intentos), ('pendiente', 1))
+        self.assertIn('fallo de prueba', trabajo.error)
+        self.assertGreater(trabajo.disponible_desde, timezone.now())
+        # mientras no pase la espera no se vuelve a tomar
+        self.assertEqual(procesar_pendientes('prueba', TIPOS), 0)
+
+        Trabajo.objects.filter(pk=trabajo.pk).update(disponible_desde=timezone.now() - timedelta(seconds=1))
+        procesar_pendientes('prueba', TIPOS)
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.intentos), ('fallido', 2))
+        self.assertIsNotNone(trabajo.momento_fin)
+
+    def test_error_permanente_no_se_reintenta(self):
+        trabajo = encolar('prueba_permanente')
+        # los filtros se validan al encolar desde la API, aqui ya no son validos
+        exportacion = encolar('exportar_inspecciones', filtros={'formato': 'pdf'})
+
+        procesar_pendientes('prueba', TIPOS)
+
+        for trabajo in [trabajo, exportacion]:
+            trabajo.refresh_from_db()
+            self.assertEqual((trabajo.estado, trabajo.intentos), ('fallido', 1))
+        self.assertIn('formato', exportacion.error)
+
+    def test_retoma_los_trabajos_de_un_trabajador_caido(self):
+        con_intentos = encolar('prueba', nombre='retomado')
+        sin_intentos = encolar('prueba_fallida')
+        Trabajo.objects.filter(pk=sin_intentos.pk).update(intentos=1)
+        tomados = [tomar_trabajo('caido', TIPOS), tomar_trabajo('caido', TIPOS)]
+        self.assertEqual({trabajo.pk for trabajo in tomados}, {con_intentos.pk, sin_intentos.pk})
+        # mientras no venzan nadie mas los toma
+        self.assertIsNone(tomar_trabajo('prueba', TIPOS))
+
+        Trabajo.objects.update(vencimiento=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(procesar_pendientes('prueba', TIPOS), 1)
+
+        con_intentos.refresh_from_db()
+        self.assertEqual((con_intentos.estado, con_intentos.intentos, con_intentos.trabajador),
+                         ('terminado', 2, 'prueba'))
+        sin_intentos.refresh_from_db()
+        self.assertEqual((sin_intentos.estado, sin_intentos.intentos), ('fallido', 2))
+        self.assertIn('dejo de responder', sin_intentos.error)
+        # el trabajador caido ya no puede guardar su intento
+        ejecutar(tomados[0] if tomados[0].pk == con_intentos.pk else tomados[1])
+        con_intentos.refresh_from_db()
+        self.assertEqual(con_intentos.intentos, 2)
+        self.assertEqual(ejecutados, ['retomado', 'retomado'])
+
+    def test_encolar_recalculo_y_consultar_avance(self):
+        response = self.client.post(reverse('api:trabajo-list'), {'tipo': 'recalcular_agregados'}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+        procesar_pendientes('prueba', TIPOS)
+
+        trabajo = self.client.get(reverse('api:trabajo-detail', args=[response.data['id']])).data
+        self.assertEqual((trabajo['estado'], trabajo['avance']), ('terminado', 1))
+        self.assertEqual(trabajo['resultado'], {'inspecciones': 0})
+
+    def test_tipo_no_permitido_desde_la_api(self):
+        response = self.client.post(reverse('api:trabajo-list'), {'tipo': 'importar_activos'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tipo', response.data)
+
+    def test_exportacion_en_segundo_plano(self):
+        (_, id_cuestionario), id_pregunta, id_opcion = self.crear_cuestionario_con_pregunta_de_seleccion_unica()
+        self.crear_inspeccion_con_respuesta_de_seleccion_unica(id_cuestionario, id_pregunta, id_opcion)
+
+        response = self.client.post(reverse('api:inspeccion-completa-exportar'), {'formato': 'ndjson'},
+                                    format='json')
+        self.assertEqual(response.status_code, 202, response.data)
+        procesar_pendientes('prueba', TIPOS)
+
+        trabajo = Trabajo.objects.get(pk=response.data['id'])
+        self.assertEqual(trabajo.estado, 'terminado', trabajo.error)
+        with default_storage.open(f'exportaciones/{os.path.basename(trabajo.resultado["archivo"])}') as archivo:
+            self.assertEqual(len(archivo.read().splitlines()), 1)
@@ -0,0 +1,143 @@
+"""Cola de trabajos en segundo plano sobre la tabla Trabajo, sin un broker externo. Las tareas se registran con el
+decorador [tarea] y se encolan con [encolar]. Los procesos del comando trabajador toman los pendientes por prioridad,
+los ejecutan y los reintentan con una espera creciente si fallan.
+
+Una tarea recibe el trabajo y sus parametros, puede reportar su avance con [reportar_avance] y retorna un resultado
+que se pueda guardar como JSON. Si lanza ErrorPermanente el trabajo falla sin reintentos.
+
+Un trabajo tomado vence despues de INSPECCIONES_VENCIMIENTO_TRABAJOS (timedelta, 30 minutos por defecto) y cada
+reporte de avance lo renueva. Si el trabajador muere sin terminarlo, el siguiente que busque trabajo lo devuelve a la
+cola como un intento fallido"""
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from inspecciones.models import Trabajo
+
+# segundos de espera antes del primer reintento, se duplica en cada intento
+ESPERA_REINTENTO = 30
+
+_TAREAS = {}
+
+
+class ErrorPermanente(Exception):
+    """Fallo que se repetiria en cada intento, como parametros invalidos"""
+
+
+def _vencimiento():
+    return timezone.now() + getattr(settings, 'INSPECCIONES_VENCIMIENTO_TRABAJOS', timedelta(minutes=30))
+
+
+def tarea(nombre, prioridad=0, maximo_intentos=3):
+    """Registra la funcion decorada como la tarea [nombre], con la prioridad y los intentos por defecto de sus
+    trabajos"""
+
+    def registrar(funcion):
+        _TAREAS[nombre] = (funcion, prioridad, maximo_intentos)
+        return funcion
+
+    return registrar
+
+
+def encolar(tipo, organizacion=None, creador=None, prioridad=None, **parametros):
+    """Crea un trabajo pendiente de la tarea [tipo]. Dentro de una transaccion los trabajadores solo lo ven cuando
+    esta se confirma"""
+    _, prioridad_por_defecto, maximo_intentos = _TAREAS[tipo]
+    return Trabajo.objects.create(
+        tipo=tipo, organizacion=organizacion, creador=creador, parametros=parametros, maximo_intentos=maximo_intentos,
+        prioridad=prioridad_por_defecto if prioridad is None else prioridad)
+
+
+def reportar_avance(trabajo, avance):
+    trabajo.avance = min(max(avance, 0), 1)
+    trabajo.vencimiento = _vencimiento()
+    Trabajo.objects.filter(pk=trabajo.pk).update(avance=trabajo.avance, vencimiento=trabajo.vencimiento)
+
+
+def renovar(trabajo):
+    """Aplaza el vencimiento de un trabajo que no sabe calcular su avance"""
+    trabajo.vencimiento = _vencimiento()
+    Trabajo.objects.filter(pk=trabajo.pk).update(vencimiento=trabajo.vencimiento)
+
+
+def nombre_de_trabajador():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def tomar_trabajo(trabajador, tipos=None):
+    """Marca como procesando el siguiente trabajo disponible y lo retorna, None si no hay. La actualizacion
+    condicionada al estado evita que dos trabajadores tomen el mismo aun si la base de datos no bloquea filas"""
+    _retomar_vencidos()
+    while True:
+        with transaction.atomic():
+            disponibles = Trabajo.objects.filter(estado=Trabajo.Estados.pendiente,
+                                                 disponible_desde__lte=timezone.now())
+            if tipos:
+                disponibles = disponibles.filter(tipo__in=tipos)
+            trabajo = disponibles.select_for_update(skip_locked=True) \
+                .order_by('-prioridad', 'disponible_desde', 'momento_creacion').first()
+            if trabajo is None:
+                return None
+            tomado = Trabajo.objects.filter(pk=trabajo.pk, estado=Trabajo.Estados.pendiente).update(
+                estado=Trabajo.Estados.procesando, intentos=F('intentos') + 1, trabajador=trabajador,
+                momento_inicio=timezone.now(), vencimiento=_vencimiento())
+        if tomado:
+            trabajo.refresh_from_db()
+            return trabajo
+
+
+def _retomar_vencidos():
+    """Los trabajos procesando cuyo trabajador no los renovo cuentan como un intento fallido, vuelven a la cola si les
+    quedan intentos. El filtro por estado y vencimiento hace que solo un trabajador retome cada uno"""
+    ahora = timezone.now()
+    vencidos = Trabajo.objects.filter(estado=Trabajo.Estados.procesando, vencimiento__lt=ahora)
+    error = 'El trabajador dejo de responder antes de terminar'
+    vencidos.filter(intentos__lt=F('maximo_intentos')).update(
+        estado=Trabajo.Estados.pendiente, disponible_desde=ahora, vencimiento=None, error=error)
+    vencidos.update(estado=Trabajo.Estados.fallido, vencimiento=None, error=error, momento_fin=ahora)
+
+
+def ejecutar(trabajo):
+    """Ejecuta un trabajo ya tomado y guarda su resultado. Si falla vuelve a quedar pendiente hasta agotar sus
+    intentos, salvo con ErrorPermanente"""
+    funcion, _, _ = _TAREAS[trabajo.tipo]
+    trabajo.vencimiento = None
+    try:
+        resultado = funcion(trabajo, **trabajo.parametros)
+    except Exception as error:
+        trabajo.error = traceback.format_exc()
+        if trabajo.intentos < trabajo.maximo_intentos and not isinstance(error, ErrorPermanente):
+            trabajo.estado = Trabajo.Estados.pendiente
+            trabajo.disponible_desde = timezone.now() + timedelta(
+                seconds=ESPERA_REINTENTO * 2 ** (trabajo.intentos - 1))
+        else:
+            trabajo.estado = Trabajo.Estados.fallido
+            trabajo.momento_fin = timezone.now()
+        _guardar(trabajo, ['estado', 'error', 'disponible_desde', 'momento_fin', 'vencimiento'])
+        return
+    trabajo.estado, trabajo.resultado, trabajo.avance = Trabajo.Estados.terminado, resultado, 1
+    trabajo.momento_fin = timezone.now()
+    _guardar(trabajo, ['estado', 'resultado', 'avance', 'momento_fin', 'vencimiento'])
+
+
+def _guardar(trabajo, campos):
+    # si vencio mientras corria ya se retomo como otro intento, el resultado de este se descarta
+    Trabajo.objects.filter(pk=trabajo.pk, estado=Trabajo.Estados.procesando, intentos=trabajo.intentos) \
+        .update(**{campo: getattr(trabajo, campo) for campo in campos})
+
+
+def procesar_pendientes(trabajador=None, tipos=None, debe_parar=lambda: False):
+    """Ejecuta los trabajos disponibles hasta que no quede ninguno o [debe_parar] lo indique. Retorna cuantos
+    ejecuto"""
+    trabajador = trabajador or nombre_de_trabajador()
+    ejecutados = 0
+    while not debe_parar() and (trabajo := tomar_trabajo(trabajador, tipos)) is not None:
+        ejecutar(trabajo)
+        ejecutados += 1
+    return ejecutados
@@ -18,6 +18,10 @@ router.register(r'activos', views_api.ActivoViewSet, basename='activo')
 router.register(r'cuestionarios', views_api.CuestionarioViewSet, basename='cuestionario')
 router.register(r'cuestionarios-completos', views_api.CuestionarioCompletoViewSet, basename='cuestionario-completo')
 router.register(r'inspecciones-completas', views_api.InspeccionCompletaViewSet, basename='inspeccion-completa')
+router.register(r'sincronizacion', views_api.SincronizacionViewSet, basename='sincronizacion')
+router.register(r'importaciones', views_api.ImportacionViewSet, basename='importacion')
+router.register(r'trabajos', views_api.TrabajoViewSet, basename='trabajo')
+router.register(r'subidas-fotos', views_api.SubidaDeFotoViewSet, basename='subida-foto')
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
@@ -1,13 +1,18 @@
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Q, Avg, Count
-from django.http import HttpResponseRedirect, HttpResponseBadRequest, JsonResponse
+from django.db.models import Q
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.urls import reverse_lazy, reverse
 from django.utils.datastructures import MultiValueDictKeyError
 from django.views.generic import CreateView, UpdateView, DeleteView, ListView, DetailView
 from django.views.generic.base import TemplateResponseMixin, ContextMixin, View
 
+from inspecciones.exportacion import FORMATOS
 from inspecciones.forms import PerfilForm, UserForm, UserEditForm, PerfilEditForm
-from inspecciones.models import Organizacion, Inspeccion, Perfil, Activo, Respuesta
+from inspecciones.models import Organizacion, Inspeccion, Perfil, Respuesta
+from inspecciones.planeacion import planeacion_de_organizacion
+from inspecciones.reporte import construir_reporte
+from inspecciones.serializers import FiltroDeExportacionSerializer
+from inspecciones.tablero import datos_del_tablero, estadisticas_del_tablero
 
 
 class OrganizacionListView(LoginRequiredMixin, ListView):
@@ -18,16 +23,10 @@ class OrganizacionDetailView(LoginRequiredMixin, DetailView):
     model = Organizacion
 
     def get_context_data(self, **kwargs):
-        inspecciones = Inspeccion.objects.filter(
-            cuestionario__organizacion=self.request.user.perfil.organizacion)
         """Agrega todas las caracteristicas."""
         context = {'caracteristicas': Organizacion.Caracteristicas.values,
-                   'inspecciones': {
-                       'total': inspecciones.count(),
-                       'sinNovedad': inspecciones.filter(criticidad_calculada=0).count(),
-                       'atrasadas': 10,
-                       'promedio': inspecciones.aggregate(Avg('criticidad_calculada'))
-                   }}
+                   'inspecciones': datos_del_tablero(self.request.user.perfil.organizacion),
+                   'usuarios': self.object.usuarios.select_related('user')}
         context.update(kwargs)
         return super().get_context_data(**context)
 
@@ -157,47 +156,52 @@ class RegistrationView(TemplateResponseMixin, ContextMixin, View):
 
 class InspeccionListView(LoginRequiredMixin, ListView):
     def get_queryset(self):
+        # los contadores ya estan en cada inspeccion, solo hace falta traer las relaciones que muestra la tabla
         return Inspeccion.objects.filter(cuestionario__organizacion=self.request.user.perfil.organizacion) \
-            .order_by('-momento_inicio')
+            .select_related('activo', 'cuestionario', 'inspector__user').order_by('-momento_inicio')
 
 
+class DescargarInspeccionesView(LoginRequiredMixin, View):
+    """Exporta las inspecciones de la organizacion con sus respuestas. Acepta los filtros del listado de la API y
+    ?formato=csv|xlsx|ndjson"""
+
+    def get(self, request, *args, **kwargs):
+        filtro = FiltroDeExportacionSerializer(data=request.GET)
+        if not filtro.is_valid():
+            return JsonResponse(filtro.errors, status=400)
+        inspecciones = filtro.filtrar(
+            Inspeccion.objects.filter(cuestionario__organizacion=request.user.perfil.organizacion))
+        formato = filtro.validated_data['formato']
+        exportar, content_type = FORMATOS[formato]
+        response = StreamingHttpResponse(exportar(inspecciones), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="inspecciones.{formato}"'
+        return response
+
 
 class InspeccionDetailView(LoginRequiredMixin, DetailView):
     model = Inspeccion
     pk_url_kwarg = 'inspeccion_id'
 
+    def get_queryset(self):
+        return Inspeccion.objects.select_related('activo', 'cuestionario', 'inspector__user') \
+            .prefetch_related('cuestionario__etiquetas_aplicables')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Son las que tienen inspeccionId no nula, de tipo seleccion multiple, seleccion unica
-        # cuadricula y numerica
-        respuestas = context['inspeccion'].respuestas.all().order_by('-criticidad_calculada_con_reparaciones')
-        idsRespuestas = context['inspeccion'].respuestas.values_list('id', flat=True)
-        # Son las respuestas padre de cada pregunta de la cuadricula
-        respuestasCuadricula = Respuesta.objects.filter(respuesta_cuadricula__id__in=idsRespuestas)
-        respuestasCuadriculaIds = respuestasCuadricula.values_list('id', flat=True)
-        # Incluye las subrespuestas de las preguntas cuadricula multiple y de seleccion multiple
-        respuestasMultiples = Respuesta.objects.filter(
-            Q(respuesta_multiple__id__in=idsRespuestas) | Q(respuesta_multiple__id__in=respuestasCuadriculaIds),
-            opcion_respondida_esta_seleccionada=True)
-        context.update({'respuestasMultiples': respuestasMultiples})
-        # Aqui se excluyen las respuestas generales de las preguntas tipo cuadricula.
-        respuestas = respuestas.exclude(tipo_de_respuesta='cuadricula') | respuestasCuadricula
-        context.update({'respuestas': respuestas})
-        reparadas = respuestas.filter(reparado=True).count()
-        pendientes = respuestas.filter(
-            criticidad_calculada_con_reparaciones__gt=0).count()
-        sinNovedad = respuestas.filter(
-            criticidad_calculada=0).count()
-        context.update({'grupos': {'reparadas': reparadas, 'pendiente': pendientes, 'sinNovedad': sinNovedad,
-                                   'todas': reparadas + pendientes + sinNovedad}})
+        # la plantilla recibe las tarjetas ya calculadas, sin consultas por respuesta
+        reporte = construir_reporte(self.object)
+        context.update({'reporte': reporte, 'grupos': reporte['grupos']})
         return context
 
 
 class ActivoListView(LoginRequiredMixin, ListView):
+    template_name = 'inspecciones/activo_list.html'
+    context_object_name = 'activo_list'
+
     def get_queryset(self):
-        activos = Activo.objects.filter(organizacion=self.request.user.perfil.organizacion)
-        print(activos)
-        return activos
+        # sale de la tabla de planeacion en una sola consulta
+        return planeacion_de_organizacion(self.request.user.perfil.organizacion,
+                                          solo_atrasados=self.request.GET.get('atrasados') == '1')
 
 
 def get_chart_template(graphType, data, title, titleSize='16px'):
@@ -240,31 +244,22 @@ def get_sub_respuesta(resp):
 
 
 def chart_data_state(request):
-    dataset = Inspeccion.objects.filter(cuestionario__organizacion=request.user.perfil.organizacion)
-    ids = dataset.values_list('id', flat=True)
-    respuestas = Respuesta.objects.filter(inspeccion__id__in=ids, criticidad_calculada__lte=4)
-    idsRespPadres = respuestas.values_list('id', flat=True)
-    subRespMultiples = Respuesta.objects.filter(respuesta_multiple__id__in=idsRespPadres)
-    unicas = respuestas.filter(tipo_de_respuesta__in=['seleccion_unica', 'numerica'])
-    subRespCuadricula = Respuesta.objects.filter(respuesta_cuadricula__id__in=idsRespPadres,
-                                                 tipo_de_respuesta__in=['seleccion_unica', 'numerica'])
-    subResp = subRespMultiples | unicas | subRespCuadricula
-    respuestasCriticas = subResp.values('criticidad_calculada').annotate(cantidad=Count('criticidad_calculada'))
-    novedades = subResp.filter(criticidad_calculada__gt=0).count()
-    reparadas = subResp.filter(reparado=True).count()
+    estadisticas = estadisticas_del_tablero(request.user.perfil.organizacion)
+    novedades = estadisticas['novedades']
+    reparadas = estadisticas['reparadas']
     dataState = {
         'name': 'Cantidad',
         'data': [{
             "name": 'En reparación',
-            "y": dataset.filter(estado='en_reparacion').count()
+            "y": estadisticas['estados']['en_reparacion']
         },
             {
                 "name": 'Borrador',
-                "y": dataset.filter(estado='borrador').count()
+                "y": estadisticas['estados']['borrador']
             },
             {
                 "name": 'Finalizada',
-                "y": dataset.filter(estado='finalizada').count()
+                "y": estadisticas['estados']['finalizada']
             }
         ]
     }
@@ -284,7 +279,7 @@ def chart_data_state(request):
     dataCriticidad = {
         'name': "Cantidad",
         'colorByPoint': True,
-        'data': list(map(lambda x: {'name': x['criticidad_calculada'], 'y': x['cantidad']}, respuestasCriticas))
+        'data': [{'name': criticidad, 'y': cantidad} for criticidad, cantidad in estadisticas['criticidades']]
     }
     chartState = get_chart_template('pie', dataState, 'Estado de inspecciones')
     chartReparaciones = get_chart_template('pie', dataReparaciones, 'Novedades pendientes vs novedades atendidas',
@@ -295,7 +290,7 @@ def chart_data_state(request):
         'title': {
             'text': 'Criticidad'
         },
-        'categories': list(map(lambda x: x['criticidad_calculada'], respuestasCriticas))
+        'categories': [criticidad for criticidad, _ in estadisticas['criticidades']]
     }
     chartCriticidad['legend'] = {
         'enabled': False
@@ -1,22 +1,41 @@
+import base64
+import json
+
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
+from django.db.models import Prefetch, Q
 from django.http import Http404
 from django.shortcuts import render
-from rest_framework import viewsets, permissions, status
+from django.utils.dateparse import parse_datetime
+from rest_framework import viewsets, permissions, status, mixins
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.parsers import MultiPartParser
 
 from rest_framework.response import Response
 from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 
+from inspecciones.carga_masiva import CargaDeActivos
+from inspecciones.importacion import cargar_filas
+from inspecciones.medios import puede_ver, respuesta_de_archivo
 from inspecciones.mixins import PutAsCreateMixin, CreateAsUpdateMixin
 from inspecciones.models import Perfil, Organizacion, Activo, Cuestionario, Inspeccion, EtiquetaJerarquicaDeActivo, \
-    EtiquetaJerarquicaDePregunta
+    EtiquetaJerarquicaDePregunta, Bloque, Importacion, Trabajo, SubidaDeFoto
 from inspecciones.serializers import PerfilCreateSerializer, \
     OrganizacionSerializer, ActivoSerializer, CuestionarioSerializer, CuestionarioCompletoSerializer, \
     InspeccionCompletaSerializer, PerfilSerializer, \
     SubirFotosCuestionarioSerializer, SubirFotosInspeccionSerializer, EtiquetaJerarquicaDeActivoSerializer, \
-    EtiquetaJerarquicaDePreguntaSerializer
+    EtiquetaJerarquicaDePreguntaSerializer, ParAtrasadoSerializer, InspeccionResumenSerializer, \
+    FiltroDeInspeccionesSerializer, ImportacionSerializer, TrabajoSerializer, FiltroDeExportacionSerializer, \
+    SubidaDeFotoSerializer
+from inspecciones.planeacion import pares_atrasados, recalcular_planeacion_de_organizacion
+from inspecciones.sincronizacion import nuevo_token, leer_token, cambios_desde, TokenVencido
+from inspecciones.subidas import iniciar_subida, leer_rango, escribir_parte, finalizar_subida, ErrorDeSubida, \
+    ParteFueraDeOrden
+from inspecciones.tablero import invalidar_tablero
+from inspecciones.trabajos import encolar
 
 
 class OrganizacionViewSet(viewsets.ModelViewSet):
@@ -112,6 +131,66 @@ class EtiquetaJerarquicaDePreguntaViewSet(CreateAsUpdateMixin, viewsets.ModelVie
     lookup_url_kwarg = 'nombre'
 
 
+class PaginacionPorPagina(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class PaginacionPorCursor(BasePagination):
+    """Paginacion por llave sobre (momento_subida, id), de la inspeccion mas reciente a la mas antigua. Cada pagina
+    continua desde la ultima fila de la anterior, asi su costo no depende de cuantas inspecciones haya"""
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Cursor invalido'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        tamano = self.get_page_size(request)
+        queryset = queryset.order_by('-momento_subida', '-id')
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            momento_subida, id_inspeccion = self.decodificar_cursor(cursor)
+            queryset = queryset.filter(Q(momento_subida__lt=momento_subida) |
+                                       Q(momento_subida=momento_subida, id__lt=id_inspeccion))
+        # una fila de mas dice si hay pagina siguiente sin hacer un count
+        pagina = list(queryset[:tamano + 1])
+        self.siguiente = pagina[tamano - 1] if len(pagina) > tamano else None
+        return pagina[:tamano]
+
+    def get_page_size(self, request):
+        try:
+            tamano = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(tamano, 1), self.max_page_size)
+
+    def decodificar_cursor(self, cursor):
+        try:
+            momento_subida, id_inspeccion = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            momento_subida = parse_datetime(momento_subida)
+        except (TypeError, ValueError):
+            momento_subida = None
+        if momento_subida is None:
+            raise ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+        return momento_subida, id_inspeccion
+
+    def codificar_cursor(self, inspeccion):
+        return base64.urlsafe_b64encode(
+            json.dumps([inspeccion.momento_subida.isoformat(), inspeccion.id]).encode()).decode()
+
+    def get_next_link(self):
+        if self.siguiente is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   self.codificar_cursor(self.siguiente))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+
 class ActivoViewSet(viewsets.ModelViewSet):
 
 
@@ -134,6 +213,95 @@ class ActivoViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, headers=headers)
 
+    @action(detail=False, methods=['post'])
+    def importar(self, request):
+        """Carga masiva con upsert por identificador. Cada fila se valida por separado y las que tienen errores se
+        reportan con su posicion sin detener la carga de las demas"""
+        if not isinstance(request.data, list):
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ['Se esperaba una lista de activos']})
+        organizacion = request.user.perfil.organizacion
+        resumen = cargar_filas(CargaDeActivos(organizacion), enumerate(request.data))
+        # los bulk no emiten señales. Una carga puede tocar casi todos los activos, se recalcula la organizacion
+        # completa que cuesta lo mismo
+        recalcular_planeacion_de_organizacion(organizacion)
+        invalidar_tablero(organizacion.pk)
+        return Response(resumen)
+
+    @action(detail=False, methods=['get'], pagination_class=PaginacionPorPagina)
+    def atrasados(self, request):
+        """Pares (activo, cuestionario) de la organizacion con al menos un dia de retraso, paginados"""
+        pares = pares_atrasados(request.user.perfil.organizacion).order_by(
+            'identificador', 'tipo_de_inspeccion', 'version')
+        pagina = self.paginate_queryset(pares)
+        return self.get_paginated_response(ParAtrasadoSerializer(pagina, many=True).data)
+
+
+class ImportacionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin,
+                         viewsets.GenericViewSet):
+    """Sube un archivo CSV o XLSX de activos y consulta el avance de su importacion, que se procesa por lotes
+    fuera de la peticion"""
+    serializer_class = ImportacionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def get_queryset(self):
+        return Importacion.objects.filter(organizacion=self.request.user.perfil.organizacion) \
+            .order_by('-momento_creacion')
+
+    def perform_create(self, serializer):
+        perfil = self.request.user.perfil
+        importacion = serializer.save(organizacion=perfil.organizacion, creador=perfil)
+        encolar('importar_activos', organizacion=perfil.organizacion, creador=perfil, importacion=str(importacion.pk))
+
+
+class TrabajoViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin,
+                     viewsets.GenericViewSet):
+    """Encola recalculos de la organizacion y consulta el avance de cualquier trabajo en segundo plano de ella"""
+    serializer_class = TrabajoSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Trabajo.objects.filter(organizacion=self.request.user.perfil.organizacion) \
+            .order_by('-momento_creacion')
+
+    def perform_create(self, serializer):
+        perfil = self.request.user.perfil
+        serializer.save(organizacion=perfil.organizacion, creador=perfil)
+
+
+class SubidaDeFotoViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Subida de una foto por partes que se puede retomar, el protocolo esta en inspecciones.subidas. Consultar la
+    subida indica desde que byte continuar"""
+    serializer_class = SubidaDeFotoSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return SubidaDeFoto.objects.filter(creador=self.request.user.perfil)
+
+    def perform_create(self, serializer):
+        iniciar_subida(serializer.save(creador=self.request.user.perfil))
+
+    def update(self, request, *args, **kwargs):
+        """Escribe una parte, el cuerpo son los bytes crudos y no pasa por los parsers"""
+        subida = self.get_object()
+        try:
+            inicio, fin = leer_rango(request.headers.get('Content-Range'), subida.tamano)
+            escribir_parte(subida, inicio, fin, request.stream)
+        except ParteFueraDeOrden as error:
+            return Response({'detail': str(error), 'recibidos': subida.recibidos}, status=status.HTTP_409_CONFLICT)
+        except ErrorDeSubida as error:
+            raise ValidationError({'detail': str(error)})
+        return Response(self.get_serializer(subida).data)
+
+    @action(detail=True, methods=['post'])
+    def finalizar(self, request, pk=None):
+        subida = self.get_object()
+        try:
+            finalizar_subida(subida)
+        except ErrorDeSubida as error:
+            raise ValidationError({'detail': str(error)})
+        return Response(self.get_serializer(subida).data)
+
 
 class CuestionarioViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
@@ -144,24 +312,44 @@ class CuestionarioViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
 
+def _relaciones_de_pregunta(prefijo):
+    return [f'{prefijo}{relacion}' for relacion in
+            ['fotos_guia', 'etiquetas', 'opciones_de_respuesta', 'criticidades_numericas', 'preguntas']]
+
+
 class CuestionarioCompletoViewSet(CuestionarioViewSet):
     serializer_class = CuestionarioCompletoSerializer
 
+    # todo lo que recorre CuestionarioCompletoSerializer, asi la cantidad de consultas no depende del tamaño del
+    # cuestionario. Las preguntas de las cuadriculas tambien pasan por el PreguntaSerializer
+    prefetch = [
+        'etiquetas_aplicables',
+        Prefetch('bloques', queryset=Bloque.objects.select_related('titulo', 'pregunta')),
+        'bloques__titulo__fotos',
+        *_relaciones_de_pregunta('bloques__pregunta__'),
+        *_relaciones_de_pregunta('bloques__pregunta__preguntas__'),
+    ]
+
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related(*self.prefetch)
+
     @action(detail=False, methods=['post'])
     def subir_fotos(self, request):
         serializer = SubirFotosCuestionarioSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        res = serializer.save()
+        res = serializer.save(organizacion_id=request.user.perfil.organizacion_id)
         return Response(res, status=status.HTTP_201_CREATED)
 
-    @transaction.atomic
     def update(self, request, *args, **kwargs):
-        """
-        Hace un update a la berraca, borrando todo y volviendolo a insertar
-        TODO: hacer tests para este metodo"""
+        """Actualiza solo las partes del arbol que cambiaron y agrega a la respuesta el resumen de los cambios"""
+        partial = kwargs.pop('partial', False)
         instance = self.get_object()
-        self.perform_destroy(instance)
-        return self.create(request, *args, **kwargs)
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        # se vuelve a leer con el prefetch para no serializar el arbol fila por fila
+        serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
+        return Response({**serializer.data, 'cambios': getattr(serializer, 'cambios', None)})
 
 
 class InspeccionCompletaViewSet(viewsets.ModelViewSet):
@@ -173,10 +361,107 @@ class InspeccionCompletaViewSet(viewsets.ModelViewSet):
 
     serializer_class = InspeccionCompletaSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PaginacionPorCursor
+
+    def get_serializer_class(self):
+        filtro = getattr(self, 'filtro', None)
+        if self.action == 'list' and filtro is not None and not filtro.validated_data['respuestas']:
+            return InspeccionResumenSerializer
+        return super().get_serializer_class()
+
+    def list(self, request, *args, **kwargs):
+        """Pagina filtrada de inspecciones, sin las respuestas a menos que se pidan con ?respuestas=true"""
+        self.filtro = FiltroDeInspeccionesSerializer(data=request.query_params)
+        self.filtro.is_valid(raise_exception=True)
+        pagina = self.paginate_queryset(self.filtro.filtrar(self.get_queryset()))
+        serializer = self.get_serializer(pagina, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def update(self, request, *args, **kwargs):
+        """Actualiza incrementalmente las respuestas y agrega a la respuesta el resumen de los cambios"""
+        partial = kwargs.pop('partial', False)
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response({**serializer.data, 'cambios': getattr(serializer, 'cambios', None)})
+
+    @action(detail=False, methods=['post'])
+    def exportar(self, request):
+        """Encola la exportacion con los filtros del listado y el formato, el archivo queda en el resultado del
+        trabajo"""
+        filtro = FiltroDeExportacionSerializer(data=request.data)
+        filtro.is_valid(raise_exception=True)
+        perfil = request.user.perfil
+        trabajo = encolar('exportar_inspecciones', organizacion=perfil.organizacion, creador=perfil,
+                          filtros=dict(filtro.data))
+        return Response(TrabajoSerializer(trabajo).data, status=status.HTTP_202_ACCEPTED)
 
     @action(detail=False, methods=['post'])
     def subir_fotos(self, request):
         serializer = SubirFotosInspeccionSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        res = serializer.save()
+        res = serializer.save(organizacion_id=request.user.perfil.organizacion_id)
         return Response(res, status=status.HTTP_201_CREATED)
+
+
+class ArchivoDeMediosView(APIView):
+    """Entrega un archivo de media si el usuario lo puede ver, ver inspecciones.medios. Usa la autenticacion de la
+    API para que la app pueda pedir las fotos con su token"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def perform_content_negotiation(self, request, force=False):
+        # los navegadores piden imagenes con Accept: image/*, la respuesta no pasa por los renderers
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, nombre):
+        if not puede_ver(request.user, nombre):
+            raise Http404
+        return respuesta_de_archivo(request, nombre)
+
+
+class SincronizacionViewSet(viewsets.ViewSet):
+    """Sincronizacion incremental de la app movil. Recibe un token por recurso (?activos=<token>&...) y responde por
+    cada recurso las filas modificadas desde su token, los ids eliminados y el token para la proxima vez. Un recurso
+    sin token se entrega completo"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def recursos(self, organizacion):
+        return {
+            'activos': (Activo.objects.filter(organizacion=organizacion).prefetch_related('etiquetas'),
+                        ActivoSerializer),
+            'cuestionarios': (Cuestionario.objects.filter(organizacion=organizacion).prefetch_related(
+                *CuestionarioCompletoViewSet.prefetch), CuestionarioCompletoSerializer),
+            'etiquetas_activos': (EtiquetaJerarquicaDeActivo.objects.filter(organizacion=organizacion),
+                                  EtiquetaJerarquicaDeActivoSerializer),
+            'etiquetas_preguntas': (EtiquetaJerarquicaDePregunta.objects.filter(organizacion=organizacion),
+                                    EtiquetaJerarquicaDePreguntaSerializer),
+            'inspecciones': (Inspeccion.objects.filter(cuestionario__organizacion=organizacion),
+                             InspeccionResumenSerializer),
+        }
+
+    def list(self, request):
+        organizacion = request.user.perfil.organizacion
+        recursos = self.recursos(organizacion)
+        desde, errores = {}, {}
+        for recurso in recursos:
+            try:
+                desde[recurso] = leer_token(request.query_params.get(recurso))
+            except TokenVencido:
+                errores[recurso] = 'Token de sincronizacion vencido, se debe sincronizar sin token'
+            except ValueError:
+                errores[recurso] = 'Token de sincronizacion invalido'
+        if errores:
+            raise ValidationError(errores)
+
+        # el token se toma antes de leer, lo que cambie durante la lectura llega en la proxima sincronizacion
+        token = nuevo_token()
+        respuesta = {}
+        for recurso, (queryset, serializer_class) in recursos.items():
+            cambiados, eliminados = cambios_desde(queryset, recurso, organizacion, desde[recurso])
+            respuesta[recurso] = {
+                'token': token,
+                'cambiados': serializer_class(cambiados, many=True, context={'request': request}).data,
+                'eliminados': eliminados,
+            }
+        return Response(respuesta)
@@ -103,6 +103,15 @@ DATABASES = {
     }
 }
 
+# Cache compartida por todos los procesos, los workers de gunicorn y el trabajador de tareas, asi la invalidacion que
+# hace uno la ven los demas. La tabla se crea con python manage.py createcachetable
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'cache_compartida',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -13,14 +13,16 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.auth.views import logout_then_login
 from django.http import HttpResponseRedirect
-from django.urls import path, include, reverse, reverse_lazy
+from django.urls import path, re_path, include, reverse, reverse_lazy
 import inspecciones.urls
 import inspecciones.views
+import inspecciones.views_api
 
 
 def redirect_to_default(*args, **kwargs):
@@ -40,10 +42,12 @@ urlpatterns = [
 
                   path('inspecciones/', include([
                       path('', inspecciones.views.InspeccionListView.as_view(), name='inspeccion-list'),
+                      # antes del detalle, que acepta cualquier texto como id
+                      path('descargar_inspecciones/', inspecciones.views.DescargarInspeccionesView.as_view(),
+                           name='descargar_inspecciones'),
                       path('<str:inspeccion_id>/', inspecciones.views.InspeccionDetailView.as_view(),
                            name='inspeccion-detail'),
                       path('estadisticas/', redirect_to_default, name='estadisticas'),
-                      path('descargar_inspecciones/', redirect_to_default, name='descargar_inspecciones'),
                       path('formOtPadre/<str:pk>/', redirect_to_default, name='formOtPadre'),
                   ])),
 
@@ -75,4 +79,7 @@ urlpatterns = [
                            name='usuario-delete'),
                   ])),
 
-              ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+                  # verifica la organizacion y delega el envio al servidor web, ver inspecciones.medios
+                  re_path(r'^%s(?P<nombre>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
+                          inspecciones.views_api.ArchivoDeMediosView.as_view(), name='archivo-de-medios'),
+              ]